@@ -7,33 +7,73 @@ import pandas as pd
 from tqdm import tqdm
 
 
+def rtt_summary(fpath, chunksize=1<<16, k=1000):
+    '''Streaming summary (mmsketch.StreamSummary) of the RTT (ms) in a
+    *_sender_RTT.csv, averaged per second first. The file is read in
+    chunks, so memory doesn't depend on its length; with the default
+    'k' the quantiles are exact for runs of up to ~1000 seconds.
+
+    A *_sender_RTT.npz (from mmpcap) is read at once.
+
+    '''
+    from mmsketch import StreamSummary
+
+    summary = StreamSummary(k)
+
+    if fpath.endswith('.npz'):
+        from mmpcap import load_pcap_series
+
+        timestamp, rtt = load_pcap_series(fpath)
+        seconds, index = np.unique(timestamp.round(), return_inverse=True)
+        summary.update(np.bincount(index, rtt) / np.bincount(index) * 1000)
+        return summary
+
+    # the last second of a chunk may go on in the next one
+    carry = None
+    for chunk in pd.read_csv(fpath, header=None, names=['timestamp', 'rtt'], chunksize=chunksize):
+        groups = chunk.rtt.groupby(chunk.timestamp.values.round()).agg(['sum', 'count'])
+        if carry is not None:
+            if carry.name in groups.index:
+                groups.loc[carry.name] += carry
+            else:
+                summary.update([carry['sum'] / carry['count'] * 1000])
+        carry = groups.iloc[-1]
+        summary.update(groups['sum'].values[:-1] / groups['count'].values[:-1] * 1000)
+
+    if carry is not None:
+        summary.update([carry['sum'] / carry['count'] * 1000])
+
+    return summary
+
+
 def generate_results_table(results_dir, key, savepath=None, append=False):
+    from timing import span
 
-    flist = glob.glob(os.path.join(results_dir, '*_sender_RTT.csv'))
+    # RTT from mmpcap (.npz), or from tshark (.csv) for older runs
+    flist = glob.glob(os.path.join(results_dir, '*_sender_RTT.npz'))
+    flist += [fpath for fpath in glob.glob(os.path.join(results_dir, '*_sender_RTT.csv'))
+              if os.path.splitext(fpath)[0] + '.npz' not in flist]
 
     table = [] # key, tracename, duration, blksize, qsize, mmdelay, avg cap, avg tput, avg util, delay statistics
-    for fpath in tqdm(flist, desc='Parsing all output files in \'{}\''.format(results_dir)):
-        fname = os.path.basename(fpath)
-        trace, rest = fname.split('_T')
-        if '_Q' in rest:
-            duration, blksize, qsize, mmdelay, _ = rest.split('_', 4)
-            qsize = int(float(qsize[1:]))
-        else:
-            duration, blksize, mmdelay, _ = rest.split('_', 3)
-            qsize = None
-        duration = int(duration[1:])
-        mmdelay = int(mmdelay[5:])
+    with span('parse'):
+        for fpath in tqdm(flist, desc='Parsing all output files in \'{}\''.format(results_dir)):
+            fname = os.path.basename(fpath)
+            trace, rest = fname.split('_T')
+            if '_Q' in rest:
+                duration, blksize, qsize, mmdelay, _ = rest.split('_', 4)
+                qsize = int(float(qsize[1:]))
+            else:
+                duration, blksize, mmdelay, _ = rest.split('_', 3)
+                qsize = None
+            duration = int(duration[1:])
+            mmdelay = int(mmdelay[5:])
         
-        df_rtt = pd.read_csv(fpath, header=None, names=['timestamp', 'rtt'])
-        df_rtt.set_index('timestamp', inplace=True)
-        df_rtt['seconds'] = df_rtt.index.values.round()
-        df_rtt = df_rtt.groupby('seconds').mean()
-        df_rtt.loc[:, 'rtt'] = df_rtt.rtt.values * 1000 # convert RTT to milliseconds 
+            rtt = rtt_summary(fpath).stats()
         
-        df_tput = pd.read_csv(fpath.replace('sender_RTT', 'uplink_mmtput'), index_col=[0])
-        df_tput = (df_tput * 8 / 1e6)
+            df_tput = pd.read_csv(os.path.splitext(fpath)[0].replace('sender_RTT', 'uplink_mmtput') + '.csv', index_col=[0])
+            df_tput = (df_tput * 8 / 1e6)
 
-        table.append((key, trace, duration, blksize, qsize, mmdelay, df_tput.capacity_bytes.mean(), df_tput.egress_bytes.mean(), (df_tput.egress_bytes*100 / df_tput.capacity_bytes).mean(), df_rtt.rtt.min(), df_rtt.rtt.max(), df_rtt.rtt.mean(), df_rtt.rtt.std(), df_rtt.rtt.quantile(0.25), df_rtt.rtt.quantile(0.5), df_rtt.rtt.quantile(0.75)))
+            table.append((key, trace, duration, blksize, qsize, mmdelay, df_tput.capacity_bytes.mean(), df_tput.egress_bytes.mean(), (df_tput.egress_bytes*100 / df_tput.capacity_bytes).mean(), rtt['min'], rtt['max'], rtt['mean'], rtt['std'], rtt['q25'], rtt['q50'], rtt['q75']))
 
     df = pd.DataFrame(table, columns=['key', 'trace', 'duration', 'blksize', 'qsize', 'mmdelay', 'capacity', 'throughput', 'utilization', 'delay_min', 'delay_max', 'delay_avg', 'delay_std', 'delay_25', 'delay_50', 'delay_75'])
     df = df.set_index(['key', 'trace', 'duration', 'blksize', 'qsize', 'mmdelay'])
@@ -46,7 +86,8 @@ def generate_results_table(results_dir, key, savepath=None, append=False):
             df_existing = pd.read_csv(savepath, index_col=[0,1,2,3,4,5])
             df = pd.concat([df_existing, df], axis=0)
 
-    df.to_csv(savepath, float_format='%.4f')
+    with span('save'):
+        df.to_csv(savepath, float_format='%.4f')
 
     return df
 
@@ -58,10 +99,20 @@ if __name__ == '__main__':
     parser.add_argument('save_key', help='Name for this group of results (usually name of the CCA)')
     parser.add_argument('--savepath', '-o', help='Path to save the results table')
     parser.add_argument('--append', '-a', action='store_true', help='Append to an existing table (ignored if --savepath is not provided)')
+    parser.add_argument('--manifest', help='Save the timing of every phase (and the rusage) to this JSON manifest')
+    parser.add_argument('--profile', action='store_true', help='Run under cProfile, with the stats next to the manifest (default: next to the table)')
 
     args = parser.parse_args()
 
     if not os.path.exists('results'):
         os.makedirs('results')
 
-    generate_results_table(args.results_dir, args.save_key, savepath=args.savepath, append=args.append)
+    from timing import instrumented
+
+    manifest = args.manifest
+    if manifest is None and args.profile:
+        savepath = args.savepath if args.savepath is not None else os.path.join('results', 'results_{}.csv'.format(args.save_key))
+        manifest = os.path.splitext(savepath)[0] + '_manifest.json'
+
+    with instrumented(manifest, 'make_table', args.profile):
+        generate_results_table(args.results_dir, args.save_key, savepath=args.savepath, append=args.append)
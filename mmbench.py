@@ -0,0 +1,372 @@
+import os
+import json
+import time
+
+# generated datasets: the mm log of the uplink, the trace of its link and
+# what the captures would have given, next to a JSON description
+BENCH_INIT_TIMESTAMP = 1600000000000
+BENCH_BASE_TIMESTAMP = 3
+
+
+def bench_name(duration_s, rate_mbps, seed):
+    return 'bench_R{:g}_T{:g}_seed{}'.format(rate_mbps, duration_s, seed)
+
+
+def _join(*cols):
+    # lines of text from columns (string arrays, or strings for every
+    # line)
+    import numpy as np
+
+    line = cols[0]
+    for col in cols[1:]:
+        line = np.char.add(line, col)
+    return line
+
+
+def generate_mm_log(savedir, duration_s=60, rate_mbps=50, load=1.1, buf_len=150000, n_flows=4, rtt_ms=10, seed=0):
+    '''Write a realistic mm-link log (and the trace of its link) that
+    depends only on the arguments: a link of about 'rate_mbps' that
+    fades in and out, and 'n_flows' flows offering 'load' times that
+    on average, in bursts, through a droptail queue of 'buf_len' bytes
+    (mmqueue.replay(), so the '#', '+', '-' and 'd' events, their order
+    and the queue sizes are those of mm-link). '+' and 'd' events carry
+    a '~flow' suffix, packets are mostly full size.
+
+    Also writes the '_receiver_tput.npz' and '_sender_RTT.npz' series
+    that mmpcap would extract from the captures of such a run (with an
+    RTT of 'rtt_ms' without the queue), so that every plot path has its
+    inputs. Returns the paths and the description of the dataset, also
+    saved as '<name>.json'.
+
+    '''
+    import numpy as np
+    from mmqueue import MM_OPPORTUNITY_BYTES, replay, taken_bytes
+    from mmpcap import save_pcap_series
+
+    rng = np.random.default_rng(seed)
+    duration_ms = int(duration_s * 1000)
+    ms = np.arange(1, duration_ms + 1)
+    name = bench_name(duration_s, rate_mbps, seed)
+    if not os.path.exists(savedir):
+        os.makedirs(savedir)
+
+    # the link: slow fading plus deep fades a few hundred ms long
+    fading = 1 + 0.4 * np.sin(2 * np.pi * ms / rng.uniform(3000, 8000)) * np.sin(2 * np.pi * ms / rng.uniform(500, 1500))
+    fades = np.repeat(rng.random(duration_ms // 250 + 1) < 0.1, 250)[:duration_ms]
+    per_ms = rate_mbps * 1e6 / 8 / MM_OPPORTUNITY_BYTES / 1000 * np.where(fades, 0.1, fading)
+    opportunities = np.repeat(ms, rng.poisson(per_ms))
+    opportunities[-1] = duration_ms
+    # named like the channel traces plot_bgtrace() reads
+    trace = os.path.join(savedir, name + '.trace1')
+    np.savetxt(trace, opportunities, fmt='%d')
+
+    # the traffic: on/off bursts of every flow, mostly full-size packets
+    offered = load * rate_mbps * 1e6 / 8 / 1500 / 1000
+    on = np.repeat(rng.random((n_flows, duration_ms // 100 + 1)) < 0.6, 100, axis=1)[:,:duration_ms]
+    counts = rng.poisson(offered / n_flows / 0.6 * on)
+    arr_ms = np.repeat(np.tile(ms, n_flows), counts.ravel())
+    flow = np.repeat(np.repeat(np.arange(n_flows), duration_ms), counts.ravel())
+    order = np.argsort(arr_ms, kind='stable')
+    arr_ms, flow = arr_ms[order] + BENCH_BASE_TIMESTAMP, flow[order]
+    arr_size = np.where(rng.random(arr_ms.size) < 0.9, 1500, rng.integers(40, 1501, arr_ms.size))
+
+    end_ms = duration_ms + BENCH_BASE_TIMESTAMP
+    r = replay(trace, arr_ms, arr_size, buf_len, False, end_ms, BENCH_BASE_TIMESTAMP)
+    arr_ms, arr_size, accepted, opp, sent = r['arr_ms'], r['arr_size'], r['accepted'], r['opp'], r['sent']
+    flow = flow[:arr_ms.size]
+    departed = r['dep'] < opp.size
+    dep_opp = r['dep'][departed]
+    dep_ms = opp[dep_opp]
+    dep_size = arr_size[accepted][departed]
+    delays = dep_ms - arr_ms[accepted][departed]
+
+    # queue size at the end of every line: after the opportunity (and
+    # its departures), and before an arrival is queued
+    q_opp = r['arrived_before'][np.searchsorted(arr_ms, opp, side='left')] - taken_bytes(r, sent)
+    arr_upto = np.searchsorted(opp, arr_ms, side='right')
+    q_arr = r['arrived_before'][:-1] - taken_bytes(r, np.where(arr_upto > 0, sent[np.maximum(arr_upto - 1, 0)], 0))
+
+    # lines in the order mm-link writes them: at every millisecond the
+    # opportunities (each followed by its departures), then the
+    # arrivals (each followed by its drop)
+    dropped = ~accepted
+    lines = np.concatenate([
+        _join(opp.astype(str), ' # {} '.format(MM_OPPORTUNITY_BYTES), q_opp.astype(str)),
+        _join(dep_ms.astype(str), ' - ', dep_size.astype(str), ' ', delays.astype(str), ' ', q_opp[dep_opp].astype(str)),
+        _join(arr_ms.astype(str), ' + ', arr_size.astype(str), '~', flow.astype(str), ' ', q_arr.astype(str)),
+        _join(arr_ms[dropped].astype(str), ' d 1 ', arr_size[dropped].astype(str), '~', flow[dropped].astype(str), ' ',
+              q_arr[dropped].astype(str))])
+    ms_key = np.concatenate([opp, dep_ms, arr_ms, arr_ms[dropped]])
+    group = np.concatenate([np.zeros(opp.size + dep_ms.size, np.int64), np.ones(arr_ms.size + dropped.sum(), np.int64)])
+    index = np.concatenate([np.arange(opp.size), dep_opp, np.arange(arr_ms.size), np.flatnonzero(dropped)])
+    sub = np.concatenate([np.zeros(opp.size, np.int64), np.ones(dep_ms.size, np.int64),
+                          np.zeros(arr_ms.size, np.int64), np.ones(dropped.sum(), np.int64)])
+    lines = lines[np.lexsort((sub, index, group, ms_key))]
+
+    log = os.path.join(savedir, name + '_uplink.csv')
+    with open(log, 'w') as fout:
+        fout.write('# mahimahi mm-link (uplink) [{}] > {}\n'.format(trace, log))
+        fout.write('# command line: mm-link {0} {0} --uplink-log={1} --uplink-queue=droptail --uplink-queue-args=bytes={2}\n'.format(trace, log, buf_len))
+        fout.write('# queue: droptail [bytes={}]\n'.format(buf_len))
+        fout.write('# init timestamp: {}\n'.format(BENCH_INIT_TIMESTAMP))
+        fout.write('# base timestamp: {}\n'.format(BENCH_BASE_TIMESTAMP))
+        fout.write('\n'.join(lines.tolist()))
+        fout.write('\n')
+
+    # the captures: every departure at the receiver, and an RTT sample
+    # for every other one at the sender
+    unix_s = (BENCH_INIT_TIMESTAMP + dep_ms) / 1000.0
+    save_pcap_series(os.path.join(savedir, name + '_receiver_tput.npz'), unix_s + rtt_ms / 2000.0, dep_size)
+    save_pcap_series(os.path.join(savedir, name + '_sender_RTT.npz'), unix_s[::2] + rtt_ms / 1000.0, (delays[::2] + rtt_ms) / 1000.0)
+
+    dataset = {'name' : name, 'duration_s' : duration_s, 'rate_mbps' : rate_mbps, 'load' : load, 'buf_len' : buf_len,
+               'n_flows' : n_flows, 'rtt_ms' : rtt_ms, 'seed' : seed,
+               'log' : log, 'log_bytes' : os.path.getsize(log), 'log_events' : int(lines.size),
+               'trace' : trace, 'trace_bytes' : os.path.getsize(trace), 'trace_events' : int(opportunities.size)}
+    with open(os.path.join(savedir, name + '.json'), 'w') as fout:
+        json.dump(dataset, fout, indent=1)
+    return dataset
+
+
+def _clear_outputs(dataset):
+    # everything the parsers and plots cache or write next to their
+    # inputs, so that every benchmark starts cold
+    import glob
+    import shutil
+    from mmcache import CACHE_DIRNAME
+
+    savedir = os.path.dirname(dataset['log'])
+    shutil.rmtree(os.path.join(savedir, CACHE_DIRNAME), ignore_errors=True)
+    for suffix in ('_uplink_*', '_uplink.png', '_Mbps.*'):
+        for path in glob.glob(os.path.join(savedir, dataset['name'] + suffix)):
+            os.unlink(path)
+
+
+def _parse_mm_throughput(dataset, engine):
+    from mmparse import parse_mm_throughput
+    parse_mm_throughput(dataset['log'], verbose=False, engine=engine)
+
+
+def _parse_mm_queue_delays(dataset, engine):
+    from mmparse import parse_mm_queue_delays
+    parse_mm_queue_delays(dataset['log'], engine=engine)
+
+
+def _parse_mm_log_simple(dataset, engine):
+    from mmparse import parse_mm_log_simple
+    parse_mm_log_simple(dataset['log'], engine=engine)
+
+
+def _parse_trace_file(dataset, engine):
+    from mmparse import parse_trace_file
+    parse_trace_file(dataset['trace'])
+
+
+def _plot_tput_delay(dataset, engine):
+    from plot import plot_tput_delay
+    plot_tput_delay(dataset['log'], disp=False, save=True)
+
+
+def _plot_tput_delay_tcpdump(dataset, engine):
+    from plot import plot_tput_delay_tcpdump
+    plot_tput_delay_tcpdump(dataset['log'], disp=False, save=True)
+
+
+def _plot_bgtrace(dataset, engine):
+    from plot import plot_bgtrace
+    plot_bgtrace(dataset['name'], os.path.dirname(dataset['trace']))
+
+
+# name: (input, function, engine); the ones with the 'python' engine
+# are slow and only run when asked for
+BENCHMARKS = {'parse_mm_throughput' : ('log', _parse_mm_throughput, 'numpy'),
+              'parse_mm_throughput[python]' : ('log', _parse_mm_throughput, 'python'),
+              'parse_mm_queue_delays' : ('log', _parse_mm_queue_delays, 'numpy'),
+              'parse_mm_queue_delays[python]' : ('log', _parse_mm_queue_delays, 'python'),
+              'parse_mm_log_simple' : ('log', _parse_mm_log_simple, 'numpy'),
+              'parse_mm_log_simple[python]' : ('log', _parse_mm_log_simple, 'python'),
+              'parse_trace_file' : ('trace', _parse_trace_file, None),
+              'plot_tput_delay' : ('log', _plot_tput_delay, None),
+              'plot_tput_delay_tcpdump' : ('log', _plot_tput_delay_tcpdump, None),
+              'plot_bgtrace' : ('trace', _plot_bgtrace, None)}
+
+
+def _bench_child(name, dataset, conn):
+    # one benchmark in a process of its own: cold (nothing cached), then
+    # warm (whatever the first run left behind)
+    import resource
+    import contextlib
+
+    os.environ['MPLBACKEND'] = 'Agg'
+    kind, func, engine = BENCHMARKS[name]
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        # what everything imports, so that it isn't timed
+        import numpy
+        import pandas
+        import mmparse
+        if name.startswith('plot'):
+            import plot
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        _clear_outputs(dataset)
+        t0 = time.perf_counter()
+        func(dataset, engine)
+        cold = time.perf_counter() - t0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        t0 = time.perf_counter()
+        func(dataset, engine)
+        warm = time.perf_counter() - t0
+
+    conn.send({'seconds' : cold, 'warm_seconds' : warm, 'baseline_rss_mb' : baseline / 1024, 'peak_rss_mb' : peak / 1024})
+    conn.close()
+
+
+def run_benchmarks(dataset, names=None, repeat=1, verbose=True):
+    '''Time every benchmark of BENCHMARKS in 'names' (default: all but the
+    'python' engine ones) on a dataset of generate_mm_log(), each in a
+    fresh process, 'repeat' times (the fastest counts). Returns a dict
+    per benchmark with the seconds cold and warm, events and MB of input
+    per second (cold) and the peak RSS (MB, also before it started).
+
+    '''
+    import multiprocessing
+
+    if names is None:
+        names = [name for name, (_, _, engine) in BENCHMARKS.items() if engine != 'python']
+    ctx = multiprocessing.get_context('spawn')
+
+    results = {}
+    for name in names:
+        kind = BENCHMARKS[name][0]
+        runs = []
+        for _ in range(repeat):
+            recv, send = ctx.Pipe(duplex=False)
+            proc = ctx.Process(target=_bench_child, args=(name, dataset, send))
+            proc.start()
+            send.close()
+            try:
+                runs.append(recv.recv())
+            except EOFError:
+                proc.join()
+                raise RuntimeError('benchmark {} failed (exit code {})'.format(name, proc.exitcode))
+            proc.join()
+        best = min(runs, key=lambda run: run['seconds'])
+        best['peak_rss_mb'] = max(run['peak_rss_mb'] for run in runs)
+        best['events_per_s'] = dataset[kind + '_events'] / best['seconds']
+        best['mb_per_s'] = dataset[kind + '_bytes'] / 1e6 / best['seconds']
+        results[name] = best
+        if verbose:
+            print('{:32s} {:8.3f} s (warm {:7.3f} s) {:12.0f} events/s {:8.1f} MB/s {:8.0f} MB peak RSS'.format(
+                name, best['seconds'], best['warm_seconds'], best['events_per_s'], best['mb_per_s'], best['peak_rss_mb']), flush=True)
+
+    return results
+
+
+def _environment():
+    # what the numbers were measured on
+    import sys
+    import platform
+    import subprocess
+    import numpy
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit' : commit, 'time' : time.strftime('%Y-%m-%dT%H:%M:%S'), 'python' : sys.version.split()[0],
+            'numpy' : numpy.__version__, 'machine' : platform.machine(), 'cpus' : os.cpu_count()}
+
+
+def compare(old, new, threshold=0.1):
+    '''Speedup (old / new seconds) and RSS change of the benchmarks in
+    both result files (loaded JSON), and the ones that got slower (or
+    bigger) by more than 'threshold'.
+
+    '''
+    rows, regressions = [], []
+    for name in old['results']:
+        if name not in new['results']:
+            continue
+        a, b = old['results'][name], new['results'][name]
+        speedup = a['seconds'] / b['seconds']
+        rss = b['peak_rss_mb'] / a['peak_rss_mb']
+        rows.append((name, a['seconds'], b['seconds'], speedup, rss))
+        if speedup < 1 / (1 + threshold) or rss > 1 + threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+if __name__ == '__main__':
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmarks of the mm log parsers and plots on generated logs')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    def add_dataset(sub):
+        sub.add_argument('--dir', default=os.path.join('output', 'bench'), help='where the generated data goes (default: output/bench)')
+        sub.add_argument('--duration', '-t', type=float, default=60, help='seconds of the log (default: 60)')
+        sub.add_argument('--rate', type=float, default=50, help='average rate of the link in Mbps (default: 50)')
+        sub.add_argument('--load', type=float, default=1.1, help='offered load relative to the link (default: 1.1)')
+        sub.add_argument('--buf-len', type=int, default=150000, help='droptail buffer in bytes (default: 150000)')
+        sub.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+
+    sub = subparsers.add_parser('generate', help='generate a log (and its trace)')
+    add_dataset(sub)
+
+    sub = subparsers.add_parser('run', help='run the benchmarks, generating the log if needed')
+    add_dataset(sub)
+    sub.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help='benchmarks to run (default: all but the [python] engines)')
+    sub.add_argument('--python', action='store_true', help='also run the [python] engines')
+    sub.add_argument('--repeat', '-r', type=int, default=1, help='runs of every benchmark, the fastest counts (default: 1)')
+    sub.add_argument('--output', '-o', help='JSON file for the results (default: DIR/results-COMMIT-TIME.json)')
+
+    sub = subparsers.add_parser('compare', help='compare two result files')
+    sub.add_argument('old', help='results before')
+    sub.add_argument('new', help='results after')
+    sub.add_argument('--threshold', type=float, default=0.1, help='slowdown or RSS growth that counts as a regression (default: 0.1)')
+
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        with open(args.old) as fin:
+            old = json.load(fin)
+        with open(args.new) as fin:
+            new = json.load(fin)
+        rows, regressions = compare(old, new, args.threshold)
+        print('{:32s} {:>10s} {:>10s} {:>8s} {:>8s}'.format('', old['environment']['commit'] or 'old', new['environment']['commit'] or 'new', 'speedup', 'RSS'))
+        for name, a, b, speedup, rss in rows:
+            print('{:32s} {:9.3f}s {:9.3f}s {:7.2f}x {:7.2f}x{}'.format(name, a, b, speedup, rss, '  <-' if name in regressions else ''))
+        sys.exit(1 if regressions else 0)
+
+    name = bench_name(args.duration, args.rate, args.seed)
+    described = os.path.join(args.dir, name + '.json')
+    dataset = None
+    if args.command == 'run' and os.path.exists(described):
+        with open(described) as fin:
+            dataset = json.load(fin)
+        if (dataset['load'], dataset['buf_len']) != (args.load, args.buf_len):
+            dataset = None
+    if dataset is None:
+        t0 = time.perf_counter()
+        dataset = generate_mm_log(args.dir, args.duration, args.rate, args.load, args.buf_len, seed=args.seed)
+        print('Generated "{}": {} events, {:.1f} MB in {:.1f} s'.format(dataset['log'], dataset['log_events'],
+                                                                       dataset['log_bytes'] / 1e6, time.perf_counter() - t0))
+    if args.command == 'generate':
+        sys.exit(0)
+
+    names = args.only
+    if names is None and args.python:
+        names = list(BENCHMARKS)
+    results = run_benchmarks(dataset, names, args.repeat)
+
+    environment = _environment()
+    output = args.output
+    if output is None:
+        output = os.path.join(args.dir, 'results-{}-{}.json'.format(environment['commit'], environment['time'].replace(':', '')))
+    with open(output, 'w') as fout:
+        json.dump({'environment' : environment, 'dataset' : dataset, 'results' : results}, fout, indent=1)
+    print('Results saved to "{}"'.format(output))
@@ -0,0 +1,144 @@
+import os
+import json
+import hashlib
+
+# bump whenever the content of extract_mm_metrics() changes, so that
+# older cache entries are ignored
+PARSER_VERSION = 1
+
+# the cache lives next to the logs, in a hidden directory
+CACHE_DIRNAME = '.mmcache'
+
+# total size allowed per cache directory; least recently used entries
+# are evicted beyond this
+CACHE_MAX_BYTES = 2 << 30
+
+
+def _cache_key(filepath, kind=None):
+    # a log is identified by where it is, how big it is and when it
+    # was last modified; 'kind' tells apart different things decoded
+    # from the same file
+    st = os.stat(filepath)
+    key = {'path' : os.path.abspath(filepath),
+           'size' : st.st_size,
+           'mtime_ns' : st.st_mtime_ns,
+           'version' : PARSER_VERSION}
+    if kind is not None:
+        key['kind'] = kind
+    return key
+
+
+def cache_path(filepath, key=None, kind=None):
+    if key is None:
+        key = _cache_key(filepath, kind)
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+    cachedir = os.path.join(os.path.dirname(os.path.abspath(filepath)), CACHE_DIRNAME)
+    return os.path.join(cachedir, '{}-{}.npz'.format(os.path.basename(filepath), digest))
+
+
+def load_metrics(filepath, kind=None):
+    '''Metrics of 'filepath' as returned by
+    mmparse.extract_mm_metrics() (or the dict stored under 'kind'), if
+    they are in the cache and the file hasn't changed since. None
+    otherwise.
+
+    '''
+    import numpy as np
+
+    key = _cache_key(filepath, kind)
+    savepath = cache_path(filepath, key)
+    if not os.path.exists(savepath):
+        return None
+
+    try:
+        with np.load(savepath) as npz:
+            if json.loads(str(npz['key'])) != key:
+                return None
+            metrics = json.loads(str(npz['header']))
+            for name in npz.files:
+                if name not in ('key', 'header'):
+                    metrics[name] = npz[name]
+    except (OSError, ValueError, KeyError):
+        # unreadable or partially written entry, just parse again
+        return None
+
+    if 'queue' in metrics:
+        metrics['queue'] = tuple(metrics['queue'])
+
+    # a hit counts as a use for the eviction order (if the entry is
+    # still there and the directory writable, a hit never fails)
+    try:
+        os.utime(savepath)
+    except OSError:
+        pass
+
+    return metrics
+
+
+def save_metrics(filepath, metrics, kind=None):
+    '''Store the output of mmparse.extract_mm_metrics() (or any dict
+    of arrays and JSON values, under 'kind') for 'filepath'. Failing to
+    write the cache (e.g. read-only results directory) is not an error.
+
+    '''
+    import numpy as np
+
+    key = _cache_key(filepath, kind)
+    savepath = cache_path(filepath, key)
+
+    header = {}
+    arrays = {}
+    for name, value in metrics.items():
+        if isinstance(value, np.ndarray):
+            arrays[name] = value
+        else:
+            header[name] = value
+
+    try:
+        os.makedirs(os.path.dirname(savepath), exist_ok=True)
+
+        # write to a temporary file first so that a crash never leaves
+        # a truncated entry under the real name
+        tmppath = savepath + '.{}.tmp'.format(os.getpid())
+        with open(tmppath, 'wb') as fout:
+            np.savez(fout, key=json.dumps(key), header=json.dumps(header), **arrays)
+        os.replace(tmppath, savepath)
+    except OSError:
+        return None
+
+    evict(os.path.dirname(savepath))
+
+    return savepath
+
+
+def evict(cachedir, max_bytes=None):
+    # remove least recently used entries until the directory fits
+    if max_bytes is None:
+        max_bytes = CACHE_MAX_BYTES
+
+    entries = []
+    for name in os.listdir(cachedir):
+        if name.endswith('.npz'):
+            try:
+                st = os.stat(os.path.join(cachedir, name))
+            except OSError:
+                # evicted by another process in the meantime
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+    entries.sort()
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(os.path.join(cachedir, name))
+        except OSError:
+            continue
+        total -= size
+
+    return total
+
+
+def clear(cachedir):
+    return evict(cachedir, max_bytes=0)
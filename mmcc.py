@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+'''Single entry point for the testbed scripts:
+
+  mmcc run ...        run a simulation (runmm.py)
+  mmcc plot ...       make plots (plot.py)
+  mmcc parse ...      parse an mm-link log (mmparse.py)
+  mmcc table ...      make a results table (make_table.py)
+  mmcc gen-trace ...  generate a traffic trace (generate_trace.py)
+  mmcc startup        check the startup time of the commands above
+
+Arguments after the command are those of the script. Nothing heavy
+(numpy, pandas, matplotlib) is imported here; each script imports what
+it needs, and only when it needs it.
+
+'''
+import os
+import sys
+
+COMMANDS = {'run' : 'runmm',
+            'plot' : 'plot',
+            'parse' : 'mmparse',
+            'table' : 'make_table',
+            'gen-trace' : 'generate_trace'}
+
+# seconds from launch to exit, measured on an otherwise idle machine
+# with a warm page cache (the runs themselves exit on argparse errors
+# before starting anything)
+STARTUP_BUDGET = {'run --help' : 0.15,
+                  'run' : 0.15}
+
+
+def headless():
+    # no display to show plots on (e.g. over ssh, or from a sweep)
+    return os.name == 'posix' and sys.platform != 'darwin' and not (os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+
+
+def run_command(command, argv, no_display=False):
+    import runpy
+
+    if no_display or headless():
+        os.environ.setdefault('MPLBACKEND', 'Agg')
+
+    # the scripts expect to be run from the top of the repository
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    module = COMMANDS[command]
+    sys.argv = ['mmcc ' + command] + argv
+    runpy.run_module(module, run_name='__main__', alter_sys=True)
+
+
+def check_startup(repeat=5, budget=None):
+    '''Time 'mmcc <args>' for every entry of the budget (best of
+    'repeat' launches) and print it next to its budget. Returns True if
+    all of them are within budget.
+
+    '''
+    import time
+    import subprocess as sp
+
+    if budget is None:
+        budget = STARTUP_BUDGET
+
+    ok = True
+    for args, limit in budget.items():
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            sp.run([sys.executable, os.path.abspath(__file__)] + args.split(), stdout=sp.DEVNULL, stderr=sp.DEVNULL)
+            times.append(time.perf_counter() - t0)
+        elapsed = min(times)
+        ok = ok and elapsed <= limit
+        print('mmcc {:<12s} {:6.3f} s (budget {:.3f} s){}'.format(args, elapsed, limit, '' if elapsed <= limit else '  OVER BUDGET'))
+
+    return ok
+
+
+def main(argv=None):
+    import argparse
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(prog='mmcc', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--no-display', action='store_true', help='Render plots off-screen (default when there is no display)')
+    parser.add_argument('command', choices=sorted(COMMANDS) + ['startup'])
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='Arguments of the command')
+    args = parser.parse_args(argv)
+
+    if args.command == 'startup':
+        startup_parser = argparse.ArgumentParser(prog='mmcc startup')
+        startup_parser.add_argument('--repeat', type=int, default=5, help='Launches per command, the best one counts (default: 5)')
+        startup_args = startup_parser.parse_args(args.args)
+        return 0 if check_startup(startup_args.repeat) else 1
+
+    run_command(args.command, args.args, args.no_display)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,347 @@
+import os
+
+# congestion controls of the model (the --cc-algo choices)
+FLUID_CC = ('cubic', 'reno', 'bbr')
+
+# bytes of a full packet, and the initial window in packets
+FLUID_PKT_SIZE = 1500
+FLUID_INIT_CWND = 10
+
+# bytes per delivery opportunity of a trace (see mmqueue.py)
+FLUID_OPPORTUNITY_BYTES = 1504
+
+CUBIC_C = 0.4
+CUBIC_BETA = 0.7
+
+# BBR (v1): startup gain, pacing gains of ProbeBW (one per round),
+# rounds of the max filter of the bottleneck bandwidth, and how often
+# and how long ProbeRTT is (ms)
+BBR_HIGH_GAIN = 2.885
+BBR_GAIN_CYCLE = (1.25, 0.75, 1, 1, 1, 1, 1, 1)
+BBR_BW_ROUNDS = 10
+BBR_PROBE_RTT_INTERVAL = 10000
+BBR_PROBE_RTT_MS = 200
+
+# BBR modes
+_STARTUP, _DRAIN, _PROBE_BW, _PROBE_RTT = range(4)
+
+
+def trace_capacity_ms(trace, duration_ms):
+    '''Bytes the link of a mahimahi trace can send in each millisecond
+    of the first 'duration_ms' (the trace repeats like in mm-link), as
+    a float array.
+
+    '''
+    import numpy as np
+    from mmparse import trace_capacity
+
+    per_ms = trace_capacity(trace, ms_per_bin=1, pkt_size=FLUID_OPPORTUNITY_BYTES) / 8
+    if per_ms.size == 0:
+        raise ValueError('{} has no delivery opportunities'.format(trace))
+    return np.resize(per_ms.astype(float), duration_ms)
+
+
+def _fluid_batch(capacity, buf_len, cc, mm_delay, pkt_size=FLUID_PKT_SIZE):
+    '''The model itself, one millisecond at a time for a whole batch of
+    scenarios: 'capacity' is (scenarios, ms) bytes per ms, 'buf_len'
+    (bytes), 'cc' (index into FLUID_CC) and 'mm_delay' (one-way ms)
+    one per scenario.
+
+    A sender with the window of its congestion control sends into the
+    mm-delay of the path, then the droptail queue of the link, which
+    sends up to the capacity every millisecond (from what was queued
+    before that millisecond's arrivals). The bytes that leave are acked
+    'mm_delay' later, drops are noticed 'mm_delay' later (at most one
+    window cut per RTT). Bytes are fluid: a millisecond carries any
+    amount.
+
+    Returns the per-millisecond ingress, egress, dropped bytes and the
+    queue at the end of each millisecond, each (scenarios, ms).
+
+    '''
+    import numpy as np
+
+    n, n_ms = capacity.shape
+    rows = np.arange(n)
+    d = np.asarray(mm_delay, dtype=np.int64)
+    buf_len = np.asarray(buf_len, dtype=float)
+    cc = np.asarray(cc)
+    cubic, bbr = (cc == FLUID_CC.index(name) for name in ('cubic', 'bbr'))
+    loss_based = ~bbr
+    min_cwnd = 2.0 * pkt_size
+    init_cwnd = float(FLUID_INIT_CWND * pkt_size)
+
+    # history, indexed by ms modulo its length: what was sent, left the
+    # queue or was dropped (for the ACKs and loss signals coming back),
+    # the queueing delay, and the bytes acked so far (delivery rate)
+    hist = 1 << max(int(2 * d.max() + 2).bit_length(), 12)
+    sent_h = np.zeros((n, hist))
+    egress_h = np.zeros((n, hist))
+    dropped_h = np.zeros((n, hist))
+    qdelay_h = np.zeros((n, hist))
+    acked_h = np.zeros((n, hist))
+
+    ingress = np.zeros((n, n_ms))
+    egress = np.zeros((n, n_ms))
+    dropped = np.zeros((n, n_ms))
+    queue = np.zeros((n, n_ms))
+
+    cwnd = np.full(n, init_cwnd)
+    ssthresh = np.full(n, np.inf)
+    inflight = np.zeros(n)
+    q = np.zeros(n)
+    acked_total = np.zeros(n)
+    last_cut = np.full(n, -np.inf)
+    cap_avg = capacity[:,0].copy()
+
+    # cubic: window before the last cut, when it was and the time to get
+    # back to it (s)
+    w_max = np.zeros(n)
+    epoch = np.zeros(n)
+    k_cubic = np.zeros(n)
+
+    # bbr
+    mode = np.full(n, _STARTUP)
+    btlbw = np.zeros(n)
+    rtprop = np.full(n, np.inf)
+    rtprop_stamp = np.zeros(n)
+    probe_rtt_end = np.zeros(n)
+    round_end = np.zeros(n)
+    round_max = np.zeros(n)
+    bw_rounds = np.zeros((n, BBR_BW_ROUNDS))
+    rounds = np.zeros(n, dtype=np.int64)
+    full_bw = np.zeros(n)
+    full_cnt = np.zeros(n, dtype=np.int64)
+    filled_pipe = np.zeros(n, dtype=bool)
+    cycle = np.zeros(n, dtype=np.int64)
+    gain_cycle = np.array(BBR_GAIN_CYCLE)
+
+    for t in range(n_ms):
+        back = (t - d) % hist
+        now = t % hist
+
+        # what comes back after the delay of the path: ACKs of what left
+        # the queue, and losses
+        acked = np.where(t >= d, egress_h[rows, back], 0.0)
+        lost = np.where(t >= d, dropped_h[rows, back], 0.0)
+        inflight = np.maximum(inflight - acked - lost, 0.0)
+        acked_total += acked
+        acked_h[:,now] = acked_total
+        rtt = 2 * d + qdelay_h[rows, back]
+        got_ack = acked > 0
+
+        # loss based: one cut per RTT, growth on ACKs
+        cut = loss_based & (lost > 0) & (t - last_cut >= rtt)
+        if cut.any():
+            w_max = np.where(cut & cubic, cwnd, w_max)
+            epoch = np.where(cut & cubic, t, epoch)
+            k_cubic = np.where(cut & cubic, np.cbrt(w_max / pkt_size * (1 - CUBIC_BETA) / CUBIC_C), k_cubic)
+            cwnd = np.where(cut, np.maximum(cwnd * np.where(cubic, CUBIC_BETA, 0.5), min_cwnd), cwnd)
+            ssthresh = np.where(cut, cwnd, ssthresh)
+            last_cut = np.where(cut, t, last_cut)
+        grow = loss_based & got_ack & ~cut
+        slow_start = cwnd < ssthresh
+        avoidance = cwnd + pkt_size * acked / cwnd
+        target = (CUBIC_C * ((t - epoch) / 1000.0 - k_cubic) ** 3) * pkt_size + w_max
+        avoidance = np.where(cubic, np.maximum(avoidance, np.minimum(target, 1.5 * cwnd)), avoidance)
+        cwnd = np.where(grow, np.where(slow_start, cwnd + acked, avoidance), cwnd)
+
+        # bbr: delivery rate over the last min RTT, windowed max of it
+        # over the last rounds, min RTT over the last 10 s
+        if bbr.any():
+            span = np.clip(np.where(np.isfinite(rtprop), rtprop, 2 * d), 1, hist - 1).astype(np.int64)
+            rate = (acked_total - np.where(t >= span, acked_h[rows, (t - span) % hist], 0.0)) / span
+            round_max = np.maximum(round_max, rate)
+
+            expired = t - rtprop_stamp > BBR_PROBE_RTT_INTERVAL
+            update = got_ack & ((rtt <= rtprop) | expired)
+            rtprop = np.where(update, rtt, rtprop)
+            rtprop_stamp = np.where(update & ~expired, t, rtprop_stamp)
+            to_probe_rtt = bbr & expired & (mode != _PROBE_RTT) & np.isfinite(rtprop)
+            mode = np.where(to_probe_rtt, _PROBE_RTT, mode)
+            probe_rtt_end = np.where(to_probe_rtt, t + np.maximum(BBR_PROBE_RTT_MS, rtprop), probe_rtt_end)
+            done = (mode == _PROBE_RTT) & (t >= probe_rtt_end)
+            mode = np.where(done, np.where(filled_pipe, _PROBE_BW, _STARTUP), mode)
+            rtprop_stamp = np.where(done, t, rtprop_stamp)
+
+            new_round = bbr & (t >= round_end)
+            if new_round.any():
+                bw_rounds[new_round, rounds[new_round] % BBR_BW_ROUNDS] = round_max[new_round]
+                rounds += new_round
+                round_max = np.where(new_round, 0.0, round_max)
+                round_end = np.where(new_round, t + span, round_end)
+                cycle = np.where(new_round & (mode == _PROBE_BW), (cycle + 1) % len(gain_cycle), cycle)
+            btlbw = np.maximum(bw_rounds.max(axis=1), round_max)
+
+            # the pipe is full once the bandwidth grows less than 25 %
+            # for three rounds
+            check = new_round & (mode == _STARTUP)
+            grew = btlbw >= 1.25 * full_bw
+            full_bw = np.where(check & grew, btlbw, full_bw)
+            full_cnt = np.where(check, np.where(grew, 0, full_cnt + 1), full_cnt)
+            to_drain = check & (full_cnt >= 3)
+            filled_pipe |= to_drain
+            mode = np.where(to_drain, _DRAIN, mode)
+            bdp = btlbw * np.where(np.isfinite(rtprop), rtprop, 2 * d)
+            mode = np.where((mode == _DRAIN) & (inflight <= bdp), _PROBE_BW, mode)
+
+            pacing_gain = np.choose(mode, [BBR_HIGH_GAIN, 1 / BBR_HIGH_GAIN, gain_cycle[cycle], 1.0])
+            cwnd_gain = np.where(mode == _PROBE_BW, 2.0, BBR_HIGH_GAIN)
+            bbr_cwnd = np.where(mode == _PROBE_RTT, 4.0 * pkt_size, np.maximum(cwnd_gain * bdp, init_cwnd))
+            cwnd = np.where(bbr, bbr_cwnd, cwnd)
+            pace = np.where(bbr & (btlbw > 0), pacing_gain * btlbw, np.inf)
+        else:
+            pace = np.inf
+
+        # the sender
+        send = np.clip(cwnd - inflight, 0.0, pace)
+        inflight += send
+        sent_h[:,now] = send
+
+        # the link: what was queued goes first, then what arrives now
+        # (after the delay of the path) is queued or dropped
+        c = capacity[:,t]
+        out = np.minimum(q, c)
+        q -= out
+        arrived = sent_h[rows, back]
+        q += arrived
+        drop = np.maximum(q - buf_len, 0.0)
+        q -= drop
+        cap_avg += (c - cap_avg) / 100
+
+        egress_h[:,now] = out
+        dropped_h[:,now] = drop
+        qdelay_h[:,now] = q / np.maximum(cap_avg, 1.0)
+        ingress[:,t] = arrived
+        egress[:,t] = out
+        dropped[:,t] = drop
+        queue[:,t] = q
+
+    return ingress, egress, dropped, queue
+
+
+def _fifo_delays(ingress, egress, dropped):
+    # queueing delay (ms) of the bytes leaving in every millisecond
+    # with any: how long ago the queue had received as many bytes as
+    # have left by then
+    import numpy as np
+
+    arrived = np.cumsum(ingress - dropped)
+    left = np.cumsum(egress)
+    ms = np.flatnonzero(egress > 0)
+    since = np.searchsorted(arrived, left[ms] - 1e-6, side='left')
+    return ms, ms - since
+
+
+def simulate_fluid(scenarios, duration_ms=60000, batch=256, verbose=True):
+    '''Run the fluid model of _fluid_batch() for the scenarios, dicts
+    with the 'trace', 'buf_len' (bytes), 'cc' (one of FLUID_CC) and
+    'mm_delay' (one-way, ms), 'batch' of them at a time.
+
+    Returns a list of dicts like mmparse.extract_mm_metrics() does for
+    the mm log of a real run, one per scenario: mmparse.mm_log_simple()
+    gives the per-millisecond DataFrame of parse_mm_log_simple(), and
+    delays are one per millisecond with traffic leaving the queue.
+
+    '''
+    import numpy as np
+    from tqdm import tqdm
+
+    capacities = {}
+    results = []
+    for first in tqdm(range(0, len(scenarios), batch), desc='Fluid model', disable=not verbose):
+        part = scenarios[first:first + batch]
+        for s in part:
+            if s['trace'] not in capacities:
+                capacities[s['trace']] = trace_capacity_ms(s['trace'], duration_ms)
+            if s['cc'] not in FLUID_CC:
+                raise ValueError('unknown congestion control {} (one of {})'.format(s['cc'], ', '.join(FLUID_CC)))
+        capacity = np.stack([capacities[s['trace']] for s in part])
+        ingress, egress, dropped, queue = _fluid_batch(capacity, [s['buf_len'] for s in part], [FLUID_CC.index(s['cc']) for s in part],
+                                                       [s['mm_delay'] for s in part])
+
+        ticks = np.arange(1, duration_ms + 1, dtype=np.int64)
+        for j, s in enumerate(part):
+            delay_ms, delays = _fifo_delays(ingress[j], egress[j], dropped[j])
+            results.append({'init_timestamp' : 0,
+                            'base_timestamp' : 0,
+                            'queue' : ('droptail', 'bytes', s['buf_len']),
+                            'ms' : ticks,
+                            'ingress' : ingress[j],
+                            'egress' : egress[j],
+                            'dropped' : dropped[j],
+                            'capacity' : capacity[j],
+                            'queue_bytes' : queue[j],
+                            'delay_ms' : ticks[delay_ms],
+                            'delays' : delays})
+    return results
+
+
+def fluid_grid(traces, buf_lens, ccs=FLUID_CC, mm_delays=(5,)):
+    # every combination, as scenarios for simulate_fluid()
+    import itertools
+
+    return [{'trace' : trace, 'buf_len' : buf_len, 'cc' : cc, 'mm_delay' : mm_delay}
+            for trace, buf_len, cc, mm_delay in itertools.product(traces, buf_lens, ccs, mm_delays)]
+
+
+def fluid_summary(scenarios, results):
+    '''Estimated throughput (Mbps), utilization, loss, queue and delay of
+    every scenario from the results of simulate_fluid(), as a DataFrame
+    indexed by trace, buffer, cc and delay.
+
+    '''
+    from pandas import DataFrame
+    from mmqueue import queue_summary
+
+    rows = []
+    for s, metrics in zip(scenarios, results):
+        row = {'trace' : os.path.basename(s['trace']), 'buf_len' : s['buf_len'], 'cc' : s['cc'], 'mm_delay' : s['mm_delay'],
+               'tput_Mbps' : metrics['egress'].sum() * 8 / 1e3 / metrics['ms'].size}
+        row.update(queue_summary(metrics))
+        rows.append(row)
+
+    return DataFrame(rows).set_index(['trace', 'buf_len', 'cc', 'mm_delay'])
+
+
+def screen_fluid(scenarios, duration_ms=60000, batch=256, verbose=True):
+    # simulate_fluid() and fluid_summary() in one go
+    return fluid_summary(scenarios, simulate_fluid(scenarios, duration_ms, batch, verbose))
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Fluid model of cubic, reno and bbr over channel traces, to screen settings before emulating them')
+    parser.add_argument('traces', nargs='+', help='mahimahi traces')
+    parser.add_argument('--buf-len', type=int, nargs='+', required=True, help='droptail buffer sizes (bytes)')
+    parser.add_argument('--cc-algo', nargs='+', choices=FLUID_CC, default=list(FLUID_CC), help='congestion controls (default: all)')
+    parser.add_argument('--mm-delay', type=int, nargs='+', default=[5], help='one-way delays of mm-delay (ms, default: 5)')
+    parser.add_argument('--duration', '-t', type=float, default=60, help='seconds of every run (default: 60)')
+    parser.add_argument('--batch', type=int, default=256, help='scenarios simulated together (default: 256)')
+    parser.add_argument('--output', '-o', help='CSV to write (default: print)')
+    parser.add_argument('--save-tables', metavar='DIR', help='also write the per-millisecond table of every scenario (_parsed.txt format) here')
+    args = parser.parse_args()
+
+    scenarios = fluid_grid(args.traces, args.buf_len, args.cc_algo, args.mm_delay)
+    duration_ms = int(args.duration * 1000)
+
+    t0 = time.perf_counter()
+    results = simulate_fluid(scenarios, duration_ms, args.batch)
+    if args.save_tables is not None:
+        from mmparse import mm_log_simple, write_mm_table
+
+        if not os.path.exists(args.save_tables):
+            os.makedirs(args.save_tables)
+        for s, metrics in zip(scenarios, results):
+            name = '{}_buf{}_{}_delay{:02d}_fluid_parsed.txt'.format(os.path.basename(s['trace']), s['buf_len'], s['cc'], s['mm_delay'])
+            write_mm_table(os.path.join(args.save_tables, name), *mm_log_simple(metrics))
+    df = fluid_summary(scenarios, results)
+    print('{} scenarios in {:.1f} s'.format(len(scenarios), time.perf_counter() - t0), file=sys.stderr)
+
+    if args.output is not None:
+        df.to_csv(args.output)
+    else:
+        print(df.to_string())
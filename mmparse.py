@@ -1,24 +1,82 @@
 import os
 
+# decoded traces, shared by everything in this process that reads
+# them (they are also kept in the on-disk cache, see mmcache.py)
+_TRACE_CACHE = {}
+
+
+def load_trace(filename, cache=True):
+    '''Packet delivery opportunities of a mahimahi trace: one
+    timestamp (ms) per line, as an int64 array in file order.
+
+    With 'cache', the decoded array is kept in memory and in the cache
+    directory next to the trace, for as long as the trace is unchanged.
+
+    '''
+    import numpy as np
+
+    if not cache:
+        return np.fromfile(filename, dtype=np.int64, sep=' ')
+
+    import mmcache
+    
+    st = os.stat(filename)
+    memo_key = (os.path.abspath(filename), st.st_size, st.st_mtime_ns)
+    if memo_key in _TRACE_CACHE:
+        return _TRACE_CACHE[memo_key]
+
+    cached = mmcache.load_metrics(filename, kind='trace')
+    if cached is not None:
+        opportunities = cached['opportunities']
+    else:
+        opportunities = np.fromfile(filename, dtype=np.int64, sep=' ')
+        mmcache.save_metrics(filename, {'opportunities' : opportunities}, kind='trace')
+
+    # shared, so nobody gets to modify it
+    opportunities.flags.writeable = False
+    _TRACE_CACHE[memo_key] = opportunities
+    
+    return opportunities
+
+
+def trace_capacity(filename, ms_per_bin=1000, pkt_size=1492, cache=True):
+    '''Capacity of a mahimahi trace in bits per bin of 'ms_per_bin'
+    ms (any width from 1 ms up), as an int64 array. Bin i covers the
+    opportunities at (i*ms_per_bin, (i+1)*ms_per_bin] ms, so that a
+    trace that runs until exactly N seconds has N full 1 s bins;
+    opportunities at 0 ms count towards the first bin. Bins without
+    any opportunity are 0, and the last bin may be partial.
+
+    '''
+    import numpy as np
+
+    opportunities = load_trace(filename, cache)
+    if opportunities.size == 0:
+        return np.zeros(0, np.int64)
+    
+    bin_i = np.maximum(opportunities - 1, 0) // ms_per_bin
+
+    return np.bincount(bin_i) * (pkt_size * 8)
+
+
 # parsing a trace file
-def parse_trace_file(filename, pkt_size=1492):
-    f1 = open (filename,"r")
-    BW = []
-    nextTime = 1000
-    cnt = 0
-    for line in f1:
-        #print line
-        if int(line.strip()) > nextTime:
-            BW.append(cnt*pkt_size*8)
-            cnt = 0
-            nextTime+=1000
-        else:
-            cnt+=1
-    f1.close()
-    return BW
+def parse_trace_file(filename, pkt_size=1492, ms_per_bin=1000):
+    # bits per bin of the trace as a list (see trace_capacity())
+    return trace_capacity(filename, ms_per_bin, pkt_size).tolist()
+
+
+def parse_mm_queue_delays(filepath, engine='numpy'):
+    # per-departure queueing delay (ms) and the time the packet
+    # entered the queue (seconds since the base timestamp)
+    if engine == 'python':
+        return _parse_mm_queue_delays_loop(filepath)
+    elif engine == 'numpy':
+        return mm_queue_delays(extract_mm_metrics(filepath, verbose=False))
+    else:
+        raise ValueError('engine should be \'python\' or \'numpy\'')
 
 
-def parse_mm_queue_delays(filepath):
+def _parse_mm_queue_delays_loop(filepath):
     base_timestamp = 0
     delays = []
     delaytimes = []
@@ -40,11 +98,19 @@ def parse_mm_queue_delays(filepath):
     return delays, delaytimes
 
 
-def parse_mm_throughput(filepath, ms_per_bin=1000, verbose=True):
+def parse_mm_throughput(filepath, ms_per_bin=1000, verbose=True, engine='numpy'):
+    # capacity, ingress and throughput (Mbps) in bins of 'ms_per_bin'
+    if engine == 'python':
+        return _parse_mm_throughput_loop(filepath, ms_per_bin, verbose)
+    elif engine == 'numpy':
+        return pyramid_throughput(mm_pyramid(filepath, verbose=verbose), ms_per_bin)
+    else:
+        raise ValueError('engine should be \'python\' or \'numpy\'')
+
+
+def _parse_mm_throughput_loop(filepath, ms_per_bin=1000, verbose=True):
     
     from tqdm import tqdm
-    from numpy import asarray
-    from pandas import DataFrame, Index
     
     # data contains (ms, cap, arr, dep)
     init_timestamp = None
@@ -103,6 +169,13 @@ def parse_mm_throughput(filepath, ms_per_bin=1000, verbose=True):
             t.close()
     
     # end of loop
+
+    return _mm_throughput_result(data, ms_index, ms_per_bin, init_timestamp, ms_elapsed, cap_total, arr_total, dep_total)
+
+
+def _mm_throughput_result(data, ms_index, ms_per_bin, init_timestamp, ms_elapsed, cap_total, arr_total, dep_total):
+    from numpy import asarray
+    from pandas import DataFrame, Index
     
     # compute avg cap, ingress and tput
     cap_avg_Mbps = (cap_total / ms_elapsed) / 1000.0
@@ -131,8 +204,7 @@ def parse_mm_throughput(filepath, ms_per_bin=1000, verbose=True):
     return result_dict
 
 
-def parse_mm_log_simple(mmfilepath):
-    from pandas import DataFrame, Index
+def _parse_mm_log_loop(mmfilepath):
     from tqdm import tqdm
     import numpy as np
     import re
@@ -259,31 +331,1045 @@ def parse_mm_log_simple(mmfilepath):
     mm_qsize.append(qsize_ms_last)
     mm_capacity.append(cap_ms_last)
 
-    res = np.vstack((mm_times, mm_ingress, mm_egress, mm_dropped, mm_capacity, mm_qsize)).astype(np.float).T
+    res = np.vstack((mm_times, mm_ingress, mm_egress, mm_dropped, mm_capacity, mm_qsize)).astype(float).T
+
+    return res, mm_init_timestamp, (q_type, qsize_unit, qsize_limit)
+
+
+MM_BLOCK_SIZE = 1 << 22 # bytes read at a time by the numpy engine
+
+
+def _parse_mm_header(line, header):
+    import re
+    
+    # same rules as the line-by-line loops: the init and base
+    # timestamps and the queue information are of interest
+    if line.startswith('# base timestamp'):
+        header['base_timestamp'] = int(line.split(':')[-1])
+    elif 'init timestamp:' in line:
+        header['init_timestamp'] = int(line.split(':')[1])
+    elif 'queue:' in line:
+        match = re.match('# queue: (\w+)\s*(\[(\w+)=(\d+)\])?', line).groups()
+        q_type, qsize_unit, qsize_limit = match[0], match[2], header['queue'][2]
+        if q_type != 'infinite':
+            qsize_limit = int(match[3])
+        header['queue'] = (q_type, qsize_unit, qsize_limit)
+
+
+def _iter_mm_blocks(filepath, block_size=MM_BLOCK_SIZE, verbose=True, start=0, end=None):
+    # yield chunks of the file (or of bytes [start, end), which should
+    # be line boundaries) that always end at a line boundary. The file
+    # is memory-mapped and a chunk is a view into it, so only the pages
+    # being worked on need to be resident
+    import mmap
+    from tqdm import tqdm
+
+    with open(filepath, 'rb') as fin:
+        size = os.fstat(fin.fileno()).st_size
+        if end is not None:
+            size = min(size, end)
+        if size <= start:
+            return
+        mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    if verbose:
+        t = tqdm(total=size - start, desc='Parsing the mm log', unit='B', unit_scale=True)
+
+    try:
+        pos = start
+        released = start - start % mmap.PAGESIZE
+        while pos < size:
+            cut = mm.rfind(b'\n', pos, min(pos + block_size, size)) + 1
+            if cut == 0:
+                # a line longer than a block
+                cut = mm.find(b'\n', pos, size) + 1
+            if cut == 0:
+                # last line without a newline
+                block = mm[pos:size] + b'\n'
+                cut = size
+            else:
+                block = memoryview(mm)[pos:cut]
+            try:
+                yield block
+            finally:
+                if isinstance(block, memoryview):
+                    block.release()
+            # done with these pages, don't keep them in our footprint
+            done = cut - cut % mmap.PAGESIZE
+            if done > released and hasattr(mm, 'madvise'):
+                mm.madvise(mmap.MADV_DONTNEED, released, done - released)
+                released = done
+            if verbose:
+                t.update(cut - pos)
+            pos = cut
+    finally:
+        mm.close()
+        if verbose:
+            t.close()
+
+
+class _MMBlock(object):
+    
+    def __init__(self, block):
+        '''Field positions of the event lines in a block of complete
+        mm log lines. Comment lines are kept aside as text in
+        'comments', and event lines with less than three fields are
+        ignored.
+
+        '''
+        import numpy as np
+        
+        buf = np.frombuffer(block, np.uint8)
+
+        # the block with the newline before it, and padding that lets us
+        # read a few bytes past the last field without bounds checks:
+        # byte i of the block is self._buf[i + 1]
+        self._buf = np.concatenate((np.full(1, ord('\n'), np.uint8), buf, np.full(24, ord('\n'), np.uint8)))
+
+        # space, tab, newline and carriage return all sit at or below
+        # ' ', and so does the newline before the block
+        ws = np.empty(buf.size + 1, bool)
+        ws[0] = True
+        np.less_equal(buf, ord(' '), out=ws[1:])
+
+        # start of every whitespace separated field (a non-blank byte
+        # right after a blank one), and which ones start a line
+        start = np.flatnonzero(ws[:-1] > ws[1:])
+        first = np.flatnonzero(self._buf[start] == ord('\n'))
+
+        # mm-link never indents a line: every line (the block ends with
+        # a newline) is either empty or has a field right at its start;
+        # empty lines are only counted when there is any doubt
+        nl = buf == ord('\n')
+        n_lines = np.count_nonzero(nl)
+        if first.size != n_lines and first.size + np.count_nonzero(nl[1:] & nl[:-1]) + int(nl[0]) != n_lines:
+            raise ValueError('indented lines in the mm log, use engine=\'python\'')
+        n_fields = np.diff(np.append(first, start.size))
+
+        # comment lines are handed back as text and left out
+        self.comments = []
+        head = start[first]
+        comment = buf[head] == ord('#')
+        for s in head[comment]:
+            e = s + int(np.argmax(buf[s:] == ord('\n')))
+            self.comments.append(bytes(block[s:e]).decode())
+        event = (n_fields >= 3) & ~comment
+
+        self.start = start
+        self.first = first[event]
+        self.n_fields = n_fields[event]
+        self.n = self.first.size
+        self._pos_cache = {0 : head[event], 1 : start[1:][self.first]}
+        self.op = buf[self._pos_cache[1]]
+
+    def _pos(self, field, rows=None):
+        if rows is None:
+            if field not in self._pos_cache:
+                self._pos_cache[field] = self._pos(field, slice(None))
+            return self._pos_cache[field]
+        first = self.first[rows]
+        if field < 0:
+            n_fields = self.n_fields[rows]
+            return self.start[first + n_fields + field]
+        # (the view saves adding 'field' to every index)
+        return self.start[field:][first]
+    
+    def _words(self):
+        # every byte offset of the block viewed as the start of a
+        # little-endian 64-bit word
+        import numpy as np
+
+        return np.ndarray((self._buf.size - 8,), '<u8', self._buf, offset=1, strides=(1,))
+
+    def values(self, field, rows=None):
+        '''Integer value of the leading digits of a field ('1500~xyz'
+        reads as 1500). A negative field counts from the end of the
+        line. 'rows' selects a subset of the event lines.
+
+        '''
+        import numpy as np
+        
+        # the first 8 bytes of every field at once, one row per byte
+        pos = self._pos(field, rows)
+        digits = self._words()[pos].view(np.uint8).reshape(-1, 8).T.copy()
+        digits -= np.uint8(ord('0'))
+
+        # 9 digits fit in 32 bits, which are faster to work with
+        values = np.zeros(pos.size, np.int32)
+        more = np.ones(pos.size, bool)
+        for j in range(19):
+            if j == 9:
+                values = values.astype(np.int64)
+            digit = digits[j] if j < 8 else self._buf[pos + j + 1] - np.uint8(ord('0'))
+            more &= digit <= 9
+            if not more.any():
+                break
+            # plain arithmetic beats masked ufuncs: the rows that are
+            # done get x1 + 0
+            values *= np.where(more, values.dtype.type(10), values.dtype.type(1))
+            values += digit * more
+        return values.astype(np.int64, copy=False)
+
+    def ts_changed(self):
+        '''True for the event lines whose timestamp text differs from
+        the previous line (always True for the first line). The first
+        8 raw bytes are compared instead of parsing every timestamp,
+        so a change may be reported where there is none (e.g. extra
+        spaces, or longer timestamps), but a real one is never missed.
+
+        '''
+        import numpy as np
+
+        words = self._words()
+        masks = np.array([(1 << (8 * k)) - 1 for k in range(9)], np.uint64)
+
+        # the timestamp plus the whitespace before the op
+        pos = self._pos(0)
+        width = self._pos(1) - pos
+        key = words[pos] & masks[np.minimum(width, 8)]
+
+        changed = np.ones(self.n, bool)
+        changed[1:] = (key[1:] != key[:-1]) | (width[1:] > 8)
+        return changed
+
+
+def _reduce_mm_block(blk):
+    # collapse the events of a block into one entry per distinct
+    # millisecond: (ms, ingress, egress, dropped, capacity, queue size
+    # after the last event), and pick out every departure: (ms, delay)
+    import numpy as np
+
+    starts = np.flatnonzero(blk.ts_changed())
+    ms = blk.values(0, starts)
+    same = np.concatenate(([False], ms[1:] == ms[:-1]))
+    starts, ms = starts[~same], ms[~same]
+    if np.any(ms[1:] < ms[:-1]):
+        raise ValueError('timestamps in the mm log are not monotonic, use engine=\'python\'')
+    ends = np.append(starts[1:], blk.n) - 1
+
+    # bytes are the 3rd field, except for drops where it's the 4th
+    nbytes = blk.values(2)
+    dropped = np.flatnonzero(blk.op == ord('d'))
+    nbytes[dropped] = blk.values(3, dropped)
+
+    # one bin per (millisecond, op): ingress, egress, dropped,
+    # capacity and a last one for anything else
+    op_codes = np.full(256, 4, np.int64)
+    for j, c in enumerate('+-d#'):
+        op_codes[ord(c)] = j
+    group = np.zeros(blk.n, np.int64)
+    group[starts[1:]] = 1
+    group = np.cumsum(group)
+    sums = np.bincount(group * 5 + op_codes[blk.op], weights=nbytes, minlength=5 * ms.size).reshape(-1, 5)
+    sums = [sums[:,j].astype(np.int64) for j in range(4)]
+    
+    # if the last operation in a millisecond is an addition, then the
+    # queue size isn't updated on the same line, so add it now
+    q_last = blk.values(-1, ends) + np.where(blk.op[ends] == ord('+'), nbytes[ends], 0)
+
+    # departures carry the time they spent in the queue as 4th field
+    departed = np.flatnonzero(blk.op == ord('-'))
+    
+    return [ms] + sums + [q_last], [ms[group[departed]], blk.values(3, departed)]
+
+
+MM_COMPACT_DTYPES = {'ms' : 'int32',
+                     'ingress' : 'uint32',
+                     'egress' : 'uint32',
+                     'dropped' : 'uint32',
+                     'capacity' : 'uint32',
+                     'queue_bytes' : 'uint32',
+                     'delay_ms' : 'int32',
+                     'delays' : 'float32'}
+
+
+def _mm_last_tick(filepath):
+    # timestamp of the last event line, read from the tail of the log
+    with open(filepath, 'rb') as fin:
+        fin.seek(0, os.SEEK_END)
+        fin.seek(max(0, fin.tell() - 4096))
+        for line in reversed(fin.read().splitlines()):
+            fields = line.split()
+            if len(fields) >= 3 and fields[0].isdigit():
+                return int(fields[0])
+    return 0
+
+
+def _extract_mm_metrics_compact(filepath, verbose=True, block_size=MM_BLOCK_SIZE, spill_dir=None):
+    # extract_mm_metrics() with memory bounded by the block size rather
+    # than by the length of the log: per-millisecond columns go into
+    # arrays preallocated from the last tick of the log, departures are
+    # spilled to disk block by block and mapped back at the end
+    import tempfile
+    import numpy as np
+
+    dtypes = MM_COMPACT_DTYPES
+    per_ms_names = ('ms', 'ingress', 'egress', 'dropped', 'capacity', 'queue_bytes')
+    
+    header = {'init_timestamp' : None,
+              'base_timestamp' : 0,
+              'queue' : (None, None, np.inf)}
+
+    # ticks are unique and increasing, so there can't be more of them
+    # than the last one (plus tick 0)
+    n_alloc = _mm_last_tick(filepath) + 1
+    cols = [np.zeros(n_alloc, dtypes[name]) for name in per_ms_names]
+    n_rows = 0
+
+    # the last millisecond of a block may continue in the next one, so
+    # it's held back until the next block has been seen
+    carry = None
+    
+    spill_dir = tempfile.mkdtemp(prefix='mmparse-', dir=spill_dir)
+    spill_paths = [os.path.join(spill_dir, name) for name in ('delay_ms', 'delays')]
+    n_departures = 0
+    try:
+        with open(spill_paths[0], 'wb') as fms, open(spill_paths[1], 'wb') as fdelay:
+            for block in _iter_mm_blocks(filepath, block_size, verbose):
+                blk = _MMBlock(block)
+                for line in blk.comments:
+                    _parse_mm_header(line, header)
+                if blk.n == 0:
+                    continue
+                
+                block_ms, block_departures = _reduce_mm_block(blk)
+                if carry is not None:
+                    if block_ms[0][0] < carry[0]:
+                        raise ValueError('timestamps in the mm log are not monotonic, use engine=\'python\'')
+                    if block_ms[0][0] == carry[0]:
+                        for j in range(1, 5):
+                            block_ms[j][0] += carry[j]
+                    else:
+                        block_ms = [np.concatenate(([c], col)) for c, col in zip(carry, block_ms)]
+                carry = [col[-1] for col in block_ms]
+
+                n_new = block_ms[0].size - 1
+                if n_rows + n_new > n_alloc:
+                    # only if the tail of the log wasn't what it seemed
+                    n_alloc = max(2 * n_alloc, n_rows + n_new)
+                    cols = [np.resize(col, n_alloc) for col in cols]
+                for col, new in zip(cols, block_ms):
+                    col[n_rows:n_rows+n_new] = new[:-1]
+                n_rows += n_new
+
+                block_departures[0].astype(dtypes['delay_ms']).tofile(fms)
+                block_departures[1].astype(dtypes['delays']).tofile(fdelay)
+                n_departures += block_departures[0].size
+
+        if carry is None:
+            raise ValueError('no events found in the mm log')
+
+        if n_rows + 1 > n_alloc:
+            cols = [np.resize(col, n_rows + 1) for col in cols]
+        for col, last in zip(cols, carry):
+            col[n_rows] = last
+        n_rows += 1
+        
+        metrics = dict(header)
+        for name, col in zip(per_ms_names, cols):
+            # copy so that the unused part of the allocation is freed
+            metrics[name] = col[:n_rows].copy() if n_rows < col.size else col
+        del cols
+
+        for name, path in zip(('delay_ms', 'delays'), spill_paths):
+            if n_departures > 0:
+                metrics[name] = np.memmap(path, dtypes[name], mode='r', shape=(n_departures,))
+            else:
+                metrics[name] = np.zeros(0, dtypes[name])
+    finally:
+        # the mappings stay valid after the files are unlinked
+        for path in spill_paths:
+            if os.path.exists(path):
+                os.unlink(path)
+        os.rmdir(spill_dir)
+
+    return metrics
+
+
+def _extract_mm_range(filepath, block_size=MM_BLOCK_SIZE, verbose=True, start=0, end=None):
+    # header lines, and per-block outputs of _reduce_mm_block() for the
+    # bytes [start, end) of the log
+    comments = []
+    per_ms = []
+    departures = []
+    for block in _iter_mm_blocks(filepath, block_size, verbose, start, end):
+        blk = _MMBlock(block)
+        comments += blk.comments
+        if blk.n > 0:
+            block_ms, block_departures = _reduce_mm_block(blk)
+            per_ms.append(block_ms)
+            departures.append(block_departures)
+
+    return comments, per_ms, departures
+
+
+def _split_mm_log(filepath, n):
+    # up to n byte ranges of about the same size, cut right after a
+    # newline
+    size = os.path.getsize(filepath)
+    bounds = [0]
+    with open(filepath, 'rb') as fin:
+        for i in range(1, n):
+            pos = max(size * i // n, bounds[-1])
+            fin.seek(pos)
+            line = fin.readline()
+            pos += len(line)
+            if pos < size and pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _extract_mm_ranges_parallel(filepath, workers, block_size=MM_BLOCK_SIZE, verbose=True):
+    # _extract_mm_range() on 'workers' slices of the log in separate
+    # processes, returned in file order
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from tqdm import tqdm
+
+    # no point in ranges smaller than a block
+    n_blocks = -(-os.path.getsize(filepath) // block_size)
+    ranges = _split_mm_log(filepath, max(1, min(workers, n_blocks)))
+    if len(ranges) == 1:
+        return [_extract_mm_range(filepath, block_size, verbose)]
+
+    results = [None] * len(ranges)
+    with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+        futures = {pool.submit(_extract_mm_range, filepath, block_size, False, start, end) : i
+                   for i, (start, end) in enumerate(ranges)}
+        if verbose:
+            t = tqdm(total=ranges[-1][1], desc='Parsing the mm log', unit='B', unit_scale=True)
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            if verbose:
+                t.update(ranges[i][1] - ranges[i][0])
+        if verbose:
+            t.close()
+
+    return results
+
+
+def extract_mm_metrics(filepath, verbose=True, block_size=MM_BLOCK_SIZE, cache=True, compact=False, workers=1):
+    '''Read an mm-link log once and collect everything the parsers
+    below need:
+
+    init_timestamp, base_timestamp, queue: from the header (queue is
+    (type, size unit, size limit))
+
+    ms: every millisecond tick that has at least one event, as logged
+
+    ingress, egress, dropped, capacity: bytes of '+', '-', 'd' and '#'
+    events at each of those ticks
+
+    queue_bytes: queue size after the last event of the tick
+
+    delay_ms, delays: tick and queueing delay (ms) of every departure
+
+    Timestamps must not go backwards (mm-link never does that).
+
+    With 'cache', the result is kept in a binary sidecar file next to
+    the log (see mmcache.py) and reused for as long as the log stays
+    unchanged.
+
+    With 'compact', the log is processed in a memory-mapped, block by
+    block fashion so that peak memory doesn't grow with the number of
+    events: columns use the small dtypes of MM_COMPACT_DTYPES (which
+    hold up to ~24 days of ticks and 4 GB per millisecond), and
+    delay_ms/delays are read-only memory maps of temporary files.
+    Compact results bypass the cache.
+
+    With 'workers' > 1 (None for one per CPU), the log is split into
+    as many byte ranges which are parsed in separate processes; the
+    result is identical to the serial one.
+
+    '''
+    import numpy as np
+
+    if compact:
+        if workers != 1:
+            raise ValueError('compact parsing is serial, use workers=1')
+        return _extract_mm_metrics_compact(filepath, verbose, block_size)
+
+    if cache:
+        import mmcache
+        metrics = mmcache.load_metrics(filepath)
+        if metrics is not None:
+            if verbose:
+                print('Loaded parsed mm log from cache')
+            return metrics
+
+    header = {'init_timestamp' : None,
+              'base_timestamp' : 0,
+              'queue' : (None, None, np.inf)}
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1:
+        ranges = _extract_mm_ranges_parallel(filepath, workers, block_size, verbose)
+    else:
+        ranges = [_extract_mm_range(filepath, block_size, verbose)]
+
+    # header lines are applied in file order, wherever they were found
+    per_ms = []
+    departures = []
+    for comments, range_ms, range_departures in ranges:
+        for line in comments:
+            _parse_mm_header(line, header)
+        per_ms += range_ms
+        departures += range_departures
+
+    if len(per_ms) == 0:
+        raise ValueError('no events found in the mm log')
+    
+    # stitch the blocks: a millisecond may straddle a block (or range)
+    # boundary, its first part then goes into the last entry of the
+    # block before (blocks are in order within themselves)
+    stitched = [per_ms[0]]
+    for cols in per_ms[1:]:
+        last = stitched[-1]
+        if cols[0][0] < last[0][-1]:
+            raise ValueError('timestamps in the mm log are not monotonic, use engine=\'python\'')
+        if cols[0][0] == last[0][-1]:
+            for j in range(1, 5):
+                last[j][-1] += cols[j][0]
+            last[5][-1] = cols[5][0]
+            cols = [col[1:] for col in cols]
+            if cols[0].size == 0:
+                continue
+        stitched.append(cols)
+    cols = [np.concatenate(col) for col in zip(*stitched)]
+    
+    metrics = dict(header)
+    metrics['ms'] = cols[0]
+    for name, col in zip(('ingress', 'egress', 'dropped', 'capacity'), cols[1:5]):
+        metrics[name] = col
+    metrics['queue_bytes'] = cols[5]
+    metrics['delay_ms'], metrics['delays'] = [np.concatenate(col) for col in zip(*departures)]
+
+    if cache:
+        mmcache.save_metrics(filepath, metrics)
+
+    return metrics
+
+
+def mm_queue_delays(metrics):
+    # same output as parse_mm_queue_delays(), from extract_mm_metrics()
+    delays = metrics['delays'].astype(float)
+    delaytimes = ((metrics['delay_ms'] - metrics['base_timestamp']) - delays) / 1000.0
+    
+    return delays.tolist(), delaytimes.tolist()
+
+
+def mm_delay_summary(metrics, window_ms=None, k=200, chunk=1<<20):
+    '''Queueing delays (ms) of extract_mm_metrics() as a streaming
+    summary (mmsketch.StreamSummary: running moments and a mergeable
+    quantile sketch), for the whole run and, with 'window_ms', for each
+    window of departure time counted from the base timestamp. Delays are
+    read 'chunk' at a time, so memory stays bounded with the memory maps
+    of compact metrics too.
+
+    Returns (summary, {window index: summary} or None).
+
+    '''
+    import numpy as np
+    from mmsketch import StreamSummary
+
+    summary = StreamSummary(k)
+    windows = {} if window_ms is not None else None
+    for i in range(0, metrics['delays'].size, chunk):
+        delays = np.asarray(metrics['delays'][i:i+chunk], dtype=float)
+        summary.update(delays)
+        if windows is not None:
+            window_i = np.maximum(np.asarray(metrics['delay_ms'][i:i+chunk], dtype=np.int64) - metrics['base_timestamp'], 0) // window_ms
+            # departures are in order, so windows are contiguous
+            starts = np.flatnonzero(np.concatenate(([True], window_i[1:] != window_i[:-1])))
+            for start, end in zip(starts, np.append(starts[1:], window_i.size)):
+                windows.setdefault(int(window_i[start]), StreamSummary(k)).update(delays[start:end])
+
+    return summary, windows
+
+
+def parse_mm_delay_summary(filepath, window_ms=None, k=200, compact=False):
+    # mm_delay_summary() straight from a log
+    return mm_delay_summary(extract_mm_metrics(filepath, verbose=False, compact=compact), window_ms, k)
+
+
+def mm_throughput(metrics, ms_per_bin=1000):
+    # same output as parse_mm_throughput(), from extract_mm_metrics()
+    import numpy as np
+
+    # ticks before the base timestamp count towards the first bin
+    ms_elapsed = metrics['ms'] - metrics['base_timestamp']
+    bin_i = np.maximum(ms_elapsed // ms_per_bin, 0)
+    
+    # rows of (cap, arr, dep) in bits, there is always at least bin 0
+    data = np.zeros((bin_i[-1] + 1, 3), np.int64)
+    for j, name in enumerate(('capacity', 'ingress', 'egress')):
+        np.add.at(data[:,j], bin_i, metrics[name].astype(np.int64) * 8)
+
+    totals = [int(data[:,j].sum()) for j in range(3)]
+    
+    return _mm_throughput_result(data, np.arange(data.shape[0]), ms_per_bin, metrics['init_timestamp'], int(ms_elapsed[-1]), *totals)
+
+
+# bin widths (ms) that mm_pyramid() keeps, any multiple of the first
+# one can be derived from them
+MM_PYRAMID_LEVELS = (1, 10, 100, 500, 1000)
+
+
+def build_mm_pyramid(metrics, levels=MM_PYRAMID_LEVELS):
+    '''Per-bin series of the output of extract_mm_metrics() at several
+    bin widths (ms, multiples of the first one), all derived from one
+    series at the finest width. Bins are counted from the base
+    timestamp like in mm_throughput(), ticks before it go to the first
+    bin.
+
+    Returns a dict with the header of 'metrics', 'duration_ms' and
+    'levels': {width: columns}, where the columns are ingress, egress,
+    dropped, capacity (bytes), queue_bytes (at the end of the bin),
+    delay_sum, delay_count and delay_max (queueing delay, ms, of the
+    packets that departed in the bin).
+
+    '''
+    import numpy as np
+
+    levels = sorted(set(levels))
+    base_width = levels[0]
+    if any(width % base_width != 0 for width in levels):
+        raise ValueError('bin widths should be multiples of {} ms'.format(base_width))
+
+    ms_elapsed = metrics['ms'].astype(np.int64) - metrics['base_timestamp']
+    duration_ms = int(ms_elapsed[-1])
+    bin_i = np.maximum(ms_elapsed, 0) // base_width
+    n_bins = int(bin_i[-1]) + 1
+
+    base = {}
+    for name in ('ingress', 'egress', 'dropped', 'capacity'):
+        base[name] = np.zeros(n_bins, np.int64)
+        np.add.at(base[name], bin_i, metrics[name])
+
+    # queue size after the last event of a bin, which holds until the
+    # next event
+    ends = np.append(np.flatnonzero(bin_i[1:] != bin_i[:-1]), bin_i.size - 1)
+    base['queue_bytes'] = np.zeros(n_bins, np.int64)
+    span = np.arange(bin_i[0], n_bins)
+    base['queue_bytes'][span] = metrics['queue_bytes'][ends][np.searchsorted(bin_i[ends], span, side='right') - 1]
+
+    delay_bin = np.maximum(metrics['delay_ms'].astype(np.int64) - metrics['base_timestamp'], 0) // base_width
+    delays = metrics['delays'].astype(float)
+    base['delay_sum'] = np.bincount(delay_bin, weights=delays, minlength=n_bins)
+    base['delay_count'] = np.bincount(delay_bin, minlength=n_bins)
+    base['delay_max'] = np.zeros(n_bins)
+    np.maximum.at(base['delay_max'], delay_bin, delays)
+
+    pyramid = {'init_timestamp' : metrics['init_timestamp'],
+               'base_timestamp' : metrics['base_timestamp'],
+               'queue' : metrics['queue'],
+               'duration_ms' : duration_ms,
+               'levels' : {base_width : base}}
+    for width in levels[1:]:
+        pyramid['levels'][width] = mm_pyramid_level(pyramid, width)
+
+    return pyramid
+
+
+def _coarsen_mm_bins(cols, factor):
+    # merge every 'factor' consecutive bins
+    import numpy as np
+
+    n_bins = cols['ingress'].size
+    starts = np.arange(0, n_bins, factor)
+    coarse = {}
+    for name, col in cols.items():
+        if name == 'queue_bytes':
+            coarse[name] = col[np.minimum(starts + factor, n_bins) - 1]
+        elif name == 'delay_max':
+            coarse[name] = np.maximum.reduceat(col, starts)
+        else:
+            coarse[name] = np.add.reduceat(col, starts)
+
+    return coarse
+
+
+def mm_pyramid_level(pyramid, ms_per_bin):
+    # columns of the pyramid at any multiple of its finest width,
+    # derived from the coarsest stored level that divides it
+    stored = [width for width in pyramid['levels'] if ms_per_bin % width == 0]
+    if len(stored) == 0:
+        raise ValueError('{} ms is not a multiple of {} ms'.format(ms_per_bin, min(pyramid['levels'])))
+    width = max(stored)
+    if width == ms_per_bin:
+        return pyramid['levels'][width]
+
+    return _coarsen_mm_bins(pyramid['levels'][width], ms_per_bin // width)
+
+
+def pyramid_throughput(pyramid, ms_per_bin=1000):
+    # same output as mm_throughput(), from build_mm_pyramid()
+    import numpy as np
+
+    cols = mm_pyramid_level(pyramid, ms_per_bin)
+    data = np.column_stack([cols[name] * 8 for name in ('capacity', 'ingress', 'egress')])
+    totals = [int(data[:,j].sum()) for j in range(3)]
+
+    return _mm_throughput_result(data, np.arange(data.shape[0]), ms_per_bin, pyramid['init_timestamp'], pyramid['duration_ms'], *totals)
+
+
+def pyramid_frame(pyramid, ms_per_bin=1000):
+    # one level of the pyramid as a DataFrame, indexed by the unix time
+    # (s) at the start of each bin
+    import numpy as np
+    from pandas import DataFrame, Index
+
+    cols = mm_pyramid_level(pyramid, ms_per_bin)
+    init_timestamp = pyramid['init_timestamp'] if pyramid['init_timestamp'] is not None else 0
+    start_ms = init_timestamp + pyramid['base_timestamp'] + np.arange(cols['ingress'].size) * ms_per_bin
+
+    names = ['ingress', 'egress', 'dropped', 'capacity', 'queue']
+    return DataFrame({name + '_bytes' : cols[name if name != 'queue' else 'queue_bytes'] for name in names},
+                     index=Index(start_ms / 1000.0, name='unix_time_s'))
+
+
+def mm_pyramid_path(filepath):
+    return os.path.splitext(filepath)[0] + '_pyramid.npz'
+
+
+def load_mm_pyramid(filepath):
+    '''The pyramid stored next to the log 'filepath' by mm_pyramid(), or
+    None if there is none or the log changed since.
+
+    '''
+    import json
+    import numpy as np
+
+    savepath = mm_pyramid_path(filepath)
+    if not os.path.exists(savepath):
+        return None
+
+    st = os.stat(filepath)
+    try:
+        with np.load(savepath) as npz:
+            header = json.loads(str(npz['header']))
+            if header.pop('log') != [st.st_size, st.st_mtime_ns]:
+                return None
+            pyramid = header
+            pyramid['queue'] = tuple(pyramid['queue'])
+            pyramid['levels'] = {}
+            for key in npz.files:
+                if key != 'header':
+                    width, name = key[1:].split('_', 1)
+                    pyramid['levels'].setdefault(int(width), {})[name] = npz[key]
+    except (OSError, ValueError, KeyError):
+        return None
+
+    return pyramid
+
+
+def save_mm_pyramid(filepath, pyramid):
+    import json
+    import numpy as np
+
+    st = os.stat(filepath)
+    header = {name : value for name, value in pyramid.items() if name != 'levels'}
+    header['log'] = [st.st_size, st.st_mtime_ns]
+    arrays = {'L{}_{}'.format(width, name) : col
+              for width, cols in pyramid['levels'].items() for name, col in cols.items()}
+
+    savepath = mm_pyramid_path(filepath)
+    tmppath = savepath + '.{}.tmp'.format(os.getpid())
+    try:
+        with open(tmppath, 'wb') as fout:
+            np.savez(fout, header=json.dumps(header), **arrays)
+        os.replace(tmppath, savepath)
+    except OSError:
+        return None
+
+    return savepath
+
+
+def mm_pyramid(filepath, levels=MM_PYRAMID_LEVELS, verbose=True, save=True):
+    '''Pyramid of per-bin series of the mm log 'filepath' (see
+    build_mm_pyramid()). It is stored next to the log as
+    '<log>_pyramid.npz' and reused while the log is unchanged, so any
+    bin width that is a multiple of the finest level can be served
+    without reading the log again.
+
+    '''
+    pyramid = load_mm_pyramid(filepath)
+    if pyramid is not None and set(levels) <= set(pyramid['levels']):
+        return pyramid
+
+    pyramid = build_mm_pyramid(extract_mm_metrics(filepath, verbose=verbose), levels)
+    if save:
+        save_mm_pyramid(filepath, pyramid)
+
+    return pyramid
+
+
+def _mm_log_simple_array(metrics):
+    # rows of (ms, ingress, egress, dropped, capacity, queue size),
+    # one per millisecond, like the line-by-line loop makes them
+    import numpy as np
+
+    ms = metrics['ms']
+    sums = [metrics[name] for name in ('ingress', 'egress', 'dropped', 'capacity')]
+    q_last = metrics['queue_bytes']
+
+    # events at tick 0 are never flushed on their own by the loop, they
+    # end up in the first nonzero millisecond
+    if ms.size > 1 and ms[0] == 0:
+        sums = [np.concatenate(([col[0] + col[1]], col[2:])) for col in sums]
+        ms, q_last = ms[1:], q_last[1:]
+        
+    # fill in the milliseconds that were skipped: no traffic and the
+    # queue size stays what it was at the last event
+    n_ms = int(ms[-1] - ms[0]) + 1
+    pos = ms - ms[0]
+    res = np.zeros((n_ms, 6))
+    res[:,0] = np.arange(ms[0], ms[-1] + 1)
+    for j, col in enumerate(sums, 1):
+        res[pos,j] = col
+    filled = np.zeros(n_ms, np.int64)
+    filled[pos] = pos
+    res[:,5] = q_last[np.searchsorted(pos, np.maximum.accumulate(filled))]
+
+    return res
+
+
+def _mm_log_simple_frame(res, mm_init_timestamp):
+    from pandas import DataFrame, Index
 
     # add init timestamp to offset the ms ticks and make the unit
     # "seconds"
     res[:,0] = (res[:,0] + mm_init_timestamp) / 1000.0
 
-    column_names = ['unix_time_s', 'ingress_bytes', 'egress_bytes', 'dropped_bytes',  'capacity_bytes', 'queue_bytes', 'queue_occupancy']
-    res_df = DataFrame(res[:,1:], index=Index(res[:,0], name=column_names[0]), columns=column_names[1:-1])
+    column_names = ['unix_time_s', 'ingress_bytes', 'egress_bytes', 'dropped_bytes',  'capacity_bytes', 'queue_bytes']
+    return DataFrame(res[:,1:], index=Index(res[:,0], name=column_names[0]), columns=column_names[1:])
+
+
+def mm_log_simple(metrics):
+    # same output as parse_mm_log_simple() (without writing the
+    # table), from extract_mm_metrics()
+    mm_init_timestamp = metrics['init_timestamp'] if metrics['init_timestamp'] is not None else 0
+    
+    return _mm_log_simple_frame(_mm_log_simple_array(metrics), mm_init_timestamp), metrics['queue']
+
+
+# columns of the _parsed.txt table: (width, decimals)
+MM_TABLE_FIELDS = ((17, 6), (14, 0), (13, 0), (14, 0), (15, 0), (11, 0), (16, 5))
+
+
+def _put_digits(buf, start, width, values, pad=b' '):
+    # write nonnegative integers right-aligned into rows start to
+    # start+width-1 of buf (one column per table row)
+    import numpy as np
+
+    v = values
+    for k in range(start + width - 1, start - 1, -1):
+        if pad == b' ' and k < start + width - 1 and not v.any():
+            buf[start:k+1] = ord(pad)
+            break
+        shown = v > 0
+        v, digit = np.divmod(v, 10)
+        buf[k] = digit + 48
+        if pad == b' ' and k < start + width - 1:
+            buf[k][~shown] = ord(pad)
+
+
+def _format_mm_table(res, qsize_limit):
+    '''Rows of the _parsed.txt table for 'res' (unix time and the five
+    byte columns of mm_log_simple(), one row per millisecond) as bytes,
+    formatted a whole column at a time. Returns None if some value
+    doesn't fit the fast path, see _format_mm_table_rows().
+
+    '''
+    import numpy as np
+
+    res = np.asarray(res, dtype=float)
+    n = res.shape[0]
+    eol = os.linesep.encode()
+    row_len = sum(width for width, _ in MM_TABLE_FIELDS) + len(MM_TABLE_FIELDS) - 1 + len(eol)
+    # built column by column, one buffer row per table column
+    buf = np.empty((row_len, n), np.uint8)
+
+    # unix time: the nearest double to a whole number of ms, which '%.6f'
+    # prints as those ms followed by '000' as long as it is below 2^32
+    ts = res[:,0]
+    ts_ms = np.rint(ts * 1000).astype(np.int64)
+    if not (np.all(ts_ms / 1000.0 == ts) and np.all(ts >= 0) and np.all(ts < 2.0**32)) or np.any(np.signbit(ts)):
+        return None
 
-    # write parsed output into file
-    with open(mmfilepath[:-4] + '_parsed.txt', 'w') as fout:
-        hdr_fmt = '{:>17s},{:>14s},{:>13s},{:>14s},{:>15s},{:>11s},{:>16s}' + os.linesep
-        row_fmt = '{:17.6f},{:>14.0f},{:>13.0f},{:>14.0f},{:15.0f},{:11.0f},{:16.5f}' + os.linesep
+    # byte counts: whole numbers that fit their field
+    counts = res[:,1:6]
+    if not np.all((counts >= 0) & (counts == np.floor(counts))) or np.any(np.signbit(counts)):
+        return None
+    counts = counts.astype(np.int64)
+    for j, (width, _) in enumerate(MM_TABLE_FIELDS[1:6]):
+        if n > 0 and counts[:,j].max() >= 10**width:
+            return None
 
-        fout.write('# queue: {}, length: {} {}'.format(q_type, qsize_limit, qsize_unit) + os.linesep)
-        fout.write(hdr_fmt.format(*column_names))
-        for row in tqdm(res, desc='Printing out the table'):
-            fout.write(row_fmt.format(row[0], row[1], row[2], row[3], row[4], row[5], row[5]/qsize_limit))
+    # queue occupancy: rounded to 5 decimals, leaving the rows that are
+    # too close to a tie for the float arithmetic to Python
+    with np.errstate(divide='ignore', invalid='ignore'):
+        occupancy = res[:,5] / qsize_limit
+    if not (np.all(np.isfinite(occupancy)) and np.all(occupancy >= 0) and np.all(occupancy < 1e9)) or np.any(np.signbit(occupancy)):
+        return None
+    scaled = occupancy * 1e5
+    occupancy_int = np.floor(scaled + 0.5).astype(np.int64)
+    tie = np.abs(scaled - np.floor(scaled) - 0.5) < np.maximum(scaled, 1) * 1e-12
+
+    _put_digits(buf, 0, 10, ts_ms // 1000)
+    buf[10] = ord('.')
+    _put_digits(buf, 11, 3, ts_ms % 1000, b'0')
+    buf[14:17] = ord('0')
+    pos = 17
+    for j, (width, _) in enumerate(MM_TABLE_FIELDS[1:6]):
+        buf[pos] = ord(',')
+        _put_digits(buf, pos + 1, width, counts[:,j])
+        pos += width + 1
+    buf[pos] = ord(',')
+    _put_digits(buf, pos + 1, 10, occupancy_int // 10**5)
+    buf[pos+11] = ord('.')
+    _put_digits(buf, pos + 12, 5, occupancy_int % 10**5, b'0')
+    pos += 17
+    buf[pos:] = np.frombuffer(eol, np.uint8)[:,None]
+
+    buf = buf.T.copy()
+    for i in np.flatnonzero(tie):
+        buf[i,-len(eol)-16:-len(eol)] = np.frombuffer('{:16.5f}'.format(occupancy[i]).encode(), np.uint8)
+
+    return buf.tobytes()
+
+
+def _format_mm_table_rows(res, qsize_limit):
+    # the same table, one row at a time
+    row_fmt = '{:17.6f},{:>14.0f},{:>13.0f},{:>14.0f},{:15.0f},{:11.0f},{:16.5f}' + os.linesep
+    
+    return ''.join(row_fmt.format(row[0], row[1], row[2], row[3], row[4], row[5], row[5]/qsize_limit) for row in res).encode()
+
+
+def write_mm_table(savepath, res_df, q_info):
+    '''Write the output of mm_log_simple() as the fixed-width
+    _parsed.txt table (a header line with the queue, the column names
+    and one row per millisecond).
+
+    '''
+    import numpy as np
+
+    q_type, qsize_unit, qsize_limit = q_info
+    column_names = [res_df.index.name] + list(res_df.columns) + ['queue_occupancy']
+    res = np.column_stack((res_df.index.values, res_df.values))
+
+    table = _format_mm_table(res, qsize_limit)
+    if table is None:
+        table = _format_mm_table_rows(res, qsize_limit)
+
+    hdr_fmt = '{:>17s},{:>14s},{:>13s},{:>14s},{:>15s},{:>11s},{:>16s}' + os.linesep
+    with open(savepath, 'wb') as fout:
+        fout.write(('# queue: {}, length: {} {}'.format(q_type, qsize_limit, qsize_unit) + os.linesep).encode())
+        fout.write(hdr_fmt.format(*column_names).encode())
+        fout.write(table)
+
+
+def save_mm_table_binary(savepath, res_df, q_info):
+    # the same table as an .npz with one array per column and the
+    # queue (type, unit, limit) as 'queue'
+    import numpy as np
+
+    columns = {res_df.index.name : res_df.index.values}
+    columns.update((name, res_df[name].values) for name in res_df.columns)
+    np.savez(savepath, queue=np.array([str(v) for v in q_info]), **columns)
+
+
+def parse_mm_log_simple(mmfilepath, engine='numpy', block_size=MM_BLOCK_SIZE, compact=False, workers=1, text=True, binary=False):
+    # 'python' walks the log line by line, 'numpy' reads it in large
+    # blocks and aggregates every millisecond with array operations
+    # (same result, much faster on big logs); 'compact' bounds the
+    # memory used by the numpy engine and 'workers' spreads it over
+    # several processes, see extract_mm_metrics()
+    if engine == 'python':
+        res, mm_init_timestamp, q_info = _parse_mm_log_loop(mmfilepath)
+        res_df = _mm_log_simple_frame(res, mm_init_timestamp)
+    elif engine == 'numpy':
+        res_df, q_info = mm_log_simple(extract_mm_metrics(mmfilepath, block_size=block_size, compact=compact, workers=workers))
+    else:
+        raise ValueError('engine should be \'python\' or \'numpy\'')
+
+    # write parsed output into file: the text table and/or the same
+    # columns in binary
+    if text:
+        write_mm_table(mmfilepath[:-4] + '_parsed.txt', res_df, q_info)
+    if binary:
+        save_mm_table_binary(mmfilepath[:-4] + '_parsed.npz', res_df, q_info)
     
-    return res_df, (q_type, qsize_unit, qsize_limit)
+    return res_df, q_info
+
+
+# TCP_INFO samples of the sender (sender -s), see sender.cc: a 64-byte
+# header, then a ring of fixed-size records
+TCPINFO_MAGIC = b'TCPINFO1'
+TCPINFO_HEADER_SIZE = 64
+TCPINFO_FIELDS = [('time_us', '<u8'), ('rtt_us', '<u4'), ('rttvar_us', '<u4'), ('snd_cwnd', '<u4'),
+                  ('snd_mss', '<u4'), ('total_retrans', '<u4'), ('unacked', '<u4'),
+                  ('pacing_rate', '<u8'), ('delivery_rate', '<u8'), ('bytes_acked', '<u8')]
+
+
+def read_tcpinfo_log(filepath):
+    '''TCP_INFO samples written by 'sender -s filepath': a dict with
+    'samples' (a structured array with the fields of TCPINFO_FIELDS,
+    in time order), 'interval_us', 'capacity' of the ring, 'count' of
+    samples taken and 'lost', the oldest ones overwritten when the
+    ring wrapped.
+
+    The file may be read while the sender still writes it.
+
+    '''
+    import struct
+    import numpy as np
+
+    with open(filepath, 'rb') as fin:
+        header = fin.read(TCPINFO_HEADER_SIZE)
+        if header[:8] != TCPINFO_MAGIC:
+            raise ValueError('{} is not a TCP_INFO sample file'.format(filepath))
+        version, record_size, capacity, interval_us, count = struct.unpack_from('<IIQQQ', header, 8)
+        dtype = np.dtype(TCPINFO_FIELDS)
+        if version != 1 or record_size != dtype.itemsize:
+            raise ValueError('unknown TCP_INFO sample file version {} ({} byte records)'.format(version, record_size))
+
+        ring = np.fromfile(fin, dtype=dtype, count=min(count, capacity))
+
+    if count > capacity:
+        # oldest first: the record after the last one written
+        start = count % capacity
+        ring = np.concatenate([ring[start:], ring[:start]])
+
+    return {'samples' : ring, 'interval_us' : interval_us, 'capacity' : capacity,
+            'count' : count, 'lost' : max(count - capacity, 0)}
+
+
+def tcpinfo_rtt(filepath):
+    # unix time (s) and smoothed RTT (s) of the samples of a TCP_INFO
+    # log, the same series as *_sender_RTT from the packet captures
+    # (less noisy: the kernel smooths it); samples before the first
+    # RTT estimate are left out
+    samples = read_tcpinfo_log(filepath)['samples']
+    samples = samples[samples['rtt_us'] > 0]
+    return samples['time_us'] / 1e6, samples['rtt_us'] / 1e6
 
 
 if __name__ == '__main__':
+    import argparse
+    
     # cmdline arg is mmlink downlink log file
-    logfilepath = sys.argv[1]
+    parser = argparse.ArgumentParser()
+    parser.add_argument('logfilepath', help='mm-link log file (*_downlink.csv or *_uplink.csv)')
+    parser.add_argument('--engine', choices=('python', 'numpy'), default='numpy', help='Parsing engine (default: numpy)')
+    parser.add_argument('--compact', action='store_true', help='Bound the memory used by the numpy engine, for very long logs')
+    parser.add_argument('--workers', type=int, default=1, help='Processes used by the numpy engine, 0 for one per CPU (default: 1)')
+    parser.add_argument('--no-text', dest='text', action='store_false', help='Don\'t write the <log>_parsed.txt table')
+    parser.add_argument('--binary', action='store_true', help='Also write the table as <log>_parsed.npz')
+    args = parser.parse_args()
 
-    res, q_info = parse_mm_log_simple(logfilepath)
+    res, q_info = parse_mm_log_simple(args.logfilepath, engine=args.engine, compact=args.compact, workers=args.workers or None, text=args.text, binary=args.binary)
     print(q_info)
@@ -0,0 +1,568 @@
+import os
+import struct
+
+# packets decoded at a time
+PCAP_CHUNK = 1 << 16
+
+# link types that can be decoded (LINKTYPE_* of pcap)
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_VLAN = 0x8100
+
+IPPROTO_TCP = 6
+TCP_ACK = 0x10
+
+
+def ip_address(address):
+    # dotted IPv4 address as the integer in the IP header
+    import socket
+
+    return int.from_bytes(socket.inet_aton(address), 'big')
+
+
+def _pcap_records(buf, chunk):
+    '''Record positions of a classic pcap file in 'buf': yields the
+    link type, a precision multiplier of the sub-second timestamp
+    field, the byte order ('<' or '>') and lists of record header
+    offsets, up to 'chunk' records at a time.
+
+    '''
+    magic = buf[:4]
+    if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+        order = '<'
+    elif magic in (b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+        order = '>'
+    else:
+        raise ValueError('not a pcap file')
+    frac = 1e-9 if magic in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d') else 1e-6
+    linktype = struct.unpack_from(order + 'I', buf, 20)[0] & 0xFFFF
+
+    caplen_at = struct.Struct(order + 'I').unpack_from
+    size = len(buf)
+    pos = 24
+    while pos + 16 <= size:
+        offsets = []
+        while pos + 16 <= size and len(offsets) < chunk:
+            caplen = caplen_at(buf, pos + 8)[0]
+            if pos + 16 + caplen > size:
+                # cut short by the end of the capture
+                break
+            offsets.append(pos)
+            pos += 16 + caplen
+        if not offsets:
+            break
+        yield linktype, frac, order, offsets
+
+
+def _pcapng_records(buf, chunk):
+    '''Enhanced packet blocks of a pcapng file in 'buf', like
+    _pcap_records() but per section and interface: yields the link
+    type, timestamp resolution (s), byte order and block offsets.
+
+    '''
+    size = len(buf)
+    pos = 0
+    order = '<'
+    interfaces = []
+    pending = {}
+
+    def flush(iface):
+        offsets = pending.pop(iface)
+        linktype, tsresol = interfaces[iface]
+        return linktype, tsresol, order, offsets
+
+    while pos + 12 <= size:
+        blocktype = struct.unpack_from(order + 'I', buf, pos)[0]
+        if blocktype == 0x0A0D0D0A:
+            # section header: byte order, and interfaces start again
+            for iface in list(pending):
+                yield flush(iface)
+            order = '<' if buf[pos+8:pos+12] == b'\x4d\x3c\x2b\x1a' else '>'
+            interfaces = []
+        blocklen = struct.unpack_from(order + 'I', buf, pos + 4)[0]
+        if blocklen < 12 or pos + blocklen > size:
+            break
+
+        if blocktype == 1:
+            # interface description, with the if_tsresol option (9)
+            linktype = struct.unpack_from(order + 'H', buf, pos + 8)[0]
+            tsresol = 1e-6
+            opt = pos + 16
+            while opt + 4 <= pos + blocklen - 4:
+                code, length = struct.unpack_from(order + 'HH', buf, opt)
+                if code == 0:
+                    break
+                if code == 9:
+                    value = buf[opt + 4]
+                    tsresol = 2.0 ** -(value & 0x7F) if value & 0x80 else 10.0 ** -value
+                opt += 4 + (length + 3) // 4 * 4
+            interfaces.append((linktype, tsresol))
+        elif blocktype == 6:
+            iface = struct.unpack_from(order + 'I', buf, pos + 8)[0]
+            offsets = pending.setdefault(iface, [])
+            offsets.append(pos)
+            if len(offsets) >= chunk:
+                yield flush(iface)
+        pos += blocklen
+
+    for iface in list(pending):
+        yield flush(iface)
+
+
+def _gather(b, offsets, width, order='>'):
+    # unsigned integers of 'width' bytes at each of 'offsets' of 'b'
+    import numpy as np
+
+    # (clamped to the buffer, for fields of packets captured too short
+    # to have them, which are masked out anyway)
+    offsets = np.minimum(offsets, b.size - width)
+    value = np.zeros(offsets.size, dtype=np.uint64)
+    for k in (range(width) if order == '>' else reversed(range(width))):
+        value = (value << np.uint64(8)) | b[offsets + k]
+    return value
+
+
+def _decode(b, linktype, frac, order, offsets, pcapng=False):
+    '''IPv4/TCP header fields of the records at 'offsets' (record
+    header or block offsets): a dict of arrays, with 'tcp' False for
+    packets that are not TCP over IPv4 (or were captured too short to
+    tell).
+
+    '''
+    import numpy as np
+
+    rec = np.asarray(offsets, dtype=np.int64)
+    if pcapng:
+        ts = _gather(b, rec + 12, 4, order) << np.uint64(32) | _gather(b, rec + 16, 4, order)
+        ts = ts.astype(np.float64) * frac
+        caplen = _gather(b, rec + 20, 4, order).astype(np.int64)
+        origlen = _gather(b, rec + 24, 4, order).astype(np.int64)
+        data = rec + 28
+    else:
+        ts = _gather(b, rec, 4, order).astype(np.float64) + _gather(b, rec + 4, 4, order).astype(np.float64) * frac
+        caplen = _gather(b, rec + 8, 4, order).astype(np.int64)
+        origlen = _gather(b, rec + 12, 4, order).astype(np.int64)
+        data = rec + 16
+
+    # where the IP header starts, and whether it is IPv4
+    end = data + caplen
+    safe = lambda off, width: np.where(off + width <= end, off, data)
+    if linktype == LINKTYPE_ETHERNET:
+        ethertype = _gather(b, safe(data + 12, 2), 2)
+        vlan = ethertype == ETHERTYPE_VLAN
+        ethertype[vlan] = _gather(b, safe(data[vlan] + 16, 2), 2) if vlan.any() else ethertype[vlan]
+        net = np.where(vlan, data + 18, data + 14)
+        ipv4 = ethertype == ETHERTYPE_IPV4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        net = data + 16
+        ipv4 = _gather(b, safe(data + 14, 2), 2) == ETHERTYPE_IPV4
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        net = data + 20
+        ipv4 = _gather(b, data, 2) == ETHERTYPE_IPV4
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, 12):
+        net = data
+        ipv4 = np.ones(rec.size, dtype=bool)
+    elif linktype == LINKTYPE_NULL:
+        net = data + 4
+        ipv4 = _gather(b, data, 4, order) == 2
+    else:
+        raise ValueError('link type {} is not supported'.format(linktype))
+
+    # IPv4 header (20 bytes at least), then the first 14 bytes of TCP
+    ipv4 &= net + 20 <= end
+    net = np.where(ipv4, net, data)
+    ver_ihl = _gather(b, net, 1)
+    ipv4 &= (ver_ihl >> np.uint64(4)) == 4
+    ihl = (ver_ihl & np.uint64(0x0F)).astype(np.int64) * 4
+    tcp = ipv4 & (_gather(b, net + 9, 1) == IPPROTO_TCP) & (net + ihl + 14 <= end)
+    th = np.where(tcp, net + ihl, data)
+
+    fields = {'timestamp' : ts,
+              'frame_len' : origlen,
+              'tcp' : tcp,
+              'src' : np.where(ipv4, _gather(b, net + 12, 4), 0),
+              'dst' : np.where(ipv4, _gather(b, net + 16, 4), 0),
+              'sport' : _gather(b, th, 2),
+              'dport' : _gather(b, th + 2, 2),
+              'seq' : _gather(b, th + 4, 4),
+              'ack' : _gather(b, th + 8, 4),
+              'flags' : _gather(b, th + 13, 1)}
+    ip_len = _gather(b, net + 2, 2).astype(np.int64)
+    doff = (_gather(b, th + 12, 1) >> np.uint64(4)).astype(np.int64) * 4
+    fields['payload'] = np.where(tcp, ip_len - ihl - doff, 0)
+
+    return fields
+
+
+def iter_pcap(filepath, chunk=PCAP_CHUNK):
+    '''Packets of the capture 'filepath' (pcap or pcapng, e.g. from
+    'tcpdump -s 96 -w'), decoded 'chunk' at a time: yields dicts of
+    arrays with the timestamp (s), frame length on the wire, and the
+    IPv4 addresses and TCP ports, sequence and ACK numbers, flags and
+    payload length ('tcp' tells which packets have them).
+
+    The file is mmap'd and only the offsets of the records are found
+    one by one; the headers are decoded with NumPy, a chunk at a time.
+    Only the packets of a chunk are in memory.
+
+    '''
+    import mmap
+    import numpy as np
+
+    with open(filepath, 'rb') as fin:
+        if os.fstat(fin.fileno()).st_size == 0:
+            return
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            b = np.frombuffer(buf, dtype=np.uint8)
+            pcapng = buf[:4] == b'\x0a\x0d\x0d\x0a'
+            records = _pcapng_records(buf, chunk) if pcapng else _pcap_records(buf, chunk)
+            try:
+                for linktype, frac, order, offsets in records:
+                    yield _decode(b, linktype, frac, order, offsets, pcapng)
+            finally:
+                # no views may be left when the mmap is closed
+                del b
+
+
+class PcapThroughput(object):
+
+    def __init__(self, dst):
+        '''
+        Per-frame throughput to the IPv4 address 'dst', extracted from
+        the chunks of iter_pcap() as they come (update()), possibly of
+        several captures one after the other: result() gives the
+        timestamps (s) and frame lengths (bytes) so far.
+
+        '''
+        self.dst = ip_address(dst)
+        self._timestamps = []
+        self._lengths = []
+
+    def update(self, pkts):
+        to_dst = pkts['dst'] == self.dst
+        self._timestamps.append(pkts['timestamp'][to_dst])
+        self._lengths.append(pkts['frame_len'][to_dst])
+
+    def result(self):
+        import numpy as np
+
+        if not self._timestamps:
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+        return np.concatenate(self._timestamps), np.concatenate(self._lengths)
+
+
+def pcap_throughput(filepath, dst):
+    '''Timestamps (s) and frame lengths (bytes) of the packets to the
+    IPv4 address 'dst' in a capture: the per-frame throughput that
+    tshark gives with -Y "ip.dst==DST" -e frame.time_epoch -e frame.len.
+
+    '''
+    extractor = PcapThroughput(dst)
+    for pkts in iter_pcap(filepath):
+        extractor.update(pkts)
+    return extractor.result()
+
+
+class _AckRttFlow(object):
+
+    # state of one connection carried from chunk to chunk: where the
+    # 32-bit sequence and ACK numbers are (unwrapped, relative to the
+    # first data segment), the segments not acknowledged yet (their end
+    # and first transmission) and the highest ACK so far
+
+    def __init__(self, base):
+        import numpy as np
+
+        self.base = int(base)
+        self.last_seq = 0
+        self.last_ack = 0
+        self.pending_end = np.zeros(0, dtype=np.int64)
+        self.pending_ts = np.zeros(0)
+        self.highest = -(1 << 62)
+
+    def _unwrap(self, seq, last):
+        # each number is taken as the nearest one (either way) to the
+        # one before it
+        import numpy as np
+
+        rel = (seq.astype(np.int64) - self.base) % (1 << 32)
+        prev = np.empty_like(rel)
+        prev[0] = last % (1 << 32)
+        prev[1:] = rel[:-1]
+        step = (rel - prev + (1 << 31)) % (1 << 32) - (1 << 31)
+        return last + np.cumsum(step)
+
+    def update(self, seg_ts, seg_seq, seg_len, ack_ts, ack_no):
+        import numpy as np
+
+        if seg_ts.size:
+            seg_end = self._unwrap(seg_seq, self.last_seq)
+            self.last_seq = int(seg_end[-1])
+            seg_end += seg_len
+            # first transmission of each segment end
+            ends, first = np.unique(np.concatenate([self.pending_end, seg_end]), return_index=True)
+            sent = np.concatenate([self.pending_ts, seg_ts])[first]
+        else:
+            ends, sent = self.pending_end, self.pending_ts
+
+        timestamps = rtts = np.zeros(0)
+        if ack_ts.size:
+            ack_rel = self._unwrap(ack_no, self.last_ack)
+            self.last_ack = int(ack_rel[-1])
+
+            # only ACKs that move the cumulative ACK forward
+            highest = np.maximum.accumulate(np.concatenate([[self.highest], ack_rel]))
+            new = ack_rel > highest[:-1]
+            self.highest = int(highest[-1])
+
+            if ends.size:
+                i = np.minimum(np.searchsorted(ends, ack_rel), ends.size - 1)
+                matched = new & (ends[i] == ack_rel) & (sent[i] <= ack_ts)
+                timestamps, rtts = ack_ts[matched], ack_ts[matched] - sent[i[matched]]
+
+        # whatever is acknowledged now cannot be matched any more
+        keep = ends > self.highest
+        self.pending_end, self.pending_ts = ends[keep], sent[keep]
+        return timestamps, rtts
+
+
+def ack_rtt(seg_ts, seg_seq, seg_len, ack_ts, ack_no):
+    '''RTT samples of one TCP connection, the way tshark computes
+    tcp.analysis.ack_rtt: an ACK that acknowledges new data is matched
+    to the data segment (its first transmission) that ends exactly at
+    the ACK number. Sequence and ACK numbers are 32-bit, in time order.
+    Returns the timestamps of the matched ACKs and their RTT (s).
+
+    '''
+    import numpy as np
+
+    if seg_ts.size == 0 or ack_ts.size == 0:
+        return np.zeros(0), np.zeros(0)
+    return _AckRttFlow(seg_seq[0]).update(seg_ts, seg_seq, seg_len, ack_ts, ack_no)
+
+
+class PcapAckRtt(object):
+
+    def __init__(self, acker):
+        '''
+        ACK-based RTT samples of the TCP connections at the sender, with
+        the ACKs coming from the IPv4 address 'acker', extracted from the
+        chunks of iter_pcap() as they come (update()). The chunks may
+        come from several captures one after the other (the segments of
+        a rotating capture): the segments still in flight at the end of
+        one are matched to the ACKs in the next. result() gives the
+        timestamps and RTT (s) so far.
+
+        '''
+        self.acker = ip_address(acker)
+        self._flows = {}
+        self._timestamps = []
+        self._rtts = []
+
+    def update(self, pkts):
+        import numpy as np
+
+        tcp = pkts['tcp']
+        data = tcp & (pkts['dst'] == self.acker) & (pkts['payload'] > 0)
+        ack = tcp & (pkts['src'] == self.acker) & ((pkts['flags'] & TCP_ACK) != 0)
+
+        # the connection is the port of the sender (the one that is not
+        # the receiver's)
+        timestamps, rtts = [], []
+        for port in np.union1d(pkts['sport'][data], pkts['dport'][ack]):
+            d = data & (pkts['sport'] == port)
+            a = ack & (pkts['dport'] == port)
+            flow = self._flows.get(port)
+            if flow is None:
+                if not d.any():
+                    # nothing sent on it yet
+                    continue
+                flow = self._flows[port] = _AckRttFlow(pkts['seq'][d][0])
+            ts, rtt = flow.update(pkts['timestamp'][d], pkts['seq'][d], pkts['payload'][d].astype(np.int64),
+                                  pkts['timestamp'][a], pkts['ack'][a])
+            timestamps.append(ts)
+            rtts.append(rtt)
+
+        if timestamps:
+            self._timestamps.append(np.concatenate(timestamps))
+            self._rtts.append(np.concatenate(rtts))
+
+    def result(self):
+        import numpy as np
+
+        if not self._timestamps:
+            return np.zeros(0), np.zeros(0)
+        timestamps = np.concatenate(self._timestamps)
+        rtts = np.concatenate(self._rtts)
+        order = np.argsort(timestamps, kind='stable')
+        return timestamps[order], rtts[order]
+
+
+def pcap_ack_rtt(filepath, acker):
+    '''ACK-based RTT samples (timestamps and RTT in seconds) of the TCP
+    connections in a capture at the sender, with the ACKs coming from
+    the IPv4 address 'acker' (the receiver): what tshark gives with
+    -Y "tcp.analysis.ack_rtt && ip.src==ACKER". The samples of all
+    connections are merged in time order.
+
+    '''
+    extractor = PcapAckRtt(acker)
+    for pkts in iter_pcap(filepath):
+        extractor.update(pkts)
+    return extractor.result()
+
+
+def capture_segments(pcappath):
+    '''The files of a capture rotated by 'tcpdump -C' into 'pcappath',
+    in order: 'pcappath' itself, then 'pcappath1', 'pcappath2' ...
+
+    '''
+    savedir = os.path.dirname(pcappath) or '.'
+    name = os.path.basename(pcappath)
+    numbered = []
+    for entry in os.listdir(savedir):
+        if entry.startswith(name) and entry[len(name):].isdigit():
+            numbered.append((int(entry[len(name):]), os.path.join(os.path.dirname(pcappath), entry)))
+    segments = [path for _, path in sorted(numbered)]
+    if os.path.exists(pcappath):
+        segments.insert(0, pcappath)
+    return segments
+
+
+class RotatingCapture(object):
+
+    def __init__(self, pcappath, extractor, interval=1.0):
+        '''
+        Incremental processing of a capture that tcpdump rotates into
+        segments of fixed size (-C), while it is being written: every
+        segment that is complete (tcpdump has gone on to the next one)
+        is fed to 'extractor' (a PcapThroughput or PcapAckRtt) and
+        deleted, so that the capture takes up a segment or two on disk
+        however long it runs.
+
+        start() looks for completed segments every 'interval' seconds in
+        a thread; once tcpdump is stopped, finish() processes the rest
+        and returns the result of the extractor.
+
+        '''
+        self.pcappath = pcappath
+        self.extractor = extractor
+        self.interval = interval
+        self.segments = 0
+        self.peak_bytes = 0
+        self._error = None
+        self._stop = None
+        self._thread = None
+
+    def _process(self, segment):
+        for pkts in iter_pcap(segment):
+            self.extractor.update(pkts)
+        os.unlink(segment)
+        self.segments += 1
+
+    def poll(self, last=False):
+        # process the completed segments (with 'last' also the one
+        # being written, when the capture is over)
+        segments = capture_segments(self.pcappath)
+        size = 0
+        for segment in segments:
+            try:
+                size += os.path.getsize(segment)
+            except OSError:
+                pass
+        self.peak_bytes = max(self.peak_bytes, size)
+        for segment in segments if last else segments[:-1]:
+            self._process(segment)
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                self.poll()
+        except Exception as e:
+            self._error = e
+
+    def start(self):
+        import threading
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='capture ' + os.path.basename(self.pcappath), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def finish(self):
+        self.stop()
+        if self._error is not None:
+            raise self._error
+        self.poll(last=True)
+        return self.extractor.result()
+
+
+def save_pcap_series(savepath, timestamp, value):
+    '''Store a series extracted from a capture (timestamps and one value
+    per packet) as '.npz', written to a temporary file first.
+
+    '''
+    import numpy as np
+
+    tmppath = savepath + '.{}.tmp'.format(os.getpid())
+    with open(tmppath, 'wb') as fout:
+        np.savez(fout, timestamp=timestamp, value=value)
+    os.replace(tmppath, savepath)
+    return savepath
+
+
+def load_pcap_series(filepath):
+    '''Timestamps and values (as floats) of a series extracted from a
+    capture, given as the '.csv' that tshark made (older runs) or the
+    '.npz' of save_pcap_series(); the '.npz' is used whenever there is
+    one.
+
+    '''
+    import numpy as np
+
+    npzpath = os.path.splitext(filepath)[0] + '.npz'
+    if os.path.exists(npzpath):
+        with np.load(npzpath) as npz:
+            return npz['timestamp'], npz['value'].astype(np.float64)
+
+    data = np.loadtxt(filepath, delimiter=',', ndmin=2)
+    if data.size == 0:
+        return np.zeros(0), np.zeros(0)
+    return data[:,0], data[:,1]
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    import argparse
+    import numpy as np
+
+    parser = argparse.ArgumentParser(description='Extract per-frame throughput or ACK RTT from a packet capture')
+    parser.add_argument('what', choices=('tput', 'rtt'), help='tput: frames to ADDRESS, rtt: RTT samples of ACKs from ADDRESS')
+    parser.add_argument('pcap', help='Capture file (pcap or pcapng)')
+    parser.add_argument('address', help='IPv4 address (the receiver)')
+    parser.add_argument('--output', '-o', help='Save to this file (.npz, or .csv like tshark; default: print as CSV)')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    extract = pcap_throughput if args.what == 'tput' else pcap_ack_rtt
+    timestamp, value = extract(args.pcap, args.address)
+    print('{} samples in {:.2f} s'.format(timestamp.size, time.perf_counter() - t0), file=sys.stderr)
+
+    if args.output is not None and args.output.endswith('.npz'):
+        save_pcap_series(args.output, timestamp, value)
+    else:
+        fmt = ('%.6f', '%d') if args.what == 'tput' else ('%.6f', '%.9f')
+        np.savetxt(args.output if args.output is not None else sys.stdout, np.column_stack([timestamp, value]), fmt=fmt, delimiter=',')
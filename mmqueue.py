@@ -0,0 +1,408 @@
+import os
+
+# bytes that mm-link can send at every delivery opportunity of a trace
+# (PACKET_SIZE of mahimahi's link_queue.cc)
+MM_OPPORTUNITY_BYTES = 1504
+
+# size of the packets of a generate_trace.py trace
+ARRIVAL_PKT_SIZE = 1500
+
+
+def load_arrivals(filepath, pkt_size=ARRIVAL_PKT_SIZE, verbose=False):
+    '''Arrival process for simulate(): the time (ms) and size (bytes) of
+    every packet, as int64 arrays in time order, and the header of the
+    file if it is an mm log (else None).
+
+    'filepath' is either a trace from generate_trace.py (one send time
+    in ms per line, probe packets marked with '*', all 'pkt_size'
+    bytes) or an mm-link log, whose '+' events are the packets that
+    reached the link.
+
+    '''
+    import numpy as np
+
+    with open(filepath, 'rb') as fin:
+        is_log = fin.read(1) == b'#'
+
+    if not is_log:
+        with open(filepath) as fin:
+            ms = np.array([int(line.strip().rstrip('*')) for line in fin if line.strip()], dtype=np.int64)
+        ms.sort(kind='stable')
+        return ms, np.full(ms.size, pkt_size, dtype=np.int64), None
+
+    from mmparse import _iter_mm_blocks, _MMBlock, _parse_mm_header
+
+    header = {'init_timestamp' : None,
+              'base_timestamp' : 0,
+              'queue' : (None, None, np.inf)}
+    ms, size = [], []
+    for block in _iter_mm_blocks(filepath, verbose=verbose):
+        blk = _MMBlock(block)
+        for line in blk.comments:
+            _parse_mm_header(line, header)
+        arrived = np.flatnonzero(blk.op == ord('+'))
+        ms.append(blk.values(0, arrived))
+        size.append(blk.values(2, arrived))
+
+    if not ms:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), header
+    return np.concatenate(ms), np.concatenate(size), header
+
+
+def delivery_opportunities(trace, end_ms, base_timestamp=0):
+    '''Times (ms) of the delivery opportunities of a mahimahi trace from
+    'base_timestamp' (when mm-link started) up to 'end_ms', with the
+    trace repeated the way mm-link does it.
+
+    '''
+    import numpy as np
+    from mmparse import load_trace
+
+    schedule = load_trace(trace)
+    if schedule.size == 0 or schedule[-1] <= 0:
+        raise ValueError('{} has no delivery opportunities to repeat'.format(trace))
+
+    period = int(schedule[-1])
+    repeats = max((int(end_ms) - int(base_timestamp)) // period + 1, 1)
+    times = (np.arange(repeats, dtype=np.int64)[:,None] * period + schedule[None,:]).ravel() + int(base_timestamp)
+    return times[times <= end_ms]
+
+
+def _droptail(arr_upto, sizes, limit, limit_packets, opp_bytes):
+    '''Which arrivals a droptail queue accepts. arr_upto[i] is the number
+    of delivery opportunities up to the time of arrival i (those are
+    used before the packet is enqueued, like mm-link's rationalize()).
+
+    The bytes sent so far only change at the opportunities, by up to
+    'opp_bytes' each, and between two arrivals the queue only drains:
+    the link is caught up in one step per arrival. A packet leaves the
+    queue (for the link) once its first byte is sent.
+
+    '''
+    accepted = [False] * len(sizes)
+    starts = []
+    sent = 0            # bytes of accepted packets sent so far
+    total = 0           # bytes of accepted packets
+    head = 0            # accepted packets out of the queue
+    head_end = 0        # where the last of those ends
+    k_last = 0
+    no_limit = limit is None
+
+    for i, (k, size) in enumerate(zip(arr_upto, sizes)):
+        if k != k_last:
+            sent = min(sent + (k - k_last) * opp_bytes, total)
+            k_last = k
+            while head < len(starts) and starts[head] < sent:
+                head += 1
+                head_end = starts[head] if head < len(starts) else total
+        if no_limit or (len(starts) - head + 1 <= limit if limit_packets else total - head_end + size <= limit):
+            accepted[i] = True
+            starts.append(total)
+            total += size
+
+    return accepted
+
+
+def replay(trace, arr_ms, arr_size, limit=None, limit_packets=False, end_ms=None, base_timestamp=0, opp_bytes=MM_OPPORTUNITY_BYTES):
+    '''The packets of an arrival process through mm-link, one by one (see
+    simulate() for the semantics). Returns a dict with
+
+    arr_ms, arr_size: the arrivals up to 'end_ms'
+
+    accepted: which of them got into the queue
+
+    opp, sent: time of every delivery opportunity and the bytes sent
+    by the end of it
+
+    starts, ends: where each accepted packet starts and ends in the
+    bytes accepted, and 'dep' the opportunity it departs with (the
+    number of opportunities if it doesn't by 'end_ms')
+
+    arrived_before: bytes accepted before each arrival (one more entry
+    for all of them)
+
+    '''
+    import numpy as np
+
+    arr_ms = np.asarray(arr_ms, dtype=np.int64)
+    arr_size = np.asarray(arr_size, dtype=np.int64)
+    if end_ms is None:
+        end_ms = int(arr_ms[-1]) if arr_ms.size else int(base_timestamp)
+    if arr_size.size and arr_size.max() > opp_bytes:
+        raise ValueError('packets larger than {} bytes never fit a delivery opportunity'.format(opp_bytes))
+    keep = arr_ms <= end_ms
+    arr_ms, arr_size = arr_ms[keep], arr_size[keep]
+
+    opp = delivery_opportunities(trace, end_ms, base_timestamp)
+    n_opp = opp.size
+
+    # which packets get in
+    arr_upto = np.searchsorted(opp, arr_ms, side='right')
+    accepted = np.array(_droptail(arr_upto.tolist(), arr_size.tolist(), limit, limit_packets, opp_bytes), dtype=bool)
+
+    # bytes arrived (and accepted) before each opportunity, then the
+    # bytes sent by each: sent[k] = min(sent[k-1] + opp_bytes,
+    # arrived[k]), which unrolls into a running minimum
+    acc_size = arr_size[accepted]
+    ends = np.cumsum(acc_size)
+    arrived_before = np.concatenate(([0], np.cumsum(np.where(accepted, arr_size, 0))))
+    arrived = arrived_before[np.searchsorted(arr_ms, opp, side='left')]
+    k = np.arange(n_opp, dtype=np.int64) * opp_bytes
+    sent = k + np.minimum(np.minimum.accumulate(arrived - k), opp_bytes) if n_opp else np.zeros(0, np.int64)
+
+    # a packet departs with the opportunity that sends its last byte
+    dep = np.searchsorted(sent, ends, side='left')
+
+    return {'arr_ms' : arr_ms, 'arr_size' : arr_size, 'accepted' : accepted, 'opp' : opp, 'sent' : sent,
+            'starts' : ends - acc_size, 'ends' : ends, 'dep' : dep, 'arrived_before' : arrived_before, 'end_ms' : int(end_ms)}
+
+
+def taken_bytes(r, sent_by):
+    # bytes taken out of the queue of replay() 'r' (for the link) once
+    # 'sent_by' bytes have been sent: packets leave the queue with their
+    # first byte
+    import numpy as np
+
+    out = np.searchsorted(r['starts'], sent_by, side='left')
+    return np.where(out > 0, r['ends'][np.maximum(out - 1, 0)] if r['ends'].size else 0, 0)
+
+
+def simulate(trace, arr_ms, arr_size, limit=None, limit_packets=False, end_ms=None, base_timestamp=0, init_timestamp=None,
+             opp_bytes=MM_OPPORTUNITY_BYTES):
+    '''Offline replay of mm-link with a droptail queue: the packets of
+    the arrival process ('arr_ms', 'arr_size', see load_arrivals()) go
+    through the link of the mahimahi 'trace', with the queue holding up
+    to 'limit' bytes (packets with 'limit_packets', no limit with
+    None).
+
+    mm-link's semantics are followed to the byte: every delivery
+    opportunity sends up to 'opp_bytes' from the queue, a packet may be
+    spread over several opportunities and departs with the one that
+    sends its last byte, a packet is dropped if it doesn't fit the queue
+    when it arrives (the packet being sent doesn't count), and an
+    opportunity at the same millisecond as an arrival is used first.
+
+    Returns the same dict as mmparse.extract_mm_metrics() for a log of
+    the link from its start ('base_timestamp') until 'end_ms' (default:
+    the last arrival), so mmparse.mm_log_simple() gives the
+    per-millisecond series of parse_mm_log_simple(). The queue size is
+    the one at the end of each millisecond.
+
+    '''
+    import numpy as np
+
+    r = replay(trace, arr_ms, arr_size, limit, limit_packets, end_ms, base_timestamp, opp_bytes)
+    arr_ms, arr_size, accepted, opp, end_ms = r['arr_ms'], r['arr_size'], r['accepted'], r['opp'], r['end_ms']
+    acc_size = arr_size[accepted]
+    departed = r['dep'] < opp.size
+    dep_ms = opp[r['dep'][departed]]
+    delays = dep_ms - arr_ms[accepted][departed]
+
+    # per millisecond, from the start of the link (or the first
+    # arrival) to the end
+    t0 = int(min(base_timestamp, arr_ms[0])) if arr_ms.size else int(base_timestamp)
+    n_ms = end_ms - t0 + 1
+    ingress = np.bincount(arr_ms - t0, weights=arr_size, minlength=n_ms).astype(np.int64)
+    dropped = np.bincount(arr_ms[~accepted] - t0, weights=arr_size[~accepted], minlength=n_ms).astype(np.int64)
+    capacity = np.bincount(opp - t0, minlength=n_ms).astype(np.int64) * opp_bytes
+    egress = np.bincount(dep_ms - t0, weights=acc_size[departed], minlength=n_ms).astype(np.int64)
+
+    # queue at the end of every millisecond: accepted so far, less what
+    # has been taken out for the link
+    ticks = np.arange(t0, end_ms + 1, dtype=np.int64)
+    last_opp = np.searchsorted(opp, ticks, side='right') - 1
+    sent_by = np.where(last_opp >= 0, r['sent'][np.maximum(last_opp, 0)] if opp.size else 0, 0)
+    queue = r['arrived_before'][np.searchsorted(arr_ms, ticks, side='right')] - taken_bytes(r, sent_by)
+
+    # only the milliseconds with events, like a log
+    active = (ingress > 0) | (capacity > 0) | (egress > 0) | (dropped > 0)
+
+    if limit is not None:
+        queue_info = ('droptail', 'packets' if limit_packets else 'bytes', limit)
+    else:
+        queue_info = ('infinite', None, np.inf)
+
+    return {'init_timestamp' : init_timestamp,
+            'base_timestamp' : base_timestamp,
+            'queue' : queue_info,
+            'ms' : ticks[active],
+            'ingress' : ingress[active],
+            'egress' : egress[active],
+            'dropped' : dropped[active],
+            'capacity' : capacity[active],
+            'queue_bytes' : queue[active],
+            'delay_ms' : dep_ms,
+            'delays' : delays}
+
+
+def queue_summary(metrics):
+    '''What a buffer size does: bytes in, out and dropped, loss rate,
+    utilization of the link, queueing delay (mean and percentiles, ms)
+    and mean queue size (bytes), from simulate() or
+    mmparse.extract_mm_metrics().
+
+    '''
+    import numpy as np
+
+    ingress = int(metrics['ingress'].sum())
+    egress = int(metrics['egress'].sum())
+    dropped = int(metrics['dropped'].sum())
+    capacity = int(metrics['capacity'].sum())
+    delays = np.asarray(metrics['delays'], dtype=float)
+    p50, p95, p99 = np.percentile(delays, [50, 95, 99]) if delays.size else (np.nan,) * 3
+
+    return {'ingress_bytes' : ingress,
+            'egress_bytes' : egress,
+            'dropped_bytes' : dropped,
+            'loss' : dropped / ingress if ingress else 0.0,
+            'utilization' : egress / capacity if capacity else 0.0,
+            'delay_avg_ms' : delays.mean() if delays.size else np.nan,
+            'delay_p50_ms' : p50,
+            'delay_p95_ms' : p95,
+            'delay_p99_ms' : p99,
+            'queue_avg_bytes' : float(metrics['queue_bytes'].mean()) if metrics['queue_bytes'].size else 0.0}
+
+
+def _screen_one(limit, trace, arr_ms, arr_size, limit_packets, end_ms, base_timestamp):
+    # one buffer size of screen_buffers(), in a worker
+    return dict(queue_summary(simulate(trace, arr_ms, arr_size, limit, limit_packets, end_ms, base_timestamp)), buffer=limit)
+
+
+def screen_buffers(trace, arr_ms, arr_size, limits, limit_packets=False, end_ms=None, base_timestamp=0, workers=1):
+    '''queue_summary() of every droptail buffer size in 'limits' (bytes,
+    or packets with 'limit_packets') for the same trace and arrival
+    process, with 'workers' processes (None for one per CPU). Returns a
+    DataFrame with one row per buffer size.
+
+    '''
+    import functools
+    from pandas import DataFrame
+
+    one = functools.partial(_screen_one, trace=trace, arr_ms=arr_ms, arr_size=arr_size, limit_packets=limit_packets,
+                            end_ms=end_ms, base_timestamp=base_timestamp)
+    if workers == 1:
+        rows = [one(limit) for limit in limits]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(workers) as executor:
+            rows = list(executor.map(one, limits))
+
+    return DataFrame(rows).set_index('buffer')
+
+
+def validate(trace, mmlogfpath, verbose=True):
+    '''Replay the '+' events of a real mm-link log through simulate(),
+    with the queue, base timestamp and length of the log, and compare
+    the per-millisecond series of both (mmparse.mm_log_simple()).
+    Returns a dict per column with the totals of the log and of the
+    simulation, the largest difference in a millisecond and the
+    milliseconds that differ, and the queueing delays of both
+    ('delay': summaries of the departures).
+
+    '''
+    import numpy as np
+    from mmparse import extract_mm_metrics, _mm_log_simple_array
+
+    arr_ms, arr_size, header = load_arrivals(mmlogfpath, verbose=verbose)
+    if header is None:
+        raise ValueError('{} is not an mm log'.format(mmlogfpath))
+    q_type, qsize_unit, qsize_limit = header['queue']
+    if q_type not in ('droptail', 'infinite', None):
+        raise ValueError('only droptail queues can be simulated, the log has {}'.format(q_type))
+
+    real = extract_mm_metrics(mmlogfpath, verbose=verbose)
+    limit = int(qsize_limit) if q_type == 'droptail' else None
+    sim = simulate(trace, arr_ms, arr_size, limit, qsize_unit == 'packets', int(real['ms'][-1]),
+                   header['base_timestamp'], header['init_timestamp'])
+
+    # the same milliseconds in both
+    res_real = _mm_log_simple_array(real)
+    res_sim = _mm_log_simple_array(sim)
+    t0 = max(res_real[0,0], res_sim[0,0])
+    res_real = res_real[res_real[:,0] >= t0]
+    res_sim = res_sim[res_sim[:,0] >= t0]
+    n = min(len(res_real), len(res_sim))
+
+    report = {}
+    for j, name in enumerate(('ingress_bytes', 'egress_bytes', 'dropped_bytes', 'capacity_bytes', 'queue_bytes'), 1):
+        diff = np.abs(res_real[:n,j] - res_sim[:n,j])
+        report[name] = {'log' : res_real[:n,j].sum() if name != 'queue_bytes' else res_real[:n,j].mean(),
+                        'simulated' : res_sim[:n,j].sum() if name != 'queue_bytes' else res_sim[:n,j].mean(),
+                        'max_diff' : diff.max() if n else 0.0,
+                        'ms_differing' : int(np.count_nonzero(diff))}
+    summary_real, summary_sim = queue_summary(real), queue_summary(sim)
+    report['delay'] = {name : (summary_real[name], summary_sim[name]) for name in summary_real if name.startswith('delay')}
+    report['ms'] = n
+
+    return report
+
+
+if __name__ == '__main__':
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Offline droptail mm-link simulator, for buffer sizing')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    def add_common(sub):
+        sub.add_argument('trace', help='mahimahi trace of the link')
+        sub.add_argument('arrivals', help='arrival process: a generate_trace.py trace or an mm log (its \'+\' events)')
+        sub.add_argument('--packets', action='store_true', help='buffer sizes are in packets (default: bytes)')
+        sub.add_argument('--end-ms', type=int, help='simulate until this time (default: the last arrival)')
+        sub.add_argument('--base-timestamp', type=int, help='when the link starts (default: from the mm log, else 0)')
+
+    sub = subparsers.add_parser('simulate', help='simulate one buffer size and write the mm log table (_parsed.txt format)')
+    add_common(sub)
+    sub.add_argument('buffer', type=int, help='buffer size (0: no limit)')
+    sub.add_argument('--output', '-o', help='table to write (default: only print the summary)')
+
+    sub = subparsers.add_parser('screen', help='summary of many buffer sizes')
+    add_common(sub)
+    sub.add_argument('buffers', type=int, nargs='+', help='buffer sizes, or START STOP STEP with --range')
+    sub.add_argument('--range', action='store_true', help='the buffer sizes are START STOP STEP')
+    sub.add_argument('--jobs', '-j', type=int, default=1, help='processes (0: one per CPU, default: 1)')
+    sub.add_argument('--output', '-o', help='CSV to write (default: print)')
+
+    sub = subparsers.add_parser('validate', help='compare the simulation of a real mm log with the log')
+    sub.add_argument('trace', help='mahimahi trace of the link')
+    sub.add_argument('mmlog', help='mm-link log (*_uplink.csv or *_downlink.csv)')
+
+    args = parser.parse_args()
+
+    if args.command == 'validate':
+        report = validate(args.trace, args.mmlog)
+        print('{} ms compared'.format(report.pop('ms')))
+        delay = report.pop('delay')
+        print('{:>16s} {:>16s} {:>16s} {:>12s} {:>14s}'.format('', 'log', 'simulated', 'max diff', 'ms differing'))
+        for name, row in report.items():
+            print('{:>16s} {:>16.0f} {:>16.0f} {:>12.0f} {:>14d}'.format(name, row['log'], row['simulated'], row['max_diff'], row['ms_differing']))
+        for name, (log, simulated) in delay.items():
+            print('{:>16s} {:>16.2f} {:>16.2f}'.format(name, log, simulated))
+        sys.exit(0)
+
+    arr_ms, arr_size, header = load_arrivals(args.arrivals)
+    base_timestamp = args.base_timestamp
+    if base_timestamp is None:
+        base_timestamp = header['base_timestamp'] if header is not None else 0
+
+    if args.command == 'simulate':
+        from mmparse import mm_log_simple, write_mm_table
+
+        metrics = simulate(args.trace, arr_ms, arr_size, args.buffer or None, args.packets, args.end_ms, base_timestamp,
+                           header['init_timestamp'] if header is not None else None)
+        for name, value in queue_summary(metrics).items():
+            print('{}: {}'.format(name, value))
+        if args.output is not None:
+            write_mm_table(args.output, *mm_log_simple(metrics))
+    else:
+        import time
+
+        buffers = list(range(*args.buffers)) if args.range else args.buffers
+        t0 = time.perf_counter()
+        df = screen_buffers(args.trace, arr_ms, arr_size, buffers, args.packets, args.end_ms, base_timestamp, args.jobs or None)
+        print('{} buffer sizes in {:.2f} s'.format(len(buffers), time.perf_counter() - t0), file=sys.stderr)
+        if args.output is not None:
+            df.to_csv(args.output)
+        else:
+            print(df.to_string())
@@ -0,0 +1,233 @@
+import math
+
+
+class RunningMoments(object):
+
+    def __init__(self):
+        '''Count, mean, standard deviation, min and max of a stream of
+        values, in constant memory. Updates take whole arrays, and two
+        of them can be merged (e.g. from separate runs or parse
+        chunks) as if all values had gone into one.
+
+        '''
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, values):
+        import numpy as np
+
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return self
+
+        other = RunningMoments()
+        other.n = values.size
+        other.mean = float(values.mean())
+        other.m2 = float(((values - other.mean)**2).sum())
+        other.min = float(values.min())
+        other.max = float(values.max())
+
+        return self.merge(other)
+
+    def merge(self, other):
+        # parallel variant of Welford's algorithm (Chan et al.)
+        if other.n == 0:
+            return self
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta**2 * self.n * other.n / n
+        self.n = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+        return self
+
+    def std(self, ddof=1):
+        # sample standard deviation by default, like pandas
+        return math.sqrt(self.m2 / (self.n - ddof)) if self.n > ddof else math.nan
+
+    def to_dict(self):
+        return {'n' : self.n, 'mean' : self.mean, 'm2' : self.m2, 'min' : self.min, 'max' : self.max}
+
+    @classmethod
+    def from_dict(cls, d):
+        moments = cls()
+        moments.n, moments.mean, moments.m2, moments.min, moments.max = d['n'], d['mean'], d['m2'], d['min'], d['max']
+        return moments
+
+
+class KLLSketch(object):
+
+    def __init__(self, k=200, seed=None):
+        '''Streaming quantile sketch (Karnin, Lang and Liberty, 2016).
+        Values are kept in levels of sorted buffers where an item at
+        level h stands for 2^h values; a level that outgrows its
+        capacity is compacted by promoting every other item to the
+        level above. Memory is O(k log(n/k)) and the rank error of a
+        quantile is about 1.7/k of n, for one sketch or any merge of
+        sketches.
+
+        As long as nothing has been compacted (fewer than about k
+        values), quantiles are exact and interpolated like
+        numpy.quantile() and pandas.
+
+        k: accuracy parameter
+
+        seed: seed of the coin flips of the compactions
+
+        '''
+        import numpy as np
+
+        self.k = k
+        self.n = 0
+        self.levels = [np.zeros(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, h):
+        # levels further down are smaller
+        depth = len(self.levels) - h - 1
+        return max(int(math.ceil(self.k * (2.0 / 3.0)**depth)), 2)
+
+    def _compress(self):
+        import numpy as np
+
+        h = 0
+        while h < len(self.levels):
+            if self.levels[h].size > self._capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.zeros(0))
+                items = np.sort(self.levels[h])
+                # an odd item out stays where it is
+                keep = items[:items.size % 2]
+                items = items[items.size % 2:]
+                promoted = items[self._rng.integers(2)::2]
+                self.levels[h] = keep
+                self.levels[h+1] = np.concatenate((self.levels[h+1], promoted))
+            h += 1
+
+    def update(self, values):
+        import numpy as np
+
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return self
+        self.levels[0] = np.concatenate((self.levels[0], values))
+        self.n += values.size
+        self._compress()
+
+        return self
+
+    def merge(self, other):
+        import numpy as np
+
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.zeros(0))
+        for h, items in enumerate(other.levels):
+            self.levels[h] = np.concatenate((self.levels[h], items))
+        self.n += other.n
+        self._compress()
+
+        return self
+
+    def _weighted(self):
+        # all items sorted, with their weights
+        import numpy as np
+
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(level.size, 2**h, np.int64) for h, level in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+
+        return items[order], weights[order]
+
+    def quantile(self, q):
+        '''Value at quantile(s) 'q' (between 0 and 1), nan if the sketch
+        is empty.
+
+        '''
+        import numpy as np
+
+        scalar = np.ndim(q) == 0
+        q = np.atleast_1d(np.asarray(q, dtype=float))
+        if self.n == 0:
+            res = np.full(q.size, np.nan)
+        elif len(self.levels) == 1:
+            res = np.quantile(self.levels[0], q)
+        else:
+            items, weights = self._weighted()
+            cum = np.cumsum(weights)
+            res = items[np.minimum(np.searchsorted(cum, q * cum[-1], side='left'), items.size - 1)]
+
+        return float(res[0]) if scalar else res
+
+    def rank(self, value):
+        # estimated fraction of values <= 'value'
+        import numpy as np
+
+        if self.n == 0:
+            return math.nan
+        items, weights = self._weighted()
+
+        return float(weights[items <= value].sum()) / weights.sum()
+
+    def to_dict(self):
+        return {'k' : self.k, 'n' : self.n, 'levels' : [level.tolist() for level in self.levels]}
+
+    @classmethod
+    def from_dict(cls, d, seed=None):
+        import numpy as np
+
+        sketch = cls(d['k'], seed)
+        sketch.n = d['n']
+        sketch.levels = [np.asarray(level, dtype=float) for level in d['levels']]
+
+        return sketch
+
+
+class StreamSummary(object):
+
+    def __init__(self, k=200, seed=None):
+        # running moments and a quantile sketch of the same stream
+        self.moments = RunningMoments()
+        self.sketch = KLLSketch(k, seed)
+
+    def update(self, values):
+        self.moments.update(values)
+        self.sketch.update(values)
+        return self
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def stats(self, quantiles=(0.25, 0.5, 0.75)):
+        '''count, min, max, mean, std and the given quantiles (keys like
+        'q50' for 0.5).
+
+        '''
+        stats = {'count' : self.moments.n,
+                 'min' : self.moments.min if self.moments.n > 0 else math.nan,
+                 'max' : self.moments.max if self.moments.n > 0 else math.nan,
+                 'mean' : self.moments.mean if self.moments.n > 0 else math.nan,
+                 'std' : self.moments.std()}
+        for q, value in zip(quantiles, self.sketch.quantile(list(quantiles))):
+            stats['q{:g}'.format(q * 100)] = float(value)
+
+        return stats
+
+    def to_dict(self):
+        return {'moments' : self.moments.to_dict(), 'sketch' : self.sketch.to_dict()}
+
+    @classmethod
+    def from_dict(cls, d, seed=None):
+        summary = cls(d['sketch']['k'], seed)
+        summary.moments = RunningMoments.from_dict(d['moments'])
+        summary.sketch = KLLSketch.from_dict(d['sketch'], seed)
+
+        return summary
@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import threading
+
+import mmparse
+
+
+class MMLogTail(object):
+
+    def __init__(self, filepath, ms_per_bin=1000, window=10, summary_path=None):
+        '''Follow an mm-link log while mm-link is still writing it (like
+        'tail -f') and keep throughput, capacity, queue size and
+        queueing delay per bin of 'ms_per_bin' ms, without parsing the
+        log again from the start every time.
+
+        filepath: the mm-link log (*_uplink.csv or *_downlink.csv), it
+        doesn't have to exist yet
+
+        ms_per_bin: width of a bin (ms), as in mmparse.parse_mm_throughput()
+
+        window: number of complete bins that rolling() averages over
+
+        summary_path: JSON file rewritten by write_summary() (default:
+        the log name with '_live.json' in place of '.csv')
+
+        '''
+        self.filepath = filepath
+        self.ms_per_bin = ms_per_bin
+        self.window = window
+        self.summary_path = summary_path if summary_path is not None else os.path.splitext(filepath)[0] + '_live.json'
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._reset()
+
+    def _reset(self):
+        import numpy as np
+
+        self.offset = 0
+        self.header = {'init_timestamp' : None,
+                       'base_timestamp' : 0,
+                       'queue' : (None, None, np.inf)}
+        self.last_ms = None
+        self.n_bins = 0
+        self.first_ingress = None
+        self.last_egress = None
+
+        # per bin: capacity, ingress and egress (bits), queue size after
+        # the last event (bytes), sum, count and max of queueing delays
+        self._bits = np.zeros((0, 3), np.int64)
+        self._queue = np.zeros(0, np.int64)
+        self._delay_sum = np.zeros(0)
+        self._delay_n = np.zeros(0, np.int64)
+        self._delay_max = np.zeros(0)
+
+    def _grow(self, n_bins):
+        import numpy as np
+
+        if n_bins > self._queue.size:
+            n = max(n_bins, 2 * self._queue.size, 64)
+            self._bits = np.concatenate((self._bits, np.zeros((n - self._bits.shape[0], 3), np.int64)))
+            self._delay_sum = np.append(self._delay_sum, np.zeros(n - self._queue.size))
+            self._delay_n = np.append(self._delay_n, np.zeros(n - self._queue.size, np.int64))
+            self._delay_max = np.append(self._delay_max, np.zeros(n - self._queue.size))
+            self._queue = np.append(self._queue, np.zeros(n - self._queue.size, np.int64))
+        if n_bins > self.n_bins:
+            # the queue carries over into bins without events
+            if self.n_bins > 0:
+                self._queue[self.n_bins:n_bins] = self._queue[self.n_bins - 1]
+            self.n_bins = n_bins
+
+    def _bin(self, ms):
+        import numpy as np
+
+        return np.maximum((ms - self.header['base_timestamp']) // self.ms_per_bin, 0)
+
+    def poll(self):
+        '''Read whatever complete lines were added to the log since the
+        last call and update the bins. Returns the number of bytes read.
+
+        '''
+        import numpy as np
+
+        try:
+            size = os.path.getsize(self.filepath)
+        except OSError:
+            return 0
+
+        with self._lock:
+            if size < self.offset:
+                # log was truncated or replaced, start over
+                self._reset()
+            if size == self.offset:
+                return 0
+
+            with open(self.filepath, 'rb') as fin:
+                fin.seek(self.offset)
+                chunk = fin.read(size - self.offset)
+            end = chunk.rfind(b'\n') + 1
+            if end == 0:
+                # no complete line yet
+                return 0
+            self.offset += end
+
+            blk = mmparse._MMBlock(chunk[:end])
+            for line in blk.comments:
+                mmparse._parse_mm_header(line, self.header)
+            if blk.n == 0:
+                return end
+
+            (ms, ingress, egress, dropped, capacity, q_last), (delay_ms, delays) = mmparse._reduce_mm_block(blk)
+            if self.last_ms is not None and ms[0] < self.last_ms:
+                raise ValueError('timestamps in the mm log are not monotonic')
+            self.last_ms = int(ms[-1])
+
+            bin_i = self._bin(ms)
+            self._grow(int(bin_i[-1]) + 1)
+            for j, col in enumerate((capacity, ingress, egress)):
+                np.add.at(self._bits[:,j], bin_i, col * 8)
+
+            # bins are in order, the last tick of each one has its queue
+            # size, which also holds for the bins after it until the next
+            # event
+            ends = np.append(np.flatnonzero(bin_i[1:] != bin_i[:-1]), bin_i.size - 1)
+            span = np.arange(bin_i[0], self.n_bins)
+            self._queue[span] = q_last[ends][np.searchsorted(bin_i[ends], span, side='right') - 1]
+
+            if delays.size > 0:
+                delay_bin = self._bin(delay_ms)
+                np.add.at(self._delay_sum, delay_bin, delays)
+                np.add.at(self._delay_n, delay_bin, 1)
+                np.maximum.at(self._delay_max, delay_bin, delays)
+
+            now = time.time()
+            if self.first_ingress is None and ingress.sum() > 0:
+                self.first_ingress = now
+            if egress.sum() > 0:
+                self.last_egress = now
+
+        return end
+
+    def _stats(self, lo, hi):
+        # throughput, capacity (Mbps), utilization (%), queue size
+        # (bytes) and queueing delay (ms) over bins [lo, hi)
+        seconds = (hi - lo) * self.ms_per_bin / 1000.0
+        cap, arr, dep = self._bits[lo:hi].sum(axis=0)
+        delay_n = self._delay_n[lo:hi].sum()
+
+        return {'tput_Mbps' : dep / seconds / 1e6,
+                'capacity_Mbps' : cap / seconds / 1e6,
+                'ingress_Mbps' : arr / seconds / 1e6,
+                'utilization' : dep / cap * 100 if cap > 0 else float('nan'),
+                'queue_bytes' : int(self._queue[hi - 1]),
+                'queue_bytes_avg' : float(self._queue[lo:hi].mean()),
+                'delay_avg_ms' : self._delay_sum[lo:hi].sum() / delay_n if delay_n > 0 else float('nan'),
+                'delay_max_ms' : float(self._delay_max[lo:hi].max()) if delay_n > 0 else float('nan')}
+
+    def rolling(self, window=None):
+        '''Stats over the last 'window' complete bins (the one mm-link
+        is still writing to is left out), or None until there is a
+        complete one. Keys: tput_Mbps, capacity_Mbps, ingress_Mbps, utilization
+        (%), queue_bytes (latest), queue_bytes_avg, delay_avg_ms,
+        delay_max_ms, and the bin range 'bins'.
+
+        '''
+        if window is None:
+            window = self.window
+
+        with self._lock:
+            if self.n_bins < 2:
+                return None
+            hi = self.n_bins - 1
+            lo = max(hi - window, 0)
+            stats = self._stats(lo, hi)
+            stats['bins'] = (lo, hi)
+
+        return stats
+
+    def totals(self):
+        # same as rolling(), over every bin so far
+        with self._lock:
+            if self.n_bins == 0:
+                return None
+            return self._stats(0, self.n_bins)
+
+    def series(self):
+        '''Per bin arrays so far: bin start (s since the base timestamp),
+        throughput, capacity (Mbps), queue size (bytes), mean queueing
+        delay (ms).
+
+        '''
+        import numpy as np
+
+        with self._lock:
+            n = self.n_bins
+            bits = self._bits[:n].astype(float) / (self.ms_per_bin / 1000.0) / 1e6
+            with np.errstate(invalid='ignore', divide='ignore'):
+                delay = self._delay_sum[:n] / self._delay_n[:n]
+            return {'time_s' : np.arange(n) * self.ms_per_bin / 1000.0,
+                    'tput_Mbps' : bits[:,2],
+                    'capacity_Mbps' : bits[:,0],
+                    'queue_bytes' : self._queue[:n].copy(),
+                    'delay_avg_ms' : delay}
+
+    def seconds_since_egress(self):
+        # wall-clock seconds since data last left the queue (since the
+        # first data arrived if none left yet, 0 before any arrived: a
+        # slow start is not a stall)
+        since = self.last_egress if self.last_egress is not None else self.first_ingress
+        return time.time() - since if since is not None else 0.0
+
+    def write_summary(self):
+        # rewrite the summary file (atomically, so that readers never
+        # see half of it)
+        summary = {'log' : self.filepath,
+                   'updated' : time.time(),
+                   'bytes_read' : self.offset,
+                   'ms_per_bin' : self.ms_per_bin,
+                   'n_bins' : self.n_bins,
+                   'last_ms' : self.last_ms,
+                   'init_timestamp' : self.header['init_timestamp'],
+                   'queue' : list(self.header['queue']),
+                   'seconds_since_egress' : self.seconds_since_egress(),
+                   'rolling' : self.rolling(),
+                   'totals' : self.totals()}
+
+        tmppath = self.summary_path + '.{}.tmp'.format(os.getpid())
+        with open(tmppath, 'w') as fout:
+            json.dump(summary, fout, indent=2, default=float)
+        os.replace(tmppath, self.summary_path)
+
+        return summary
+
+    def follow(self, interval=1.0, callback=None):
+        '''Poll the log and rewrite the summary every 'interval' seconds
+        until stop() is called or 'callback(self)' returns True.
+
+        '''
+        while not self._stop.is_set():
+            self.poll()
+            self.write_summary()
+            if callback is not None and callback(self):
+                break
+            self._stop.wait(interval)
+
+        # catch the end of the log
+        self.poll()
+        self.write_summary()
+
+    def start(self, interval=1.0, callback=None):
+        # follow() in a background thread
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.follow, args=(interval, callback), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Follow a growing mm-link log and print rolling stats')
+    parser.add_argument('logfilepath', help='mm-link log file (*_downlink.csv or *_uplink.csv)')
+    parser.add_argument('--ms-per-bin', type=int, default=1000, help='Width of a bin (ms) (default: 1000)')
+    parser.add_argument('--window', type=int, default=10, help='Complete bins in the rolling averages (default: 10)')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between polls (default: 1)')
+    parser.add_argument('--summary', help='Summary file (default: <log>_live.json)')
+    args = parser.parse_args()
+
+    def show(tail):
+        stats = tail.rolling()
+        if stats is not None:
+            print('t={:7.1f} s  tput {:8.2f} Mbps  cap {:8.2f} Mbps  util {:6.2f} %  queue {:8d} B  delay {:8.2f} ms'.format(
+                tail.n_bins * tail.ms_per_bin / 1000.0, stats['tput_Mbps'], stats['capacity_Mbps'],
+                stats['utilization'], stats['queue_bytes'], stats['delay_avg_ms']))
+        return False
+
+    tail = MMLogTail(args.logfilepath, args.ms_per_bin, args.window, args.summary)
+    try:
+        tail.follow(args.interval, show)
+    except KeyboardInterrupt:
+        pass
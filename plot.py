@@ -1,7 +1,10 @@
 from mmparse import *
+from mmpcap import load_pcap_series
+from timing import span, instrumented
 
 import os
 import sys
+import time
 import argparse
 import matplotlib.pyplot as plt
 import numpy as np
@@ -10,16 +13,17 @@ import pandas as pd
 from glob import glob
 
 
-def plot_bgtrace(tracename, inpdir):
+def plot_bgtrace(tracename, inpdir, ms_per_bin=1000):
     plt.rc('font', size=16)
     
     #inpdir = os.path.join('traces', 'channels')
-    bw = parse_trace_file(os.path.join(inpdir, tracename + '.trace1'), pkt_size=1472)
+    with span('parse'):
+        bw = trace_capacity(os.path.join(inpdir, tracename + '.trace1'), ms_per_bin, pkt_size=1472)
     
     fig = plt.figure(figsize=(8,4), facecolor='w')
     ax = fig.add_subplot(111)
     
-    bw_scaled = [v/1e6 for v in bw] # convert bits to megabits
+    bw_scaled = (bw / (ms_per_bin / 1000.0) / 1e6).tolist() # convert bits per bin to megabits per second
     avgbw = round(sum(bw_scaled) * 1.0 / len(bw_scaled), 3)
     maxbw = round(max(bw_scaled), 3)
     print(os.linesep + tracename.upper())
@@ -36,7 +40,7 @@ def plot_bgtrace(tracename, inpdir):
     np.savetxt(saveprefix + '.txt', bw_scaled, fmt='%.6f')
     
     #ax.fill_between(np.arange(len(bw)), 0, bw_scaled, color='#F2D19F')
-    ax.plot(bw_scaled, lw=3, c='r')
+    ax.plot(np.arange(len(bw_scaled)) * ms_per_bin / 1000.0, bw_scaled, lw=3, c='r')
     ax.set_ylabel('Available BW (Mbps)')
     ax.set_xlabel('Time (s)')
     ax.set_title('Avg BW = {:.3f} Mbps, max BW = {:.3f} Mbps'.format(avgbw, maxbw))
@@ -44,92 +48,190 @@ def plot_bgtrace(tracename, inpdir):
     # ax.grid(True, which='both')
     fig.suptitle(tracename)
     fig.subplots_adjust(bottom=0.2, top=0.8, right=0.98)
-    #fig.savefig(saveprefix + '.pdf', dpi=1000, bbox_inches='tight')
-    fig.savefig(saveprefix + '.pdf')
-    #fig.savefig(saveprefix + '.png', dpi=1000, bbox_inches='tight')
-    fig.savefig(saveprefix + '.png')
+    with span('save'):
+        #fig.savefig(saveprefix + '.pdf', dpi=1000, bbox_inches='tight')
+        fig.savefig(saveprefix + '.pdf')
+        #fig.savefig(saveprefix + '.png', dpi=1000, bbox_inches='tight')
+        fig.savefig(saveprefix + '.png')
     plt.show()
     plt.close(fig)
 
 
-def plot_tput_delay(filepath, ms_per_bin=500, skip_seconds=0, title=None, disp=True, save=False):
+# style of the tput-delay plots
+TPUT_DELAY_RC = {'font.size' : 20}
 
-    plt.rc('font', size=20)
 
-    print('Parsing delays ...')
-    delays, delaytimes = parse_mm_queue_delays(filepath)
-    df_delays_full = pd.Series(data=delays, index=pd.Index(delaytimes, name='delaytimes_ms'), name='delay_ms')
-    df_delays_full = df_delays_full.groupby(level=0).mean()
+def plot_tput_delay(filepath, ms_per_bin=500, skip_seconds=0, title=None, disp=True, save=False, verbose=True):
+    with plt.rc_context(TPUT_DELAY_RC):
+        _plot_tput_delay(filepath, ms_per_bin, skip_seconds, title, disp, save, verbose)
 
-    print('Parsing throughput ...')
-    data = parse_mm_throughput(filepath, ms_per_bin)
-    df_tput_full = pd.concat([data['ingress'], data['throughput'], data['capacity']], axis=1)
 
-    # skip certain amount of time in the beginning (if desired)
-    df_delays = df_delays_full[df_delays_full.index > skip_seconds]
-    df_tput = df_tput_full[df_tput_full.index > skip_seconds]
+def _plot_tput_delay(filepath, ms_per_bin, skip_seconds, title, disp, save, verbose):
+    # plot_tput_delay() in whatever style is set (batch workers set
+    # TPUT_DELAY_RC once)
 
-    cap = df_tput['capacity']
-    tput = df_tput['throughput']
-    cap_avg = df_tput['capacity'].mean()
-    tput_avg = df_tput['throughput'].mean()
-    util = (df_tput['throughput'] * 100.0 / df_tput['capacity']).mean()
+    # a single pass over the log gives both delays and throughput
+    with span('parse'):
+        if verbose:
+            print('Parsing mm log ...')
+        metrics = extract_mm_metrics(filepath, verbose=verbose)
+    
+        # mean delay of the packets that entered the queue at the same time
+        delays = metrics['delays'].astype(float)
+        delaytimes = ((metrics['delay_ms'] - metrics['base_timestamp']) - delays) / 1000.0
+        delaytimes, group = np.unique(delaytimes, return_inverse=True)
+        delays = np.bincount(group, weights=delays) / np.bincount(group)
+        df_delays_full = pd.Series(data=delays, index=pd.Index(delaytimes, name='delaytimes_ms'), name='delay_ms')
+
+        data = mm_throughput(metrics, ms_per_bin)
+        df_tput_full = pd.concat([data['ingress'], data['throughput'], data['capacity']], axis=1)
+
+        # skip certain amount of time in the beginning (if desired)
+        df_delays = df_delays_full[df_delays_full.index > skip_seconds]
+        df_tput = df_tput_full[df_tput_full.index > skip_seconds]
+
+        cap = df_tput['capacity']
+        tput = df_tput['throughput']
+        cap_avg = df_tput['capacity'].mean()
+        tput_avg = df_tput['throughput'].mean()
+        util = (df_tput['throughput'] * 100.0 / df_tput['capacity']).mean()
     
-    fig = plt.figure(figsize=(16,12), facecolor='w')
+    with span('render'):
+        fig = plt.figure(figsize=(16,12), facecolor='w')
     
-    ax1 = plt.subplot(2, 1, 1)
-    p1 = ax1.fill_between(cap.index, 0, cap.values, color='#F2D19F', label='Capacity')
-    p2, = ax1.plot(tput.index, tput.values, 'k--', label='Throughput')
+        ax1 = plt.subplot(2, 1, 1)
+        p1 = ax1.fill_between(cap.index, 0, cap.values, color='#F2D19F', label='Capacity')
+        p2, = ax1.plot(tput.index, tput.values, 'k--', label='Throughput')
     
-    ax2 = plt.subplot(2, 1, 2, sharex=ax1)
-    p3, = ax2.plot(df_delays.index, df_delays.values, 'k-', lw=1, label='Delay')
+        ax2 = plt.subplot(2, 1, 2, sharex=ax1)
+        p3, = ax2.plot(df_delays.index, df_delays.values, 'k-', lw=1, label='Delay')
     
-    fig.legend((p1, p2, p3), (p1.get_label(), p2.get_label(), p3.get_label()), loc='lower center', ncol=3, fontsize='small')
+        fig.legend((p1, p2, p3), (p1.get_label(), p2.get_label(), p3.get_label()), loc='lower center', ncol=3, fontsize='small')
 
-    if title is None:
-        title = os.path.splitext(os.path.basename(filepath))[0]
+        if title is None:
+            title = os.path.splitext(os.path.basename(filepath))[0]
 
-    fig.suptitle(title)
+        fig.suptitle(title)
     
-    #ax1.set_title('Cap: {:.2f} Mbps, Tput: {:.2f} Mbps, Util: {:.2f}%'.format(data['capacity_avg'], data['throughput_avg'], (data['throughput_avg'] / data['capacity_avg']) * 100))
-    ax1.set_title('Cap: {:.2f} Mbps, Tput: {:.2f} Mbps, Util: {:.2f}%'.format(cap_avg, tput_avg, util))
-    ax1.set_ylabel('Mbps')
+        #ax1.set_title('Cap: {:.2f} Mbps, Tput: {:.2f} Mbps, Util: {:.2f}%'.format(data['capacity_avg'], data['throughput_avg'], (data['throughput_avg'] / data['capacity_avg']) * 100))
+        ax1.set_title('Cap: {:.2f} Mbps, Tput: {:.2f} Mbps, Util: {:.2f}%'.format(cap_avg, tput_avg, util))
+        ax1.set_ylabel('Mbps')
     
-    ax2.set_title('Delay (min, max, avg) = ({:.2f}, {:.2f}, {:.2f})'.format(df_delays.min(), df_delays.max(), df_delays.mean()))
-    ax2.set_ylabel('Delay (ms)')
+        ax2.set_title('Delay (min, max, avg) = ({:.2f}, {:.2f}, {:.2f})'.format(df_delays.min(), df_delays.max(), df_delays.mean()))
+        ax2.set_ylabel('Delay (ms)')
     
-    ax2.set_xlabel('Time (sec)')
+        ax2.set_xlabel('Time (sec)')
     
-    ax1.tick_params(bottom=0)
-    plt.setp(ax1.xaxis.get_ticklabels(), visible=False)
+        ax1.tick_params(bottom=0)
+        plt.setp(ax1.xaxis.get_ticklabels(), visible=False)
     
-    #plt.xlim(0,60)
-    #fig.tight_layout()
-    fig.subplots_adjust(hspace=0.15)
+        #plt.xlim(0,60)
+        #fig.tight_layout()
+        fig.subplots_adjust(hspace=0.15)
     #ax1.title.set_position((0.5, 0.85))
     #ax2.title.set_position((0.5, 0.85))
     
-    if save:
-        savepath = os.path.splitext(filepath)[0]
-        print('Saving to', savepath)
-        if skip_seconds is None or skip_seconds == 0:
-            fig.savefig(savepath + '.png')
-        else:
-            fig.savefig(savepath + '_skip{}.png'.format(skip_seconds))
-        df_delays_full.to_csv(savepath + '_delays.csv', header=True)
-        with open(savepath + '_tput.csv', 'w') as fout:
-            fout.write('# duration_ms: {}'.format(data['duration_ms']) + os.linesep)
-            fout.write('# ingress_avg: {:.3f}'.format(data['ingress_avg']) + os.linesep)
-            fout.write('# throughput_avg: {:.3f}'.format(data['throughput_avg']) + os.linesep)
-            fout.write('# capacity_avg: {:.3f}'.format(data['capacity_avg']) + os.linesep)
-            fout.write('# utilization: {:.3f}'.format(data['utilization']) + os.linesep)
-            df_tput_full.to_csv(fout)
+    with span('save'):
+        if save:
+            savepath = os.path.splitext(filepath)[0]
+            if verbose:
+                print('Saving to', savepath)
+            if skip_seconds is None or skip_seconds == 0:
+                fig.savefig(savepath + '.png')
+            else:
+                fig.savefig(savepath + '_skip{}.png'.format(skip_seconds))
+            df_delays_full.to_csv(savepath + '_delays.csv', header=True)
+            with open(savepath + '_tput.csv', 'w') as fout:
+                fout.write('# duration_ms: {}'.format(data['duration_ms']) + os.linesep)
+                fout.write('# ingress_avg: {:.3f}'.format(data['ingress_avg']) + os.linesep)
+                fout.write('# throughput_avg: {:.3f}'.format(data['throughput_avg']) + os.linesep)
+                fout.write('# capacity_avg: {:.3f}'.format(data['capacity_avg']) + os.linesep)
+                fout.write('# utilization: {:.3f}'.format(data['utilization']) + os.linesep)
+                df_tput_full.to_csv(fout)
     
     if disp:
         plt.show()
     
     plt.close()
-    plt.rcdefaults()
+
+
+def tput_delay_outputs(filepath, skip_seconds=0):
+    # the files plot_tput_delay(save=True) writes for 'filepath'
+    savepath = os.path.splitext(filepath)[0]
+    png = savepath + '.png' if not skip_seconds else savepath + '_skip{}.png'.format(skip_seconds)
+    return [png, savepath + '_delays.csv', savepath + '_tput.csv']
+
+
+def _up_to_date(filepath, outputs):
+    # every output there, and written after the input last changed
+    try:
+        return min(os.stat(path).st_mtime_ns for path in outputs) >= os.stat(filepath).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def _batch_init():
+    # a worker of plot_tput_delay_batch(): nothing to show, and the
+    # style set once for all its plots
+    plt.switch_backend('Agg')
+    plt.rcParams.update(TPUT_DELAY_RC)
+
+
+def _batch_plot(filepath, ms_per_bin, skip_seconds, title, pstatspath):
+    import contextlib
+    from timing import profiled
+
+    with open(os.devnull, 'w') as fnull, contextlib.redirect_stdout(fnull), profiled(pstatspath):
+        _plot_tput_delay(filepath, ms_per_bin, skip_seconds, title, False, True, False)
+
+
+def plot_tput_delay_batch(filepaths, ms_per_bin=500, skip_seconds=0, title=None, workers=None, force=False, pstatspath=None):
+    '''Save the tput-delay plots (plot_tput_delay(save=True)) of many mm
+    logs, farmed out to a pool of 'workers' processes (default: one
+    per CPU) on the Agg backend. Logs whose outputs are all newer than
+    the log are skipped, unless 'force'.
+
+    Returns the number of logs 'done', 'skipped' and 'failed' (a log
+    that fails is reported and the others go on).
+
+    pstatspath: profile every plot in its worker and save the stats of
+    all of them together there
+
+    '''
+    import pstats
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from tqdm import tqdm
+
+    todo = [fpath for fpath in filepaths if force or not _up_to_date(fpath, tput_delay_outputs(fpath, skip_seconds))]
+    counts = {'done' : 0, 'skipped' : len(filepaths) - len(todo), 'failed' : 0}
+    if not todo:
+        return counts
+
+    workers = min(workers if workers is not None else (os.cpu_count() or 1), len(todo))
+    with ProcessPoolExecutor(workers, initializer=_batch_init) as executor:
+        # one profile per plot, merged once they are all done
+        parts = ['{}.{}'.format(pstatspath, ii) if pstatspath is not None else None for ii in range(len(todo))]
+        futures = {executor.submit(_batch_plot, fpath, ms_per_bin, skip_seconds, title, part) : fpath for fpath, part in zip(todo, parts)}
+        with tqdm(total=len(todo), desc='Plotting ({} workers)'.format(workers), unit='log') as progress:
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    counts['done'] += 1
+                except Exception as e:
+                    counts['failed'] += 1
+                    tqdm.write('Plotting {} failed: {}: {}'.format(futures[future], type(e).__name__, e))
+                progress.update()
+                progress.set_postfix(failed=counts['failed'])
+
+    if pstatspath is not None:
+        parts = [part for part in parts if os.path.exists(part)]
+        if parts:
+            pstats.Stats(*parts).dump_stats(pstatspath)
+            print('Profile of the workers saved to "{}"'.format(pstatspath))
+        for part in parts:
+            os.unlink(part)
+
+    return counts
 
 
 
@@ -140,99 +242,114 @@ def plot_tput_delay_tcpdump(mmlogfilepath, skip_seconds=0, title=None, disp=True
     rtt_savepath = mmlogfilepath.replace('uplink', 'sender_RTT')
     receiver_tput_savepath = mmlogfilepath.replace('uplink', 'receiver_tput')
 
-    print('Reading tput and RTT ...')
-    #df_rtt = pd.read_csv(rtt_savepath, index_col=0, header=None, names=['timestamp', 'rtt'])
-    df_rtt = pd.read_csv(rtt_savepath, header=None, names=['timestamp', 'rtt'])
-    df_rtt.set_index('timestamp', inplace=True)
-    df_rtt['seconds'] = df_rtt.index.values.round()
-    df_rtt = df_rtt.groupby('seconds').mean()
-    df_rtt.loc[:, 'rtt'] = df_rtt.rtt.values * 1000 # convert RTT to milliseconds 
-
-    #df_tput = pd.read_csv(receiver_tput_savepath, index_col=0, header=None, names=['timestamp', 'tput'])
-    df_tput = pd.read_csv(receiver_tput_savepath, header=None, names=['timestamp', 'tput'])
-    df_tput.set_index('timestamp', inplace=True)
-    df_tput['seconds'] = df_tput.index.values.round()
-    df_tput = df_tput.groupby('seconds').sum()
-    df_tput.loc[:, 'tput'] = df_tput.tput.values * 8 / 1e6 # convert bytes to megabits
-
-    print('Parsing mm log ...')
-    #data = parse_mm_throughput(mmlogfilepath, 1000)
-    #df_mm = pd.concat([data['ingress'], data['throughput'], data['capacity']], axis=1)
-    df_mm, (q_type, qsize_unit, qsize) = parse_mm_log_simple(mmlogfilepath)
-    df_mm['seconds'] = df_mm.index.values.round()
-    df_mm = df_mm.drop('queue_bytes', axis=1).groupby('seconds').sum()
-
-    # skip certain amount of time in the beginning (if desired)
-    df_rtt = df_rtt[df_rtt.index >= (df_rtt.index[0] + skip_seconds)]
-    df_tput = df_tput[df_tput.index >= (df_tput.index[0] + skip_seconds)]
-    df_mm = df_mm[df_mm.index >= (df_mm.index[0] + skip_seconds)]
-
-    # cap_mm = df_mm['capacity']
-    # tput_mm = df_mm['throughput']
-    # util_mm = (df_mm['throughput'] * 100.0 / df_mm['capacity']).mean()
-    cap_mm = (df_mm.capacity_bytes * 8 / 1e6)
-    tput_mm = (df_mm.egress_bytes * 8 / 1e6)
-    dropped_mm = (df_mm.dropped_bytes * 8 / 1e6)
-    util_mm = (df_mm.egress_bytes * 100.0 / df_mm.capacity_bytes).mean()
+    with span('read'):
+        print('Reading tput and RTT ...')
+        # extracted from the captures by mmpcap (.npz, or .csv from tshark
+        # for older runs)
+        #df_rtt = pd.read_csv(rtt_savepath, index_col=0, header=None, names=['timestamp', 'rtt'])
+        timestamp, rtt = load_pcap_series(rtt_savepath)
+        df_rtt = pd.DataFrame({'rtt' : rtt}, index=pd.Index(timestamp, name='timestamp'))
+        df_rtt['seconds'] = df_rtt.index.values.round()
+        df_rtt = df_rtt.groupby('seconds').mean()
+        df_rtt.loc[:, 'rtt'] = df_rtt.rtt.values * 1000 # convert RTT to milliseconds 
+
+        #df_tput = pd.read_csv(receiver_tput_savepath, index_col=0, header=None, names=['timestamp', 'tput'])
+        # (runs measured with TCP_INFO have no throughput at the receiver)
+        df_tput = None
+        if any(os.path.exists(os.path.splitext(receiver_tput_savepath)[0] + ext) for ext in ('.npz', '.csv')):
+            timestamp, tput = load_pcap_series(receiver_tput_savepath)
+            df_tput = pd.DataFrame({'tput' : tput}, index=pd.Index(timestamp, name='timestamp'))
+            df_tput['seconds'] = df_tput.index.values.round()
+            df_tput = df_tput.groupby('seconds').sum()
+            df_tput.loc[:, 'tput'] = df_tput.tput.values * 8 / 1e6 # convert bytes to megabits
+
+    with span('parse'):
+        print('Parsing mm log ...')
+        #data = parse_mm_throughput(mmlogfilepath, 1000)
+        #df_mm = pd.concat([data['ingress'], data['throughput'], data['capacity']], axis=1)
+        # 1 s bins, served from the pyramid stored next to the log
+        df_mm = pyramid_frame(mm_pyramid(mmlogfilepath), 1000).drop('queue_bytes', axis=1)
+        df_mm.index.name = 'seconds'
+
+        # skip certain amount of time in the beginning (if desired)
+        df_rtt = df_rtt[df_rtt.index >= (df_rtt.index[0] + skip_seconds)]
+        if df_tput is not None:
+            df_tput = df_tput[df_tput.index >= (df_tput.index[0] + skip_seconds)]
+        df_mm = df_mm[df_mm.index >= (df_mm.index[0] + skip_seconds)]
+
+        # cap_mm = df_mm['capacity']
+        # tput_mm = df_mm['throughput']
+        # util_mm = (df_mm['throughput'] * 100.0 / df_mm['capacity']).mean()
+        cap_mm = (df_mm.capacity_bytes * 8 / 1e6)
+        tput_mm = (df_mm.egress_bytes * 8 / 1e6)
+        dropped_mm = (df_mm.dropped_bytes * 8 / 1e6)
+        util_mm = (df_mm.egress_bytes * 100.0 / df_mm.capacity_bytes).mean()
     
-    fig = plt.figure(figsize=(16,12), facecolor='w')
+    with span('render'):
+        fig = plt.figure(figsize=(16,12), facecolor='w')
     
-    ax1 = plt.subplot(3, 1, 1)
-    #p1 = ax1.fill_between(cap_mm.index, 0, cap_mm.values, color='#F2D19F', label='Capacity')
-    p1 = ax1.fill_between(cap_mm.index - cap_mm.index[0] + 1, 0, cap_mm.values, color='#F2D19F', label='Capacity')
-    #p2, = ax1.plot(tput_mm.index, tput_mm.values, 'k--', label='Throughput')
-    p2, = ax1.plot(tput_mm.index - tput_mm.index[0] + 1, tput_mm.values, 'k--', label='Throughput')
-    #p4, = ax1.plot(df_tput.index - data['init_timestamp'], df_tput.tput, 'r:', label='Throughput (tcpdump)')
-    p4, = ax1.plot(df_tput.index - df_tput.index[0] + 1, df_tput.tput, 'r:', label='Throughput (tcpdump)')
+        ax1 = plt.subplot(3, 1, 1)
+        #p1 = ax1.fill_between(cap_mm.index, 0, cap_mm.values, color='#F2D19F', label='Capacity')
+        p1 = ax1.fill_between(cap_mm.index - cap_mm.index[0] + 1, 0, cap_mm.values, color='#F2D19F', label='Capacity')
+        #p2, = ax1.plot(tput_mm.index, tput_mm.values, 'k--', label='Throughput')
+        p2, = ax1.plot(tput_mm.index - tput_mm.index[0] + 1, tput_mm.values, 'k--', label='Throughput')
+        #p4, = ax1.plot(df_tput.index - data['init_timestamp'], df_tput.tput, 'r:', label='Throughput (tcpdump)')
+        if df_tput is not None:
+            p4, = ax1.plot(df_tput.index - df_tput.index[0] + 1, df_tput.tput, 'r:', label='Throughput (tcpdump)')
     
-    ax2 = plt.subplot(3, 1, 2, sharex=ax1)
-    p3, = ax2.plot(df_rtt.index - df_rtt.index[0] + 1, df_rtt.rtt, 'k-', lw=1, label='RTT')
+        ax2 = plt.subplot(3, 1, 2, sharex=ax1)
+        p3, = ax2.plot(df_rtt.index - df_rtt.index[0] + 1, df_rtt.rtt, 'k-', lw=1, label='RTT')
 
-    ax3 = plt.subplot(3, 1, 3, sharex=ax1)
-    p5, = ax3.plot(dropped_mm.index - dropped_mm.index[0] + 1, dropped_mm.values, 'r-', label='Dropped')
+        ax3 = plt.subplot(3, 1, 3, sharex=ax1)
+        p5, = ax3.plot(dropped_mm.index - dropped_mm.index[0] + 1, dropped_mm.values, 'r-', label='Dropped')
     
-    fig.legend((p1, p2, p4, p3, p5), (p1.get_label(), p2.get_label(), p4.get_label(), p3.get_label(), p5.get_label()), loc='lower center', ncol=5, fontsize='small')
+        handles = (p1, p2, p4, p3, p5) if df_tput is not None else (p1, p2, p3, p5)
+        fig.legend(handles, [h.get_label() for h in handles], loc='lower center', ncol=len(handles), fontsize='small')
 
-    if title is None:
-        title = os.path.splitext(os.path.basename(mmlogfilepath))[0]
+        if title is None:
+            title = os.path.splitext(os.path.basename(mmlogfilepath))[0]
 
-    fig.suptitle(title)
+        fig.suptitle(title)
     
-    #ax1.set_title('Cap: {:.2f} Mbps, Tput: {:.2f} Mbps, Util: {:.2f}%'.format(data['capacity_avg'], data['throughput_avg'], (data['throughput_avg'] / data['capacity_avg']) * 100))
-    ax1.set_title('Cap: {:.2f} Mbps, Tput: {:.2f} Mbps, Tput (tcpdump): {:.2f} Mbps, Dropped: {:.2f} Mbps, Util: {:.2f}%'.format(cap_mm.mean(), tput_mm.mean(), df_tput.tput.mean(), dropped_mm.mean(), util_mm), fontsize='small')
-    ax1.set_ylabel('Mbps')
+        #ax1.set_title('Cap: {:.2f} Mbps, Tput: {:.2f} Mbps, Util: {:.2f}%'.format(data['capacity_avg'], data['throughput_avg'], (data['throughput_avg'] / data['capacity_avg']) * 100))
+        if df_tput is not None:
+            ax1.set_title('Cap: {:.2f} Mbps, Tput: {:.2f} Mbps, Tput (tcpdump): {:.2f} Mbps, Dropped: {:.2f} Mbps, Util: {:.2f}%'.format(cap_mm.mean(), tput_mm.mean(), df_tput.tput.mean(), dropped_mm.mean(), util_mm), fontsize='small')
+        else:
+            ax1.set_title('Cap: {:.2f} Mbps, Tput: {:.2f} Mbps, Dropped: {:.2f} Mbps, Util: {:.2f}%'.format(cap_mm.mean(), tput_mm.mean(), dropped_mm.mean(), util_mm), fontsize='small')
+        ax1.set_ylabel('Mbps')
     
-    ax2.set_title('RTT (min, max, avg) = ({:.2f}, {:.2f}, {:.2f})'.format(df_rtt.rtt.min(), df_rtt.rtt.max(), df_rtt.rtt.mean()), fontsize='small')
-    ax2.set_ylabel('RTT (ms)')
+        ax2.set_title('RTT (min, max, avg) = ({:.2f}, {:.2f}, {:.2f})'.format(df_rtt.rtt.min(), df_rtt.rtt.max(), df_rtt.rtt.mean()), fontsize='small')
+        ax2.set_ylabel('RTT (ms)')
     
-    ax3.set_ylabel('Dropped (Mbps)')
+        ax3.set_ylabel('Dropped (Mbps)')
 
-    ax3.set_xlabel('Time (s)')
+        ax3.set_xlabel('Time (s)')
     
-    ax1.tick_params(bottom=0)
-    plt.setp(ax1.xaxis.get_ticklabels(), visible=False)
+        ax1.tick_params(bottom=0)
+        plt.setp(ax1.xaxis.get_ticklabels(), visible=False)
     
-    #plt.xlim(0,60)
-    #fig.tight_layout()
-    fig.subplots_adjust(hspace=0.15)
+        #plt.xlim(0,60)
+        #fig.tight_layout()
+        fig.subplots_adjust(hspace=0.15)
     #ax1.title.set_position((0.5, 0.85))
     #ax2.title.set_position((0.5, 0.85))
     
-    savepath = os.path.splitext(mmlogfilepath)[0]
-    if save:
-        print('Saving to', savepath)
-        if skip_seconds is None or skip_seconds == 0:
-            fig.savefig(savepath + '.png')
-        else:
-            fig.savefig(savepath + '_skip{}.png'.format(skip_seconds))
-        #df_delays_full.to_csv(savepath + '_mmdelays.csv', header=True)
-    with open(savepath + '_mmtput.csv', 'w') as fout:
-        # fout.write('# duration_ms: {}'.format(data['duration_ms']) + os.linesep)
-        # fout.write('# ingress_avg: {:.3f}'.format(data['ingress_avg']) + os.linesep)
-        # fout.write('# throughput_avg: {:.3f}'.format(data['throughput_avg']) + os.linesep)
-        # fout.write('# capacity_avg: {:.3f}'.format(data['capacity_avg']) + os.linesep)
-        # fout.write('# utilization: {:.3f}'.format(data['utilization']) + os.linesep)
-        df_mm.to_csv(fout)
+    with span('save'):
+        savepath = os.path.splitext(mmlogfilepath)[0]
+        if save:
+            print('Saving to', savepath)
+            if skip_seconds is None or skip_seconds == 0:
+                fig.savefig(savepath + '.png')
+            else:
+                fig.savefig(savepath + '_skip{}.png'.format(skip_seconds))
+            #df_delays_full.to_csv(savepath + '_mmdelays.csv', header=True)
+        with open(savepath + '_mmtput.csv', 'w') as fout:
+            # fout.write('# duration_ms: {}'.format(data['duration_ms']) + os.linesep)
+            # fout.write('# ingress_avg: {:.3f}'.format(data['ingress_avg']) + os.linesep)
+            # fout.write('# throughput_avg: {:.3f}'.format(data['throughput_avg']) + os.linesep)
+            # fout.write('# capacity_avg: {:.3f}'.format(data['capacity_avg']) + os.linesep)
+            # fout.write('# utilization: {:.3f}'.format(data['utilization']) + os.linesep)
+            df_mm.to_csv(fout)
     
     if disp:
         plt.show()
@@ -245,6 +362,8 @@ def plot_tput_delay_tcpdump(mmlogfilepath, skip_seconds=0, title=None, disp=True
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
+    parser.add_argument('--manifest', help='Save the timing of every phase (and the rusage) to this JSON manifest')
+    parser.add_argument('--profile', action='store_true', help='Run under cProfile, with the stats next to the manifest (default: plot_manifest.json next to the plots)')
 
     subparsers = parser.add_subparsers(title='Types of plots to make',
                                        help='List of valid plot names',
@@ -252,33 +371,52 @@ if __name__ == '__main__':
     parser_a = subparsers.add_parser('bgtrace', aliases=['trace'])
     parser_a.add_argument('names', nargs='+', help='Name of a bg trace in traces/channels/')
     parser_a.add_argument('--dir', default=os.path.join('traces', 'channels'), help='Directory where to find the traces')
+    parser_a.add_argument('--ms-per-bin', type=int, default=1000, help='Milliseconds (ms) per bin (default: 1000)')
 
     parser_b = subparsers.add_parser('tput_delay', aliases=['tput', 'delay'])
     parser_b.add_argument('mmfilepaths', nargs='+', help='Name of a mm log file (*_downlink.csv or *_uplink.csv) or directory')
     parser_b.add_argument('--title', help='Title for plot')
     parser_b.add_argument('--ms-per-bin', type=int, default=500, help='Milliseconds (ms) per bin')
     parser_b.add_argument('--skip-seconds', type=float, default=0, help='Seconds to skip from the beginning to calculate tput and utilization (default: 0)')
-    parser_b.add_argument('--dir', default=False, action='store_true')
+    parser_b.add_argument('--dir', default=False, action='store_true', help='Plot every mm log in the directory, with a pool of workers')
+    parser_b.add_argument('--pattern', default='*_downlink.csv', help='With --dir, the mm logs to plot (default: *_downlink.csv)')
+    parser_b.add_argument('--jobs', '-j', type=int, help='With --dir, plots made at a time (default: one per CPU)')
+    parser_b.add_argument('--force', action='store_true', help='With --dir, also redo the plots that are newer than their log')
 
     args = parser.parse_args()
 
+    manifest = args.manifest
+    if manifest is None and args.profile and args.plot_type is not None:
+        if args.plot_type == 'bgtrace':
+            outdir = args.dir
+        else:
+            outdir = args.mmfilepaths[0] if args.dir else os.path.dirname(args.mmfilepaths[0])
+        manifest = os.path.join(outdir, 'plot_manifest.json')
+
     if args.plot_type is None:
         print('At least one plot_type should be specified.')
         parser.print_usage()
 
     elif args.plot_type == 'bgtrace':
-        for name in args.names:
-            plot_bgtrace(name, args.dir)
+        with instrumented(manifest, 'bgtrace', args.profile):
+            for name in args.names:
+                with span(name):
+                    plot_bgtrace(name, args.dir, args.ms_per_bin)
 
     elif args.plot_type == 'tput_delay':
-        if not args.dir:
-            for fpath in args.mmfilepaths:
-                plot_tput_delay(fpath, args.ms_per_bin, args.title, save=True)
-        else:
-            # batch generation of tput-delay plots for all results
-            assert len(args.mmfilepaths) == 1
-            flist = glob(os.path.join(args.mmfilepaths[0], '*_downlink.csv'))
-            flist.sort()
-            for jj, fpath in enumerate(flist, 1):
-                print('{}/{} {}'.format(jj, len(flist), fpath))
-                plot_tput_delay(fpath, args.ms_per_bin, args.skip_seconds, args.title, disp=False, save=True)
+        # the batch is plotted by workers, which profile themselves (the
+        # parent only waits for them)
+        pstatspath = os.path.join(os.path.dirname(manifest), 'tput_delay.pstats') if args.profile and args.dir else None
+        with instrumented(manifest, 'tput_delay', args.profile and not args.dir, pstatspath):
+            if not args.dir:
+                for fpath in args.mmfilepaths:
+                    with span(os.path.basename(fpath)):
+                        plot_tput_delay(fpath, args.ms_per_bin, args.skip_seconds, args.title, save=True)
+            else:
+                # batch generation of tput-delay plots for all results
+                assert len(args.mmfilepaths) == 1
+                flist = glob(os.path.join(args.mmfilepaths[0], args.pattern))
+                flist.sort()
+                t0 = time.time()
+                counts = plot_tput_delay_batch(flist, args.ms_per_bin, args.skip_seconds, args.title, args.jobs, args.force, pstatspath)
+                print('{} plotted, {} up to date, {} failed in {:.1f} s'.format(counts['done'], counts['skipped'], counts['failed'], time.time() - t0))
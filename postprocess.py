@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import shutil
+import contextlib
+import threading
+
+
+class PostprocessQueue(object):
+
+    # backpressure: a simulation waits before it starts while this many
+    # runs are waiting for (or in) post-processing, while there is less
+    # than this much space left on the disk of the queue, or while the
+    # load average per CPU is above this
+    MAX_BACKLOG = 4
+    MIN_FREE_BYTES = 2 << 30
+    MAX_LOAD = 1.5
+
+    def __init__(self, dbpath):
+        '''
+        Persistent (SQLite) queue of the post-processing of simulation
+        runs: one row per run with the measurement, its arguments, state
+        ('pending', 'running', 'done' or 'failed'), times, the files it
+        produced and the error if it failed.
+
+        Simulations put their runs in it (Simulation.run() with
+        'postprocess_queue') and go on with the next one right away, a
+        PostprocessPool works through it. Tasks survive both: a pool
+        started later picks up whatever is left.
+
+        '''
+        self.dbpath = dbpath
+        self._lock = threading.Lock()
+        with self._connect() as con:
+            con.execute('''CREATE TABLE IF NOT EXISTS tasks (
+                               id INTEGER PRIMARY KEY AUTOINCREMENT,
+                               prefix TEXT NOT NULL,
+                               task TEXT NOT NULL,
+                               state TEXT NOT NULL DEFAULT 'pending',
+                               submitted REAL NOT NULL,
+                               started REAL,
+                               finished REAL,
+                               artifacts TEXT,
+                               error TEXT)''')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # one transaction, committed unless it raises
+        import sqlite3
+
+        con = sqlite3.connect(self.dbpath, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def put(self, measurement, server_ip, savepathprefix, mmlogfpath, save_plot=True, skip_seconds=0, profile=False):
+        # a run to post-process, returns its task id
+        task = {'measurement' : type(measurement).__name__, 'server_ip' : server_ip, 'savepathprefix' : savepathprefix,
+                'mmlogfpath' : mmlogfpath, 'save_plot' : save_plot, 'skip_seconds' : skip_seconds, 'profile' : profile}
+        with self._lock, self._connect() as con:
+            return con.execute('INSERT INTO tasks (prefix, task, submitted) VALUES (?, ?, ?)',
+                               (savepathprefix, json.dumps(task), time.time())).lastrowid
+
+    def claim(self):
+        '''The oldest pending task (a dict with its 'id' and 'submitted'
+        time), marked as running, or None if there is none. Several
+        pools may claim from the same queue.
+
+        '''
+        while True:
+            with self._lock, self._connect() as con:
+                row = con.execute("SELECT id, task, submitted FROM tasks WHERE state = 'pending' ORDER BY id LIMIT 1").fetchone()
+                if row is None:
+                    return None
+                cur = con.execute("UPDATE tasks SET state = 'running', started = ? WHERE id = ? AND state = 'pending'",
+                                  (time.time(), row[0]))
+            if cur.rowcount == 1:
+                return dict(json.loads(row[1]), id=row[0], submitted=row[2])
+
+    def finish(self, taskid, state, artifacts=None, error=None):
+        with self._lock, self._connect() as con:
+            con.execute('UPDATE tasks SET state = ?, finished = ?, artifacts = ?, error = ? WHERE id = ?',
+                        (state, time.time(), json.dumps(artifacts) if artifacts is not None else None, error, taskid))
+
+    def requeue(self):
+        # tasks left running by a pool that is gone (only call it when
+        # no other pool works on this queue)
+        with self._lock, self._connect() as con:
+            return con.execute("UPDATE tasks SET state = 'pending', started = NULL WHERE state = 'running'").rowcount
+
+    def prefixes(self):
+        with self._lock, self._connect() as con:
+            return set(row[0] for row in con.execute('SELECT prefix FROM tasks'))
+
+    def counts(self):
+        # number of tasks per state
+        with self._lock, self._connect() as con:
+            return dict(con.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state').fetchall())
+
+    def backlog(self):
+        counts = self.counts()
+        return counts.get('pending', 0) + counts.get('running', 0)
+
+    def pressure(self, max_backlog=None, min_free_bytes=None, max_load=None):
+        '''Why the next simulation should wait (as text), or None if it
+        can go ahead.
+
+        '''
+        max_backlog = max_backlog if max_backlog is not None else self.MAX_BACKLOG
+        min_free_bytes = min_free_bytes if min_free_bytes is not None else self.MIN_FREE_BYTES
+        max_load = max_load if max_load is not None else self.MAX_LOAD
+
+        backlog = self.backlog()
+        if backlog >= max_backlog:
+            return '{} runs waiting for post-processing'.format(backlog)
+        free = shutil.disk_usage(os.path.dirname(os.path.abspath(self.dbpath))).free
+        if free < min_free_bytes:
+            return '{:.1f} GiB left on disk'.format(free / (1 << 30))
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+        if load > max_load:
+            return 'load average {:.2f} per CPU'.format(load)
+        return None
+
+    def wait_for_room(self, max_backlog=None, min_free_bytes=None, max_load=None, interval=5, verbose=1):
+        # block while pressure() says so, returns the seconds waited
+        t0 = time.time()
+        reason = self.pressure(max_backlog, min_free_bytes, max_load)
+        if reason is not None and verbose >= 1:
+            print('Waiting for post-processing to catch up ({}) ...'.format(reason), flush=True)
+        while reason is not None:
+            time.sleep(interval)
+            reason = self.pressure(max_backlog, min_free_bytes, max_load)
+        return time.time() - t0
+
+
+def _files(savepathprefix):
+    # the files of a run, with their modification times
+    savedir = os.path.dirname(savepathprefix)
+    name = os.path.basename(savepathprefix)
+    files = {}
+    for entry in os.listdir(savedir or '.'):
+        path = os.path.join(savedir, entry)
+        if entry.startswith(name) and os.path.isfile(path):
+            files[path] = os.stat(path).st_mtime_ns
+    return files
+
+
+def postprocess_task(task):
+    '''Post-process one run of the queue (in a pool worker): the
+    postprocess() of its measurement (a simulation module class), with
+    its output in '<prefix>_postprocess.log'. Returns the files it
+    wrote (the artifacts of the run).
+
+    Its timing goes in the manifest of the run, under 'postprocess',
+    with cProfile stats in '<prefix>_postprocess.pstats' if the run
+    asked for them.
+
+    '''
+    # plots are saved, never shown
+    os.environ['MPLBACKEND'] = 'Agg'
+    import simulation
+    from timing import RunTimer, profiled, update_manifest
+
+    before = _files(task['savepathprefix'])
+    measurement = getattr(simulation, task['measurement'])()
+    timer = RunTimer()
+    pstatspath = task['savepathprefix'] + '_postprocess.pstats' if task.get('profile') else None
+    with open(task['savepathprefix'] + '_postprocess.log', 'w') as flog, \
+         contextlib.redirect_stdout(flog), contextlib.redirect_stderr(flog):
+        status = 'failed'
+        try:
+            with timer.activate(), timer.span('postprocess'), profiled(pstatspath):
+                measurement.postprocess(task['server_ip'], task['savepathprefix'], task['mmlogfpath'], False,
+                                        task['save_plot'], task['skip_seconds'])
+            status = 'ok'
+        finally:
+            update_manifest(task['savepathprefix'] + '_manifest.json', timer, postprocess_status=status,
+                            postprocess_wait_s=timer.started - task['submitted'], profile=pstatspath)
+    return sorted(path for path, mtime in _files(task['savepathprefix']).items() if before.get(path) != mtime)
+
+
+class PostprocessPool(object):
+
+    def __init__(self, queue, workers=None, poll=1.0, verbose=1, callback=None):
+        '''
+        Work through a PostprocessQueue with up to 'workers' runs
+        (default: one per CPU) post-processed at a time, each in a
+        process of its own.
+
+        poll: seconds between looks at the queue for new tasks
+
+        callback: called as callback(task, state, artifacts) whenever a
+        run is done ('done' or 'failed'), from the thread of run()
+
+        '''
+        self.queue = queue
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.poll = poll
+        self.verbose = verbose
+        self.callback = callback
+        self._stop = threading.Event()
+
+    def stop(self):
+        # no more tasks are coming: run() returns once the queue is empty
+        self._stop.set()
+
+    def _report(self, line):
+        if self.verbose:
+            print(line, flush=True)
+
+    def _finish(self, task, future):
+        try:
+            paths = future.result()
+            state, error = 'done', None
+            # written at the same time by a run whose name starts like
+            # this one's (e.g. with a suffix)
+            prefix = task['savepathprefix']
+            others = [other for other in self.queue.prefixes() if other.startswith(prefix) and other != prefix]
+            paths = [path for path in paths if not any(path.startswith(other) for other in others)]
+        except Exception as e:
+            paths, state, error = None, 'failed', '{}: {}'.format(type(e).__name__, e)
+        self.queue.finish(task['id'], state, paths, error)
+
+        name = os.path.basename(task['savepathprefix'])
+        if state == 'done':
+            self._report('Artifacts of {} ready ({:.0f} s after the run): {}'.format(
+                name, time.time() - task['submitted'], ', '.join(os.path.basename(path) for path in paths)))
+        else:
+            self._report('Post-processing of {} failed: {}'.format(name, error))
+        if self.callback is not None:
+            self.callback(task, state, paths)
+
+    def run(self, follow=False):
+        '''Post-process the runs in the queue, with 'follow' also those
+        put in it later until stop() is called. Returns the counts of
+        tasks per state.
+
+        '''
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+        requeued = self.queue.requeue()
+        if requeued:
+            self._report('{} unfinished post-processing task{} back in the queue'.format(requeued, 's' if requeued > 1 else ''))
+
+        running = {}
+        with ProcessPoolExecutor(self.workers) as executor:
+            while True:
+                while len(running) < self.workers:
+                    task = self.queue.claim()
+                    if task is None:
+                        break
+                    self._report('Post-processing {} ...'.format(os.path.basename(task['savepathprefix'])))
+                    running[executor.submit(postprocess_task, task)] = task
+
+                if not running and (not follow or self._stop.is_set()) and self.queue.counts().get('pending', 0) == 0:
+                    break
+
+                if running:
+                    done, _ = wait(list(running), timeout=self.poll, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._finish(running.pop(future), future)
+                else:
+                    self._stop.wait(self.poll)
+
+        return self.queue.counts()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Post-process the simulation runs in a queue')
+    parser.add_argument('queue', help='Post-processing queue (SQLite, e.g. output/postprocess.db)')
+    parser.add_argument('--jobs', '-j', type=int, help='Runs post-processed at a time (default: one per CPU)')
+    parser.add_argument('--follow', '-f', action='store_true', help='Keep waiting for new runs (until Ctrl-C)')
+    args = parser.parse_args()
+
+    print(PostprocessPool(PostprocessQueue(args.queue), args.jobs).run(args.follow))
@@ -0,0 +1,132 @@
+import os
+import time
+
+
+class NotReady(Exception):
+    pass
+
+
+async def wait_for_async(condition, deadline=10.0, interval=0.005, max_interval=0.2, what=None, exited=None):
+    '''Poll 'condition()' until it returns something true, starting
+    every 'interval' seconds and backing off (doubling) up to
+    'max_interval'. Returns the seconds it took.
+
+    Raises NotReady after 'deadline' seconds, or as soon as 'exited()'
+    (the return code of the process we wait for, None while it runs)
+    says it is gone.
+
+    '''
+    import asyncio
+
+    t0 = time.perf_counter()
+    while not condition():
+        elapsed = time.perf_counter() - t0
+        returncode = exited() if exited is not None else None
+        if returncode is not None:
+            raise NotReady('{} exited (return code {}) before being ready'.format(what or 'process', returncode))
+        if elapsed > deadline:
+            raise NotReady('{} not ready after {:.1f} s'.format(what or 'condition', deadline))
+        await asyncio.sleep(min(interval, max(deadline - elapsed, 0)))
+        interval = min(interval * 2, max_interval)
+
+    return time.perf_counter() - t0
+
+
+def children(pid):
+    # pids of the direct children of 'pid' (Linux)
+    try:
+        with open('/proc/{0}/task/{0}/children'.format(pid)) as fin:
+            return [int(p) for p in fin.read().split()]
+    except OSError:
+        pass
+
+    # kernels without CONFIG_PROC_CHILDREN
+    pids = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open('/proc/{}/stat'.format(entry)) as fin:
+                    # the field after the (command) is the state, then the ppid
+                    if int(fin.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    return pids
+
+
+def descendants(pid):
+    # 'pid' and all processes below it
+    pids = [pid]
+    i = 0
+    while i < len(pids):
+        pids.extend(children(pids[i]))
+        i += 1
+    return pids
+
+
+def _net_ns(pid):
+    try:
+        return os.readlink('/proc/{}/ns/net'.format(pid))
+    except OSError:
+        return None
+
+
+def listening(port, pid=None):
+    '''True if a TCP socket listens on 'port', in this network namespace
+    or, with 'pid', in that of 'pid' or any of its descendants (e.g.
+    a receiver inside an mm-link shell started as 'pid').
+
+    Reads /proc/<pid>/net/tcp{,6}, so nothing connects to the port.
+
+    '''
+    pids = descendants(pid) if pid is not None else ['self']
+    hexport = ':{:04X}'.format(port)
+    seen = set()
+    for p in pids:
+        ns = _net_ns(p)
+        if ns is None or ns in seen:
+            continue
+        seen.add(ns)
+        for table in ('tcp', 'tcp6'):
+            try:
+                with open('/proc/{}/net/{}'.format(p, table)) as fin:
+                    next(fin)
+                    for line in fin:
+                        fields = line.split()
+                        # state 0A is LISTEN
+                        if fields[1].endswith(hexport) and fields[3] == '0A':
+                            return True
+            except OSError:
+                pass
+    return False
+
+
+def file_opened(path):
+    # e.g. tcpdump creates its -w file once the capture is open
+    return os.path.exists(path)
+
+
+def shell_wait_for_file(path, deadline=10.0):
+    # sh snippet waiting for file_opened(path) in a mahimahi shell
+    return 'i=0; while [ ! -e {0} ] && [ $i -lt {1} ]; do sleep 0.01; i=$((i+1)); done; '.format(path, int(deadline * 100))
+
+
+class StartupTimer(object):
+
+    def __init__(self):
+        '''Seconds spent waiting for each part of a run to be ready, in
+        the order they were waited for.
+
+        '''
+        self.waits = []
+
+    async def wait_async(self, what, condition, deadline=10.0, exited=None):
+        elapsed = await wait_for_async(condition, deadline, what=what, exited=exited)
+        self.waits.append((what, elapsed))
+        return elapsed
+
+    def total(self):
+        return sum(elapsed for _, elapsed in self.waits)
+
+    def __str__(self):
+        return 'Startup: ' + ', '.join('{} {:.0f} ms'.format(what, elapsed * 1000) for what, elapsed in self.waits)
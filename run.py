@@ -36,7 +36,7 @@ def RunVERUS():
 		os.makedirs(args.dir+ "/output_verus/"+str(args.name))
 	
 	print("Begin " + str(args.time) + " seconds of verus transmission")
-	command = "./verus_protocol/verus/src/verus_server -name "+args.dir + "/output_verus/"+str(args.name)+" -p 60001 -t "+ str(args.time)#+" > rubbishVerus"
+	command = "./verus_protocol/verus/src/verus_server -name "+args.dir + "/output_verus/"+str(args.name)+" -p "+str(args.port)+" -t "+ str(args.time)#+" > rubbishVerus"
 	print command
 	pro = Popen(command, stdout=PIPE, shell=True, preexec_fn=os.setsid)
 	# tracepath = os.path.join('traces', 'channels', args.trace)
@@ -44,11 +44,15 @@ def RunVERUS():
 	# tmp = "mm-link ./"+str(args.trace)+" ./"+str(args.trace)+"--uplink-log "+str(args.dir)+"/output_verus/"+args.name+"-uplink.csv --downlink-log "+str(args.dir)+"/verus/"+str(args.name)+"/"+args.name+"-downlink.csv"
 	tmp= "mm-link ./"+str(args.trace)+" ./"+str(args.trace)+ " --meter-all --uplink-log "+str(args.dir)+"/output_verus/"+str(args.name)+"/"+args.name+"_uplink.csv --downlink-log "+str(args.dir)+"/output_verus/"+str(args.name)+"/"+args.name+"_downlink.csv --uplink-queue=droptail --uplink-queue-args=bytes={}".format(args.queue)
 	p = Popen(tmp, stdin=PIPE,shell=True)
-	p.communicate("./verus_protocol/verus/src/verus_client $MAHIMAHI_BASE -p 60001\nexit\n")
+	p.communicate("./verus_protocol/verus/src/verus_client $MAHIMAHI_BASE -p "+str(args.port)+"\nexit\n")
 
-	os.system("ps | pgrep -f verus_server | xargs kill -9")
-	os.system("ps | pgrep -f verus_client | xargs kill -9")
-	os.system("mv client_60001* "+args.dir+"/output_verus/"+str(args.name)+"/")
+	# only this run's server and client, other runs may be going on
+	try:
+		os.killpg(pro.pid, signal.SIGKILL)
+	except OSError:
+		pass
+	os.system("pkill -9 -f 'verus_client .* -p "+str(args.port)+"$'")
+	os.system("mv client_"+str(args.port)+"* "+args.dir+"/output_verus/"+str(args.name)+"/")
 	sleep(5)
 
 
@@ -63,5 +67,6 @@ if __name__ == '__main__':
 	parser.add_argument('--tcp_probe',help="whether tcp probe should be run or not",action='store_true',default=False)
 	parser.add_argument('--command', '-c', help="mm-link command to run", required=False)                
 	parser.add_argument('--queue', '-q', type=positive_int, help='Buffer size in mahimahi (bytes)')
+	parser.add_argument('--port', '-p', type=int, help='Port of the verus server (default: 60001)', default=60001)
 	args = parser.parse_args()
 	simpleRun()
\ No newline at end of file
@@ -1,4 +1,7 @@
 import os
+import argparse
+
+from scheduler import Job, run_jobs
 # import arg_parser
 
 time= 60
@@ -17,15 +20,23 @@ trace_list = 2 * trace_list
 buf_len_list = buf_len_list_1 + buf_len_list_2
 
 
+parser = argparse.ArgumentParser(description='Run run.py over all (trace, buffer size) pairs')
+parser.add_argument('--jobs', '-j', type=int, default=1, help='Runs at a time (default: 1)')
+parser.add_argument('--timeout', type=float, help='Seconds after which a run is killed (default: no limit)')
+parser.add_argument('--retries', type=int, default=0, help='Times to retry a run that fails or times out (default: 0)')
+parser.add_argument('--base-port', type=int, default=60001, help='Port of the first run slot (default: 60001)')
+args = parser.parse_args()
+
+jobs = []
 for trace, buf_len in zip(trace_list, buf_len_list):
-	print('**** Trace: {}, Buffer size: {} bytes ****'.format(trace, buf_len))
-	traces=str(trace)
-	trace = 'traces/channels/'+str(trace)
-	command = "python run.py -tr "+trace
+	name = "{0}_T{1}_128KiB_Q{2}".format(trace, time, buf_len)
+	command = "python run.py -tr traces/channels/"+str(trace)
 	command += " -t "+str(time)
 	command += " -q "+str(buf_len)
-	command += " --name "+"{0}_T{1}_128KiB_Q{2}".format(traces,time,buf_len)
-	command += " --dir "+dir 
+	command += " --name "+name
+	command += " --dir "+dir
 	command += " --algo copa"
-	
-	os.system(command)
+	command += " --port {port}"
+	jobs.append(Job(name, command, args.timeout, args.retries))
+
+run_jobs(jobs, args.jobs, args.base_port, logdir=os.path.join(dir, 'logs'))
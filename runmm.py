@@ -1,21 +1,16 @@
 import os, sys
-import signal
 import argparse
-import threading
-import subprocess as sp
 
-from time import sleep
-from plot import plot_tput_delay
+from simulation import Simulation as SimulationCore, MMLink
 
 
-class Simulation(object):
-    PORT = 9999
-    BLKSIZE_DEFAULT = 128
-    TTR_DEFAULT = 10
+class Simulation(SimulationCore):
     
     def __init__(self, trace, port=None, ttr=None, n_blks=None, filepath=None, blksize=None, cc_algo=None, buf_len=None, iperf=False):
         '''
-        Class for running mahimahi simulations on mmwave channel traces.
+        Class for running mahimahi simulations on mmwave channel traces
+        (simulation.Simulation with an mm-link shell at either end, a
+        single sender and the mm log as the measurement).
         
         trace: the mmwave channel trace to use for this simulation
         
@@ -38,36 +33,10 @@ class Simulation(object):
         iperf: whether to use iperf or not instead of our custom sender/receiver
         
         '''
-        # the trace to use to emulate the link 
-        self.trace = trace
-        
-        self.port = port if port is not None else Simulation.PORT
-        
-        # packet sending mode
-        self.ttr = self.n_blks = self.filepath = None
-        if (ttr is not None) + (n_blks is not None) + (filepath is not None) > 1:
-            raise Exception('only one of \'ttr\', \'n_blks\' and \'filepath\' may be specified')
-        if n_blks is not None:
-            self.n_blks = n_blks
-        elif filepath is not None:
-            self.filepath = filepath
-        else:
-            self.ttr = ttr if ttr is not None else Simulation.TTR_DEFAULT
-        
-        # sending block size
-        self.blksize = blksize if blksize is not None else Simulation.BLKSIZE_DEFAULT
-        
-        # the congestion control algo
-        self.cc_algo = cc_algo
-        
-        # length of buffer in mahimahi
-        self.buf_len = buf_len
-        
-        # use iperf instead of our sender and receiver?
-        self.iperf = iperf
+        SimulationCore.__init__(self, trace, port, ttr, n_blks, filepath, blksize, cc_algo, buf_len, iperf)
     
     
-    def run(self, savedir='output', mm_side='receiver', log=False, verbose=0, disp_plot=False, save_plot=True):
+    def run(self, savedir='output', mm_side='receiver', log=False, verbose=0, disp_plot=False, save_plot=True, live_interval=None, stall_timeout=None, suffix=None, postprocess_queue=None, profile=False):
         ''' Run the simulation with following runtime options.
         
         savedir: directory where to store outputs
@@ -79,151 +48,27 @@ class Simulation(object):
         disp_plot: display a plot
         
         save_plot: save the plot
-        '''
-        
-        # make output directories
-        if not os.path.exists(savedir):
-            os.makedirs(savedir)
-        
-        print('Saving all output to this directory: "{}"'.format(savedir))
-        
-        # fixing dest file names
-        if self.ttr is not None:
-            saveprefix = '{}_T{}'.format(self.trace, self.ttr)
-        elif self.n_blks is not None:
-            saveprefix = '{}_N{}'.format(self.trace, self.n_blks)
-        else:
-            assert (self.filepath is not None)
-            filename = os.path.splitext(os.path.basename(self.filepath))[0]
-            saveprefix = '{}_file_{}'.format(self.trace, filename)
-        
-        saveprefix += '_{}KiB'.format(self.blksize)
-        
-        if self.buf_len is not None:
-            saveprefix += '_Q{}'.format(self.buf_len)
-        
-        savepathprefix = os.path.join(savedir, saveprefix)
-        
-        # starting the simulations
-        
-        # (i) receiver command
-        receiver_cmd = 'sender_receiver/receiver {} 1 {}'.format(self.port, int(verbose >= 1))
-        if log:
-            recvlogdir = savepathprefix + '_receiver'
-            if not os.path.exists(recvlogdir):
-                os.mkdir(recvlogdir)
-            receiver_cmd += ' --log {}'.format(os.path.join(recvlogdir, 'recvlog'))
-        
-        # (ii) mm command
-        tracepath = os.path.join('traces', 'channels', self.trace)
-        # mm_cmd = 'mm-link {0} {0} --uplink-log {1}_uplink.csv --downlink-log {1}_downlink.csv'.format(tracepath, savepathprefix)
-        if mm_side== "receiver":
-            mm_cmd = 'mm-link {0} {0} --downlink-log {1}_downlink.csv'.format(tracepath, savepathprefix)
-        else:
-            mm_cmd = 'mm-link {0} {0} --uplink-log {1}_uplink.csv'.format(tracepath, savepathprefix)
 
-        if self.buf_len is not None:
-            # mm_cmd += ' --uplink-queue=droptail --uplink-queue-args=bytes={}'.format(self.buf_len)
-            mm_cmd += ' --uplink-queue=droptail --uplink-queue-args=bytes={}'.format(self.buf_len)
-            mm_cmd += ' --downlink-queue=droptail --downlink-queue-args=bytes={}'.format(self.buf_len)
-        
-        # (iii) sender command
-        sender_cmd = 'sender_receiver/sender {{}} {}'.format(self.port)
-        if self.filepath is not None:
-            sender_cmd += ' -f {}'.format(self.filepath)
-        elif self.n_blks is not None:
-            sender_cmd += ' -n {}'.format(self.n_blks)
-        else:
-            sender_cmd += ' -t {}'.format(self.ttr)
-        if self.blksize != Simulation.BLKSIZE_DEFAULT:
-            sender_cmd += ' -b {}'.format(self.blksize)
-        if self.cc_algo is not None:
-            sender_cmd += ' -C {}'.format(self.cc_algo)
-        if log:
-            sender_cmd += ' -l {}'.format(savepathprefix + '_sender.log')
-        
-        if mm_side == 'sender':
-            server_ip = '100.64.0.1' # MAHIMAHI_BASE: address exposed by native machine to processes inside mahimahi
+        live_interval: follow the mm log while the simulation runs and
+        rewrite a '*_live.json' summary next to it every so many
+        seconds (off by default)
 
-            mmlogfpath = savepathprefix + '_uplink.csv'
-            
-            # starting the receiver in a separate process
-            if verbose >= 1:
-                print('Starting receiver using command:', receiver_cmd)
-            if verbose >= 2:
-                receiver_process = sp.Popen(receiver_cmd.split(), universal_newlines=True)
-            else:
-                receiver_process = sp.Popen(receiver_cmd.split(), stdin=sp.PIPE, stdout=sp.PIPE, universal_newlines=True)
-            
-            if verbose >= 2:
-                print('Receiver process started, pid', receiver_process.pid)
-            
-            # starting the sender and mahimahi in a separate process
-            sender_cmd = mm_cmd + ' -- ' + sender_cmd.format(server_ip)
-            if verbose >= 1:
-                print('Starting sender inside mahimahi using command:', sender_cmd)
-            if verbose >= 2:
-                sender_process = sp.Popen(sender_cmd.split(), universal_newlines=True)
-            else:
-                sender_process = sp.Popen(sender_cmd.split(), stdin=sp.PIPE, stdout=sp.PIPE, universal_newlines=True)
-            
-            if verbose >= 2:
-                print('Sender process started, pid', sender_process.pid)
-            
-        elif mm_side == 'receiver':
-            server_ip = '100.64.0.2' # address exposed by mahimahi to processes outside
+        stall_timeout: with 'live_interval', abort the run if nothing
+        has left the mm-link queue for this many seconds
 
-            mmlogfpath = savepathprefix + '_downlink.csv'
-            
-            # starting the receiver and mahimahi in a separate process
-            receiver_cmd = mm_cmd + ' -- ' + receiver_cmd
-            if verbose >= 1:
-                print('Starting receiver inside Mahimahi using command:', receiver_cmd)
-            if verbose >= 2:
-                receiver_process = sp.Popen(receiver_cmd.split(), universal_newlines=True)
-            else:
-                receiver_process = sp.Popen(receiver_cmd.split(), stdin=sp.PIPE, stdout=sp.PIPE, universal_newlines=True)
-            
-            # to ensure the mm interface gets up
-            if verbose >= 2:
-                print('Waiting for mm-interface to get up ...')
-            sleep(1)
-            
-            if verbose >= 2:
-                print('Receiver process started, pid', receiver_process.pid)
-            
-            # starting the sender
-            sender_cmd = sender_cmd.format(server_ip)
-            if verbose >= 1:
-                print('Starting sender using command:', sender_cmd)
-            if verbose >= 2:
-                sender_process = sp.Popen(sender_cmd.split())
-            else:
-                sender_process = sp.Popen(sender_cmd.split(), stdin=sp.PIPE, stdout=sp.PIPE)
-            
-            if verbose >= 2:
-                print('Sender started, pid', sender_process.pid)
-            
-        else:
-            raise Exception('mm_side option should be \'sender\' or \'receiver\' only')
-        
-        # waiting for processes to close
-        if verbose >= 1:
-            print('Waiting for sender process ...')
-        sender_process_retcode = sender_process.wait()
-        if verbose >= 2:
-            print('Sender process returned', sender_process_retcode)
-        
-        if verbose >= 1:
-            print('Waiting for receiver process ...')
-        receiver_process_retcode = receiver_process.wait()
-        if verbose >= 2:
-            print('Receiver process returned', receiver_process_retcode)
-            
-        print('Plotting performance ...')
-        plot_tput_delay(mmlogfpath, title=os.path.basename(savepathprefix), disp=disp_plot, save=save_plot)
+        suffix: appended to the names of the output files (e.g. to tell
+        apart runs with the same settings)
+
+        postprocess_queue: leave the plotting to a post-processing pool
+        working on this queue (see simulation.Simulation.run())
+
+        profile: run the post-processing under cProfile (see
+        simulation.Simulation.run())
+        '''
+        self.link = MMLink(mm_side)
         
-        return
+        return SimulationCore.run(self, savedir, log, verbose, disp_plot, save_plot, live_interval, stall_timeout, suffix,
+                                  postprocess_queue=postprocess_queue, profile=profile)
 
 
 def unsigned_int(arg):
@@ -312,6 +157,21 @@ if __name__ == '__main__':
     parser.add_argument('--save-plot', action='store_true',
                         help='Save the tput-delay plot',
                         default=False)
+
+    parser.add_argument('--live-interval', type=float, metavar='SECONDS',
+                        help='Follow the mm log during the run and update a live summary every so many seconds')
+
+    parser.add_argument('--stall-timeout', type=float, metavar='SECONDS',
+                        help='With --live-interval, abort the run if nothing leaves the mm-link queue for this long')
+
+    parser.add_argument('--suffix',
+                        help='Suffix for the names of the output files')
+
+    parser.add_argument('--postprocess-queue', metavar='QUEUE_DB',
+                        help='Queue the post-processing for postprocess.py instead of doing it after the run')
+
+    parser.add_argument('--profile', action='store_true',
+                        help='Run the post-processing under cProfile, with the stats in *_postprocess.pstats')
     
     args = parser.parse_args()
 
@@ -319,6 +179,6 @@ if __name__ == '__main__':
     
     sim = Simulation(args.trace, args.port, args.ttr, args.n_blocks, args.filepath, args.blksize, args.cc_algo, args.buf_len, args.iperf)
     
-    sim.run(args.dir, args.mm_side, args.log, args.verbose, args.disp_plot, args.save_plot)
+    sim.run(args.dir, args.mm_side, args.log, args.verbose, args.disp_plot, args.save_plot, args.live_interval, args.stall_timeout, args.suffix, args.postprocess_queue, args.profile)
     
     print("Finished")
@@ -1,22 +1,18 @@
 # same as runmm.py but changing the way simulation is being run
 
 import os, sys
-import signal
 import argparse
-import threading
-import subprocess as sp
 
-from time import sleep
-from plot import plot_tput_delay, plot_tput_delay_tcpdump
+from simulation import Simulation as SimulationCore, MMDelayLink, TimedSender, PcapMeasurement, TcpInfoMeasurement
 from utils import *
 
-class Simulation(object):
-    PORT = 9999
-    BLKSIZE_DEFAULT = 128
-    TTR_DEFAULT = 10
+class Simulation(SimulationCore):
     
     def __init__(self, trace, port=None, ttr=None, n_blks=None, filepath=None, blksize=None, cc_algo=None, buf_len=None, mm_delay=None, iperf=False):
-        '''Class for running mahimahi simulations on mmwave channel traces.
+        '''Class for running mahimahi simulations on mmwave channel traces
+        (simulation.Simulation with the sender inside mm-delay and
+        mm-link shells, stopped after 'ttr' seconds, and tcpdump
+        captures at both ends).
         
         trace: the mmwave channel trace to use for this simulation
         
@@ -43,38 +39,13 @@ class Simulation(object):
         sender/receiver
 
         '''
-        # the trace to use to emulate the link 
-        self.trace = trace
-        
-        self.port = port if port is not None else Simulation.PORT
-        
-        # packet sending mode
-        self.ttr = self.n_blks = self.filepath = None
-        if (ttr is not None) + (n_blks is not None) + (filepath is not None) > 1:
-            raise Exception('only one of \'ttr\', \'n_blks\' and \'filepath\' may be specified')
-        if n_blks is not None:
-            self.n_blks = n_blks
-        elif filepath is not None:
-            self.filepath = filepath
-        else:
-            self.ttr = ttr if ttr is not None else Simulation.TTR_DEFAULT
-        
-        # sending block size
-        self.blksize = blksize if blksize is not None else Simulation.BLKSIZE_DEFAULT
-        
-        # the congestion control algo
-        self.cc_algo = cc_algo
-        
-        # length of buffer in mahimahi
-        self.buf_len = buf_len
+        SimulationCore.__init__(self, trace, port, ttr, n_blks, filepath, blksize, cc_algo, buf_len, iperf,
+                                link=MMDelayLink(mm_delay), traffic=TimedSender(), measurement=PcapMeasurement())
 
         # value of delay to give to mm-delay
         self.mm_delay = mm_delay
-        
-        # use iperf instead of our sender and receiver?
-        self.iperf = iperf
 
-    def run(self, savedir='output', log=False, skip_seconds=0, verbose=0, disp_plot=False, save_plot=True, suffix=None):
+    def run(self, savedir='output', log=False, skip_seconds=0, verbose=0, disp_plot=False, save_plot=True, suffix=None, postprocess_queue=None, tcpinfo=None, capture_segment_mb=None, profile=False):
         '''Run the simulation with following runtime options.
         
         savedir: directory where to store outputs
@@ -90,156 +61,30 @@ class Simulation(object):
         
         save_plot: save the plot
 
-        '''
-        
-        # make output directories
-        if not os.path.exists(savedir):
-            os.makedirs(savedir)
-        
-        print('Saving all output to this directory: "{}"'.format(savedir))
-        
-        # fixing dest file names
-        if self.ttr is not None:
-            saveprefix = '{}_T{}'.format(os.path.splitext(self.trace)[0], self.ttr)
-        elif self.n_blks is not None:
-            saveprefix = '{}_N{}'.format(self.trace, self.n_blks)
-        else:
-            assert (self.filepath is not None)
-            filename = os.path.splitext(os.path.basename(self.filepath))[0]
-            saveprefix = '{}_file_{}'.format(self.trace, filename)
-        
-        saveprefix += '_{}KiB'.format(self.blksize)
-        
-        if self.buf_len is not None:
-            saveprefix += '_Q{:.0f}'.format(self.buf_len)
+        suffix: appended to the names of the output files
 
-        if self.mm_delay is not None and self.mm_delay > 0:
-            saveprefix += '_delay{:02d}'.format(self.mm_delay)
+        postprocess_queue: leave the tshark extraction and the plotting
+        to a post-processing pool working on this queue, so that the
+        next run can start right away (see
+        simulation.Simulation.run())
 
-        if suffix is not None:
-            saveprefix += '_' + suffix
-        
-        savepathprefix = os.path.join(savedir, saveprefix)
-        
-        # starting the simulations
-        
-        # (i) receiver command
-        receiver_cmd = 'sender_receiver/receiver {} 1 {}'.format(self.port, int(verbose >= 1))
-        if log:
-            recvlogdir = savepathprefix + '_receiver'
-            if not os.path.exists(recvlogdir):
-                os.mkdir(recvlogdir)
-            receiver_cmd += ' --log {}'.format(os.path.join(recvlogdir, 'recvlog'))
-        
-        # (ii) mm command
-        tracepath = os.path.join('traces', 'channels', self.trace)
-        mm_cmd = 'mm-link {0} {0} --uplink-log {1}_uplink.csv'.format(tracepath, savepathprefix)
-        if self.mm_delay is not None and self.mm_delay > 0:
-            mm_cmd = 'mm-delay {} '.format(self.mm_delay) + mm_cmd
+        tcpinfo: measure the RTT by sampling TCP_INFO in the sender
+        every so many milliseconds instead of capturing packets (no
+        tcpdump, and no throughput at the receiver other than the mm
+        log's)
 
-        if self.buf_len is not None:
-            # mm_cmd += ' --uplink-queue=droptail --uplink-queue-args=bytes={}'.format(self.buf_len)
-            mm_cmd += ' --uplink-queue=droptail --uplink-queue-args=bytes={}'.format(self.buf_len)
-            mm_cmd += ' --downlink-queue=droptail --downlink-queue-args=bytes={}'.format(self.buf_len)
-        
-        # (iii) sender command
-        sender_cmd = 'sender_receiver/sender {{}} {}'.format(self.port)
-        #if self.filepath is not None:
-        #    sender_cmd += ' -f {}'.format(self.filepath)
-        #elif self.n_blks is not None:
-        #    sender_cmd += ' -n {}'.format(self.n_blks)
-        #else:
-        #    sender_cmd += ' -t {}'.format(self.ttr)
-        sender_cmd += ' -t 305'
-        if self.blksize != Simulation.BLKSIZE_DEFAULT:
-            sender_cmd += ' -b {}'.format(self.blksize)
-        if self.cc_algo is not None:
-            sender_cmd += ' -C {}'.format(self.cc_algo)
-        if log:
-            sender_cmd += ' -l {}'.format(savepathprefix + '_sender.log')
-        
-        server_ip = '100.64.0.1' # MAHIMAHI_BASE: address exposed by native machine to processes inside mahimahi
+        capture_segment_mb: rotate the captures into files of this many
+        MB, each processed and deleted as soon as it is complete, so
+        that long runs do not fill the disk
 
-        mmlogfpath = savepathprefix + '_uplink.csv'
+        profile: run the extraction and the plotting under cProfile
+        (see simulation.Simulation.run())
 
-        # starting the receiver in a separate process
-        if verbose >= 1:
-            print('Starting receiver using command:', receiver_cmd)
-        
-        # receiver_process = sp.Popen('sudo tcpdump -i any -s 96 -w {}_receiver.pcap & '.format(savepathprefix) + receiver_cmd, shell=True, universal_newlines=True, preexec_fn=os.setsid)
-        os.system('sudo tcpdump -i any -s 96 -w {}_receiver.pcap & '.format(savepathprefix) + receiver_cmd + ' &')
-        sleep(2)
-
-        # if verbose >= 2:
-        #     print('Receiver process started, pid', receiver_process.pid)
-
-        # starting the sender and mahimahi in a separate process
-        #sender_cmd = mm_cmd 
-        if verbose >= 1:
-            print('Starting mahimahi using command:', mm_cmd)
-
-        sender_process = sp.Popen(mm_cmd, stdin=sp.PIPE, shell=True, universal_newlines=True)
-        sleep(2)
-
-        if verbose >= 2:
-            print('Mahimahi process started, pid', sender_process.pid)
-
-        # output = sp.check_output("ifconfig", shell=True, universal_newlines=True)
-        # interface = "delay-"+output.split("delay-")[-1].split(":")[0]
-        # os.system("sudo ifconfig {0} txqueuelen 10000000".format(interface))
-        # sleep(1)
-        # sender_process.communicate('sudo ifconfig ingress txqueuelen 10000000 &&' + sender_cmd.format(server_ip) + '& \n sleep ' + str(self.ttr) + ' \n exit')
-
-        sender_cmd = sender_cmd.format(server_ip)
-        if verbose >= 1:
-            print('Starting sender process inside mahimahi using command:', sender_cmd)
-
-        sender_process.communicate('sudo tcpdump -i any -s96 -w {}_sender.pcap & '.format(savepathprefix) + sender_cmd + ' & \n sleep ' + str(self.ttr) + ' \n exit')
-
-        os.system('ps | pgrep -f sender_receiver/sender | xargs kill -TERM')
-        os.system('ps | pgrep -f sender_receiver/receiver | xargs kill -TERM')
-        os.system('ps | pgrep -f tcpdump | sudo xargs kill -TERM')
-        os.system('ps | pgrep -f tcpdump | sudo xargs kill -TERM')
-
-        # waiting for processes to close
-        #if verbose >= 1:
-        #    print('Waiting for sender process ...')
-        #sender_process_retcode = sender_process.wait()
-        #if verbose >= 2:
-        #    print('Sender process returned', sender_process_retcode)
-        #
-        #if verbose >= 1:
-        #    print('Waiting for receiver process ...')
-        #receiver_process_retcode = receiver_process.wait()
-        #if verbose >= 2:
-        #    print('Receiver process returned', receiver_process_retcode)
-
-        # first extract throughput at receiver
-        tput_cmd = 'tshark -r {0}_receiver.pcap -Y "ip.dst=={1}" -T fields -e frame.time_epoch -e frame.len -E separator=, > {0}_receiver_tput.csv'.format(savepathprefix, server_ip)
-        print('Extracting throughput at receiver:', tput_cmd)
-        os.system(tput_cmd)
-        print('Saved to "{}_receiver_tput.csv"'.format(savepathprefix))
-        os.unlink('{}_receiver.pcap'.format(savepathprefix))
-
-        # # next extract throughput at sender
-        # sender_tput_savepath = os.path.splitext(sender_pcap)[0] + '_tput.csv'
-        # cmd = tput_cmd.format(sender_pcap, server_ip, sender_tput_savepath)
-        # print('Extracting throughput at sender:', cmd)
-        # os.system(cmd)
-        # print('Saved to "{}"'.format(sender_tput_savepath))
-        
-        # next get RTT at sender
-        rtt_cmd = 'tshark -r {0}_sender.pcap -Y "tcp.analysis.ack_rtt && ip.src=={1}" -T fields -e frame.time_epoch -e tcp.analysis.ack_rtt -E separator=, > {0}_sender_RTT.csv'.format(savepathprefix, server_ip)
-        print('Extracting RTT:', rtt_cmd)
-        os.system(rtt_cmd)
-        print('Saved to "{}_sender_RTT.csv"'.format(savepathprefix))
-        os.unlink('{}_sender.pcap'.format(savepathprefix))
-            
-        print('Plotting performance ...')
-        #plot_tput_delay(mmlogfpath, skip_seconds=skip_seconds, title=os.path.basename(savepathprefix), disp=disp_plot, save=save_plot)
-        plot_tput_delay_tcpdump(mmlogfpath, skip_seconds=skip_seconds, title=os.path.basename(savepathprefix), disp=disp_plot, save=save_plot)
+        '''
+        self.measurement = TcpInfoMeasurement(tcpinfo) if tcpinfo is not None else PcapMeasurement(capture_segment_mb)
 
-        return
+        return SimulationCore.run(self, savedir, log, verbose, disp_plot, save_plot, suffix=suffix, skip_seconds=skip_seconds,
+                                  postprocess_queue=postprocess_queue, profile=profile)
 
 if __name__ == '__main__':
     ''' Interactive program to run a full simulation. '''
@@ -307,6 +152,21 @@ if __name__ == '__main__':
     parser.add_argument('--save-plot', action='store_true',
                         help='Save the tput-delay plot',
                         default=False)
+
+    parser.add_argument('--suffix',
+                        help='Suffix for the names of the output files')
+
+    parser.add_argument('--postprocess-queue', metavar='QUEUE_DB',
+                        help='Queue the post-processing for postprocess.py instead of doing it after the run')
+
+    parser.add_argument('--tcpinfo', type=float, metavar='INTERVAL_MS',
+                        help='Sample TCP_INFO in the sender every INTERVAL_MS for the RTT instead of running tcpdump')
+
+    parser.add_argument('--capture-segment-mb', type=float, metavar='MB',
+                        help='Rotate the packet captures every MB megabytes, processing and deleting each segment during the run')
+
+    parser.add_argument('--profile', action='store_true',
+                        help='Run the post-processing under cProfile, with the stats in *_postprocess.pstats')
     
     args = parser.parse_args()
 
@@ -314,6 +174,6 @@ if __name__ == '__main__':
     
     sim = Simulation(args.trace, args.port, args.ttr, args.n_blocks, args.filepath, args.blksize, args.cc_algo, args.buf_len, args.mm_delay, args.iperf)
     
-    sim.run(args.dir, args.log, args.skip_seconds, args.verbose, args.disp_plot, args.save_plot)
+    sim.run(args.dir, args.log, args.skip_seconds, args.verbose, args.disp_plot, args.save_plot, args.suffix, args.postprocess_queue, args.tcpinfo, args.capture_segment_mb, args.profile)
     
     print("Finished")
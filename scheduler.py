@@ -0,0 +1,350 @@
+import os, sys
+import time
+import signal
+import socket
+import threading
+import subprocess as sp
+
+
+class Job(object):
+
+    def __init__(self, name, cmd, timeout=None, retries=0, cwd=None, env=None, check=None, exclusive=False):
+        '''
+        One experiment run for run_jobs().
+
+        name: unique name of the run, also the name of its log file and
+        (through '{name}') usable as its output prefix or suffix
+
+        cmd: the command, a list of arguments or a string that is split
+        on whitespace; '{port}', '{name}' and '{slot}' in it are
+        replaced by the port given to the run, its name and the index of
+        the worker slot running it
+
+        timeout: seconds after which the run is killed (None: no limit)
+
+        retries: how many more times to try a run that fails or times
+        out
+
+        cwd: working directory of the run (default: the current one)
+
+        env: extra environment variables for the run
+
+        check: called as check(job) after the run returns 0; the run
+        counts as failed ('invalid') unless it returns True (e.g. when
+        an output file is missing)
+
+        exclusive: the run cannot go on together with others (see
+        check_concurrent())
+
+        '''
+        self.name = name
+        self.cmd = cmd.split() if isinstance(cmd, str) else list(cmd)
+        self.timeout = timeout
+        self.retries = retries
+        self.cwd = cwd
+        self.env = env if env is not None else {}
+        self.check = check
+        self.exclusive = exclusive
+
+    def command(self, port, slot):
+        return [arg.format(port=port, name=self.name, slot=slot) for arg in self.cmd]
+
+
+def simulation_job(sim, savedir='output', suffix=None, timeout=None, retries=0, script=None, **run_args):
+    '''Job that runs the runmm*.Simulation 'sim' with the command line
+    of its own script (runmm.py for runmm.Simulation, and so on), on the
+    port the scheduler gives it. The job is named like the output files
+    of the run, which makes runs with the same settings clash; tell
+    those apart with 'suffix'.
+
+    savedir: output directory, relative to the top of the repository
+    (where the script runs)
+
+    run_args: options of the script (e.g. mm_side='sender' becomes
+    '--mm-side sender', log=True becomes '--log')
+
+    Runs that go on together each get their own mm-link shell, and with
+    it their own address; a sender outside mahimahi only reaches the
+    first one at 100.64.0.2, so runs with the receiver inside (the
+    default of runmm.py, and runmm_multi.py with more than one sender)
+    are exclusive and can only run one at a time.
+
+    '''
+    if script is None:
+        script = sys.modules[type(sim).__module__].__file__
+    script = os.path.abspath(script)
+
+    name = sim.saveprefix(suffix)
+    # runmm.py picks the side when it runs, runmm_multi.py puts the
+    # receiver inside for more than one sender
+    mm_side = 'receiver' if sim.traffic.n_senders > 1 else run_args.get('mm_side', sim.link.mm_side)
+
+    cmd = [sys.executable, script, sim.trace, '--port', '{port}', '--dir', savedir]
+    if suffix is not None:
+        cmd += ['--suffix', suffix]
+    if sim.ttr is not None:
+        cmd += ['--ttr', str(sim.ttr)]
+    elif sim.n_blks is not None:
+        cmd += ['--n-blocks', str(sim.n_blks)]
+    else:
+        cmd += ['--trace-file', sim.filepath]
+    cmd += ['--blksize', str(sim.blksize)]
+    if sim.cc_algo is not None:
+        cmd += ['--cc-algo', sim.cc_algo]
+    if sim.buf_len is not None:
+        cmd += ['--buf-len', '{:.0f}'.format(sim.buf_len)]
+    if getattr(sim, 'mm_delay', None) is not None:
+        cmd += ['--mm-delay', str(sim.mm_delay)]
+    if sim.iperf:
+        cmd += ['--iperf']
+    for key, value in run_args.items():
+        flag = '--' + key.replace('_', '-')
+        if value is True:
+            cmd += [flag]
+        elif value is not False and value is not None:
+            cmd += [flag, str(value)]
+
+    # the scripts run from the top of the repository (traces/ etc.),
+    # and plots are saved, never shown
+    return Job(name, cmd, timeout, retries, cwd=os.path.dirname(script), env={'MPLBACKEND' : 'Agg'},
+               exclusive=mm_side == 'receiver')
+
+
+def check_concurrent(jobs, workers):
+    '''Raise ValueError if 'jobs' would run more than one at a time
+    (with 'workers' > 1) and one of them is exclusive.
+
+    '''
+    if min(workers, len(jobs)) <= 1:
+        return
+    exclusive = [job.name for job in jobs if job.exclusive]
+    if exclusive:
+        raise ValueError('{} cannot run together with other runs: with the receiver inside mahimahi the sender '
+                         'only reaches the first mm-link shell (100.64.0.2); use mm_side \'sender\' or one run at a time'
+                         .format(', '.join(exclusive[:3]) + (' and {} more'.format(len(exclusive) - 3) if len(exclusive) > 3 else '')))
+
+
+def port_free(port):
+    # nothing listening on (or bound to) this TCP port here
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind(('', port))
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
+
+
+def _format_seconds(seconds):
+    seconds = int(round(seconds))
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class Scheduler(object):
+
+    def __init__(self, jobs, workers=1, base_port=9999, logdir='logs', progress_interval=30, verbose=1, callback=None):
+        '''
+        Run experiment jobs (Job) up to 'workers' at a time, each in its
+        own process group, with the output of every run in
+        '<logdir>/<name>.log'.
+
+        Worker slot i hands out ports from base_port + i upwards,
+        skipping ports that are taken, so runs that go on together
+        never share one.
+
+        progress_interval: seconds between progress lines while runs
+        are going on (a line is also printed whenever a run ends)
+
+        verbose: 0 for no progress output
+
+        callback: called as callback(job, result) from the worker
+        thread whenever a job is over (after its last try)
+
+        '''
+        names = [job.name for job in jobs]
+        if len(set(names)) != len(names):
+            raise ValueError('job names must be unique')
+        check_concurrent(jobs, workers)
+
+        self.jobs = list(jobs)
+        self.workers = max(1, min(workers, len(self.jobs)))
+        self.base_port = base_port
+        self.logdir = logdir
+        self.progress_interval = progress_interval
+        self.verbose = verbose
+        self.callback = callback
+
+        self._lock = threading.Lock()
+        # (job, attempt), the next one at the end
+        self._pending = [(job, 1) for job in reversed(self.jobs)]
+        self._running = {}
+        self._ports = set()
+        self._stop = threading.Event()
+        self.results = {}
+
+    def _port(self, slot):
+        # lowest free port of this slot (slots are 'workers' apart)
+        with self._lock:
+            port = self.base_port + slot
+            while port in self._ports or not port_free(port):
+                port += self.workers
+            self._ports.add(port)
+        return port
+
+    def _run(self, job, slot, attempt):
+        port = self._port(slot)
+        cmd = job.command(port, slot)
+        env = dict(os.environ)
+        env.update(job.env)
+        logpath = os.path.join(self.logdir, job.name + '.log')
+
+        t0 = time.time()
+        with open(logpath, 'a') as flog:
+            flog.write('# attempt {}, port {}: {}\n'.format(attempt, port, ' '.join(cmd)))
+            flog.flush()
+            proc = sp.Popen(cmd, stdout=flog, stderr=sp.STDOUT, stdin=sp.DEVNULL, cwd=job.cwd, env=env, start_new_session=True)
+            with self._lock:
+                self._running[job.name] = (proc, t0)
+            try:
+                returncode = proc.wait(timeout=job.timeout)
+                status = 'ok' if returncode == 0 else 'failed'
+                if status == 'ok' and job.check is not None and not job.check(job):
+                    status = 'invalid'
+            except sp.TimeoutExpired:
+                # the runner's group; mm-link, the senders, the receiver
+                # and tcpdump are in sessions of their own, the runner
+                # tears them down on SIGTERM (Supervisor.guard())
+                self._kill(proc)
+                returncode = proc.returncode
+                status = 'timeout'
+            flog.write('# {} (return code {}) after {:.1f} s\n'.format(status, returncode, time.time() - t0))
+
+        with self._lock:
+            del self._running[job.name]
+            self._ports.discard(port)
+
+        return {'name' : job.name, 'status' : status, 'returncode' : returncode, 'attempts' : attempt,
+                'port' : port, 'elapsed' : time.time() - t0, 'log' : logpath}
+
+    def _kill(self, proc, grace=15):
+        # SIGTERM to the runner's group, SIGKILL after 'grace' seconds:
+        # long enough for a Simulation to tear down its own processes
+        # (Supervisor.grace per process group)
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(proc.pid, sig)
+            except ProcessLookupError:
+                break
+            try:
+                proc.wait(timeout=grace)
+                break
+            except sp.TimeoutExpired:
+                pass
+
+    def _worker(self, slot):
+        while not self._stop.is_set():
+            with self._lock:
+                if not self._pending:
+                    return
+                job, attempt = self._pending.pop()
+            res = self._run(job, slot, attempt)
+            if res['status'] != 'ok' and attempt <= job.retries and not self._stop.is_set():
+                # back of the queue, so that a flaky run doesn't hold up
+                # the others
+                with self._lock:
+                    self._pending.insert(0, (job, attempt + 1))
+                self._report('{} {} (return code {}), retrying'.format(job.name, res['status'], res['returncode']))
+                continue
+            with self._lock:
+                self.results[job.name] = res
+            if self.callback is not None:
+                self.callback(job, res)
+            self._report('{} {} in {}{}'.format(job.name, res['status'], _format_seconds(res['elapsed']),
+                                                '' if attempt == 1 else ' (attempt {})'.format(attempt)))
+
+    def progress(self):
+        '''Runs done, running and pending, seconds since the start and
+        the estimated seconds left (None until a run has ended).
+
+        '''
+        with self._lock:
+            done = len(self.results)
+            running = len(self._running)
+            pending = len(self._pending)
+            elapsed = time.time() - self._t0
+            # runs that failed early say little about the others
+            durations = [res['elapsed'] for res in self.results.values() if res['status'] == 'ok']
+            if not durations:
+                durations = [res['elapsed'] for res in self.results.values()]
+            started = [t0 for _, t0 in self._running.values()]
+
+        eta = None
+        if durations:
+            # runs take about the same time: what is left of the running
+            # ones, then the pending ones in rounds of 'workers'
+            mean = sum(durations) / len(durations)
+            now = time.time()
+            left = [max(mean - (now - t0), 0) for t0 in started]
+            eta = (max(left) if left else 0) + -(-pending // self.workers) * mean
+
+        return {'done' : done, 'running' : running, 'pending' : pending, 'total' : len(self.jobs),
+                'elapsed' : elapsed, 'eta' : eta}
+
+    def _report(self, event=None):
+        if not self.verbose:
+            return
+        p = self.progress()
+        line = '[{}/{} done, {} running, {} pending] elapsed {}, ETA {}'.format(
+            p['done'], p['total'], p['running'], p['pending'], _format_seconds(p['elapsed']),
+            _format_seconds(p['eta']) if p['eta'] is not None else '?')
+        if event is not None:
+            line = event + os.linesep + '  ' + line
+        print(line, flush=True)
+
+    def run(self):
+        '''Run all jobs, returns the result of every one of them (dicts
+        with name, status ('ok', 'failed', 'invalid' or 'timeout'), returncode,
+        attempts, port, elapsed and log), in the order of the jobs. On
+        KeyboardInterrupt the running jobs are killed and no new ones
+        are started.
+
+        '''
+        if not os.path.exists(self.logdir):
+            os.makedirs(self.logdir)
+
+        self._t0 = time.time()
+        threads = [threading.Thread(target=self._worker, args=(slot,), daemon=True) for slot in range(self.workers)]
+        for t in threads:
+            t.start()
+
+        try:
+            last = time.time()
+            while any(t.is_alive() for t in threads):
+                for t in threads:
+                    t.join(0.5)
+                if time.time() - last >= self.progress_interval:
+                    self._report()
+                    last = time.time()
+        except KeyboardInterrupt:
+            self._stop.set()
+            with self._lock:
+                running = [proc for proc, _ in self._running.values()]
+            for proc in running:
+                self._kill(proc)
+            for t in threads:
+                t.join()
+            raise
+
+        return [self.results[job.name] for job in self.jobs if job.name in self.results]
+
+
+def run_jobs(jobs, workers=1, base_port=9999, logdir='logs', progress_interval=30, verbose=1, callback=None):
+    # run_jobs(jobs, K) == Scheduler(jobs, K).run(), plus a closing summary
+    results = Scheduler(jobs, workers, base_port, logdir, progress_interval, verbose, callback).run()
+    if verbose:
+        failed = [res['name'] for res in results if res['status'] != 'ok']
+        print('{} of {} runs ok'.format(len(results) - len(failed), len(results)))
+        if failed:
+            print('Failed: ' + ', '.join(failed))
+    return results
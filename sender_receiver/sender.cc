@@ -1,5 +1,10 @@
 #include "channel.hpp"
 
+#include <fcntl.h>
+#include <stdint.h>
+#include <pthread.h>
+#include <sys/mman.h>
+
 using namespace std;
 
 
@@ -27,6 +32,194 @@ struct tcp_conn {
 };
 
 
+/* TCP_INFO sampling (-s): the kernel's view of the connection every
+   'interval' microseconds, written to a ring of 'capacity' records
+   mmap'd from the sample file. What was sampled is on disk even when
+   the sender is killed, and the file never grows beyond the ring. Read
+   it with mmparse.read_tcpinfo_log(). */
+
+#define TCPINFO_MAGIC     "TCPINFO1"
+#define TCPINFO_VERSION   1
+#define TCPINFO_CAPACITY  (1 << 20)
+
+/* struct tcp_info as the kernel has it: glibc's <netinet/tcp.h> stops
+   at tcpi_total_retrans, the fields after it are filled in since Linux
+   4.6 (and left zero by older kernels) */
+struct tcp_info_ext {
+  struct tcp_info base;
+  uint64_t pacing_rate;
+  uint64_t max_pacing_rate;
+  uint64_t bytes_acked;
+  uint64_t bytes_received;
+  uint32_t segs_out;
+  uint32_t segs_in;
+  uint32_t notsent_bytes;
+  uint32_t min_rtt;
+  uint32_t data_segs_in;
+  uint32_t data_segs_out;
+  uint64_t delivery_rate;
+};
+
+typedef struct __attribute__((packed)) {
+  char magic[8];
+  uint32_t version;
+  uint32_t record_size;
+  uint64_t capacity;		// records in the ring
+  uint64_t interval_us;		// sampling interval
+  uint64_t count;		// records written so far (the ring holds the last 'capacity')
+  char reserved[24];
+} tcpinfo_header_t;
+
+typedef struct __attribute__((packed)) {
+  uint64_t time_us;		// unix time of the sample (microseconds)
+  uint32_t rtt_us;		// smoothed RTT
+  uint32_t rttvar_us;		// RTT variation
+  uint32_t snd_cwnd;		// congestion window (segments)
+  uint32_t snd_mss;		// segment size (bytes)
+  uint32_t total_retrans;	// segments retransmitted so far
+  uint32_t unacked;		// segments in flight
+  uint64_t pacing_rate;		// bytes per second
+  uint64_t delivery_rate;	// bytes per second
+  uint64_t bytes_acked;		// bytes acked so far
+} tcpinfo_record_t;
+
+struct tcpinfo_sampler {
+  int sockfd;
+  uint64_t interval_us;
+  uint64_t capacity;
+  size_t maplen;
+  tcpinfo_header_t *header;
+  tcpinfo_record_t *ring;
+  volatile bool stop;
+  pthread_t thread;
+};
+
+
+/* create the sample file and map it */
+int
+tcpinfo_open(struct tcpinfo_sampler *sampler, const char *filepath, uint64_t interval_us, uint64_t capacity) {
+  
+  int fd;
+  if ((fd = open(filepath, O_RDWR | O_CREAT | O_TRUNC, 0644)) == -1) {
+    perror("open");
+    return -1;
+  }
+  
+  sampler->interval_us = interval_us;
+  sampler->capacity = capacity;
+  sampler->maplen = sizeof(tcpinfo_header_t) + capacity * sizeof(tcpinfo_record_t);
+  
+  // the records are written as they come (the file stays sparse
+  // until then)
+  if (ftruncate(fd, sampler->maplen) != 0) {
+    perror("ftruncate");
+    close(fd);
+    return -1;
+  }
+  
+  void *map = mmap(NULL, sampler->maplen, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+  close(fd);
+  if (map == MAP_FAILED) {
+    perror("mmap");
+    return -1;
+  }
+  
+  sampler->header = (tcpinfo_header_t *) map;
+  sampler->ring = (tcpinfo_record_t *) ((char *) map + sizeof(tcpinfo_header_t));
+  
+  memcpy(sampler->header->magic, TCPINFO_MAGIC, 8);
+  sampler->header->version = TCPINFO_VERSION;
+  sampler->header->record_size = sizeof(tcpinfo_record_t);
+  sampler->header->capacity = capacity;
+  sampler->header->interval_us = interval_us;
+  sampler->header->count = 0;
+  
+  return 0;
+}
+
+
+/* sampling thread: one record every interval, on a fixed schedule */
+void *
+tcpinfo_loop(void *arg) {
+  
+  struct tcpinfo_sampler *sampler = (struct tcpinfo_sampler *) arg;
+  struct tcp_info_ext info;
+  socklen_t len;
+  struct timespec next, now;
+  uint64_t count = 0;
+  
+  clock_gettime(CLOCK_MONOTONIC, &next);
+  
+  while (!sampler->stop) {
+    
+    memset(&info, 0, sizeof(info));
+    len = sizeof(info);
+    if (getsockopt(sampler->sockfd, IPPROTO_TCP, TCP_INFO, &info, &len) != 0) {
+      warn("getsockopt TCP_INFO");
+      break;
+    }
+    clock_gettime(CLOCK_REALTIME, &now);
+    
+    tcpinfo_record_t *rec = &(sampler->ring[count % sampler->capacity]);
+    rec->time_us = (uint64_t) now.tv_sec * 1000000 + now.tv_nsec / 1000;
+    rec->rtt_us = info.base.tcpi_rtt;
+    rec->rttvar_us = info.base.tcpi_rttvar;
+    rec->snd_cwnd = info.base.tcpi_snd_cwnd;
+    rec->snd_mss = info.base.tcpi_snd_mss;
+    rec->total_retrans = info.base.tcpi_total_retrans;
+    rec->unacked = info.base.tcpi_unacked;
+    rec->pacing_rate = info.pacing_rate;
+    rec->delivery_rate = info.delivery_rate;
+    rec->bytes_acked = info.bytes_acked;
+    
+    // the record is complete before it is counted
+    count++;
+    __atomic_store_n(&(sampler->header->count), count, __ATOMIC_RELEASE);
+    
+    next.tv_nsec += (sampler->interval_us % 1000000) * 1000;
+    next.tv_sec += sampler->interval_us / 1000000 + next.tv_nsec / 1000000000;
+    next.tv_nsec %= 1000000000;
+    
+    // running late (e.g. CPU busy): skip the samples missed rather
+    // than catching up with a burst of them
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    if (now.tv_sec > next.tv_sec || (now.tv_sec == next.tv_sec && now.tv_nsec > next.tv_nsec))
+      next = now;
+    clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, &next, NULL);
+  }
+  
+  return NULL;
+}
+
+
+int
+tcpinfo_start(struct tcpinfo_sampler *sampler, int sockfd) {
+  
+  sampler->sockfd = sockfd;
+  sampler->stop = false;
+  if (pthread_create(&(sampler->thread), NULL, tcpinfo_loop, sampler) != 0) {
+    warn("pthread_create");
+    return -1;
+  }
+  
+  return 0;
+}
+
+
+void
+tcpinfo_stop(struct tcpinfo_sampler *sampler) {
+  
+  sampler->stop = true;
+  pthread_join(sampler->thread, NULL);
+  
+  uint64_t count = sampler->header->count;
+  msync(sampler->header, sampler->maplen, MS_SYNC);
+  munmap(sampler->header, sampler->maplen);
+  
+  cout << "Took " << count << " TCP_INFO samples" << endl;
+}
+
+
 /* follow all steps to setup the connection, set relevant socket options */
 int
 setup_tcp_connection(char *serv_ip, int serv_port, char *cc_protocol, struct tcp_conn *conn) {
@@ -419,6 +612,9 @@ int main(int argc, char** argv)
   char *cc_algo        =  NULL; // the cc algorithm to use
   char *logfilepath    =  NULL; // path to log file (optional)
   bool verbose         = false; // whether to show verbose output (log the output of sender)
+  char *samplefilepath =  NULL; // path to TCP_INFO sample file (optional)
+  double interval_ms   =    10; // TCP_INFO sampling interval
+  long capacity        = TCPINFO_CAPACITY; // TCP_INFO samples kept
   
   // Shiva: method of generation of packets ("const" by default)
   int genmethod = 0;
@@ -426,9 +622,9 @@ int main(int argc, char** argv)
   // parse the commandline arguments and options
   int opt;
   char usage_str[200];
-  sprintf(usage_str, "Usage: %s [-t ttr / -n n_blks / -f tracefilepath] [-b blksize] [-C cc_algo] [-l logfilepath] [-v] SERVER_IP SERVER_PORT\n", argv[0]);
+  sprintf(usage_str, "Usage: %s [-t ttr / -n n_blks / -f tracefilepath] [-b blksize] [-C cc_algo] [-l logfilepath] [-s samplefilepath [-i interval_ms] [-c capacity]] [-v] SERVER_IP SERVER_PORT\n", argv[0]);
   
-  while ((opt = getopt(argc, argv, "t:n:f:b:C:l:v")) != -1) {
+  while ((opt = getopt(argc, argv, "t:n:f:b:C:l:s:i:c:v")) != -1) {
     switch (opt) {
     case 't':
     case 'n':
@@ -465,6 +661,23 @@ int main(int argc, char** argv)
 	exit(EXIT_FAILURE);
       }
       break;
+    case 's':
+      samplefilepath = optarg;
+      break;
+    case 'i':
+      interval_ms = atof(optarg);
+      if (interval_ms <= 0) {
+	cerr << "Sampling interval (-i option) has to be > 0." << endl;
+	exit(EXIT_FAILURE);
+      }
+      break;
+    case 'c':
+      capacity = atol(optarg);
+      if (capacity < 1) {
+	cerr << "Sample capacity (-c option) has to be >= 1." << endl;
+	exit(EXIT_FAILURE);
+      }
+      break;
     case 'v':
       verbose = true;
       break;
@@ -492,6 +705,17 @@ int main(int argc, char** argv)
     exit(EXIT_FAILURE);
   }
   
+  // sample TCP_INFO while sending
+  struct tcpinfo_sampler sampler;
+  if (samplefilepath != NULL) {
+    if (tcpinfo_open(&sampler, samplefilepath, (uint64_t) (interval_ms * 1000), capacity) != 0) {
+      cerr << "Unable to set up TCP_INFO sampling to " << samplefilepath << "." << endl;
+      exit(EXIT_FAILURE);
+    }
+    if (tcpinfo_start(&sampler, conn.sockfd) != 0)
+      exit(EXIT_FAILURE);
+  }
+  
   // choose input sending method based on options
   if (genmethod == 'n') {
     if (send_nblocks(&conn, mode.n_blocks, blksize, 0) != 0) 
@@ -505,6 +729,9 @@ int main(int argc, char** argv)
       cerr << "ABNORMAL TERMINATION: Something went wrong in send_ttr()" << endl;
   }
   
+  if (samplefilepath != NULL)
+    tcpinfo_stop(&sampler);
+  
   // finally, close connection
   cout << "Done, closing connection." << endl;
   
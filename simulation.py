@@ -0,0 +1,645 @@
+import os
+
+from readiness import StartupTimer, listening, file_opened, shell_wait_for_file
+from supervisor import Supervisor, RunStalled
+from timing import span
+
+
+class MMLink(object):
+
+    def __init__(self, mm_side='receiver'):
+        '''
+        Link emulation with an mm-link shell around one end of the
+        connection.
+
+        mm_side: the side that should run inside the mahimahi shell,
+        'sender' or 'receiver'
+
+        '''
+        if mm_side not in ('sender', 'receiver'):
+            raise Exception('mm_side option should be \'sender\' or \'receiver\' only')
+        self.mm_side = mm_side
+
+    def server_ip(self):
+        if self.mm_side == 'sender':
+            return '100.64.0.1' # MAHIMAHI_BASE: address exposed by native machine to processes inside mahimahi
+        return '100.64.0.2' # address exposed by mahimahi to processes outside
+
+    def log_path(self, savepathprefix):
+        # the mm log of the direction the data goes
+        return savepathprefix + ('_uplink.csv' if self.mm_side == 'sender' else '_downlink.csv')
+
+    def command(self, sim, savepathprefix):
+        tracepath = os.path.join('traces', 'channels', sim.trace)
+        direction = 'uplink' if self.mm_side == 'sender' else 'downlink'
+        mm_cmd = 'mm-link {0} {0} --{1}-log {2}'.format(tracepath, direction, self.log_path(savepathprefix))
+
+        if sim.buf_len is not None:
+            mm_cmd += ' --uplink-queue=droptail --uplink-queue-args=bytes={}'.format(sim.buf_len)
+            mm_cmd += ' --downlink-queue=droptail --downlink-queue-args=bytes={}'.format(sim.buf_len)
+
+        return mm_cmd
+
+    def saveprefix(self):
+        # part of the output names that is up to the link
+        return ''
+
+
+class MMDelayLink(MMLink):
+
+    def __init__(self, mm_delay=None):
+        '''
+        mm-link with the sender inside, itself inside an mm-delay shell
+        that adds 'mm_delay' ms of delay each way (no mm-delay shell if
+        None or 0).
+
+        '''
+        MMLink.__init__(self, 'sender')
+        self.mm_delay = mm_delay
+
+    def command(self, sim, savepathprefix):
+        mm_cmd = MMLink.command(self, sim, savepathprefix)
+        if self.mm_delay is not None and self.mm_delay > 0:
+            mm_cmd = 'mm-delay {} '.format(self.mm_delay) + mm_cmd
+        return mm_cmd
+
+    def saveprefix(self):
+        if self.mm_delay is not None and self.mm_delay > 0:
+            return '_delay{:02d}'.format(self.mm_delay)
+        return ''
+
+
+class SingleSender(object):
+    '''One sender, sending for the sending mode of the simulation ('ttr'
+    seconds, 'n_blks' blocks or the traffic trace in 'filepath').
+
+    '''
+    n_senders = 1
+
+    # stop the receiver once the senders are done rather than waiting
+    # for it to exit by itself
+    stop_receiver = False
+
+    def sending_args(self, sim):
+        if sim.filepath is not None:
+            return ' -f {}'.format(sim.filepath)
+        elif sim.n_blks is not None:
+            return ' -n {}'.format(sim.n_blks)
+        return ' -t {}'.format(sim.ttr)
+
+    def command(self, sim, server_ip, savepathprefix, log):
+        sender_cmd = 'sender_receiver/sender {} {}'.format(server_ip, sim.port)
+        sender_cmd += self.sending_args(sim)
+        if sim.blksize != sim.BLKSIZE_DEFAULT:
+            sender_cmd += ' -b {}'.format(sim.blksize)
+        if sim.cc_algo is not None:
+            sender_cmd += ' -C {}'.format(sim.cc_algo)
+        if log:
+            sender_cmd += ' -l {}'.format(savepathprefix + '_sender.log')
+        return sender_cmd
+
+    def script(self, sim, sender_cmd):
+        # sh commands running the sender inside a mahimahi shell
+        return sender_cmd
+
+
+class MultiSender(SingleSender):
+
+    def __init__(self, n_senders=1):
+        # 'n_senders' senders outside mahimahi, all on the same link
+        self.n_senders = n_senders
+
+
+class TimedSender(SingleSender):
+    '''A sender inside mahimahi told to send for longer than needed and
+    stopped after 'ttr' seconds by the shell running it.
+
+    '''
+    SEND_SECONDS = 305
+    stop_receiver = True
+
+    def sending_args(self, sim):
+        return ' -t {}'.format(self.SEND_SECONDS)
+
+    def script(self, sim, sender_cmd):
+        return '{} & S=$!; sleep {}; kill $S; wait $S'.format(sender_cmd, sim.ttr)
+
+
+class MMLogMeasurement(object):
+    '''Performance from the mm log alone (throughput and queueing delay,
+    plot.plot_tput_delay()).
+
+    '''
+
+    def capture(self, savepathprefix, side):
+        # command capturing packets at 'side' ('sender' or 'receiver'),
+        # and the file it writes, None if nothing is captured
+        return None
+
+    def prepare(self, savepathprefix):
+        pass
+
+    def sender_args(self, savepathprefix):
+        # options of the sender for this measurement
+        return ''
+
+    def start(self, server_ip, savepathprefix):
+        # once everything is up: anything processed during the run
+        pass
+
+    def stop(self):
+        pass
+
+    def finish(self, savepathprefix):
+        # once the run is over (before post-processing, which may be
+        # done elsewhere)
+        pass
+
+    def postprocess(self, server_ip, savepathprefix, mmlogfpath, disp_plot=False, save_plot=True, skip_seconds=0):
+        print('Plotting performance ...')
+        if not disp_plot:
+            # nothing to show, so no need for an interactive backend
+            os.environ.setdefault('MPLBACKEND', 'Agg')
+        with span('plot'):
+            from plot import plot_tput_delay
+            plot_tput_delay(mmlogfpath, skip_seconds=skip_seconds, title=os.path.basename(savepathprefix), disp=disp_plot, save=save_plot)
+
+
+class PcapMeasurement(MMLogMeasurement):
+    '''tcpdump at the sender and the receiver as well: throughput at the
+    receiver and RTT at the sender, extracted from the captures with
+    mmpcap, next to the mm log (plot.plot_tput_delay_tcpdump()).
+
+    With 'segment_mb', tcpdump rotates each capture into files of that
+    many MB (-C) and every completed one is processed and deleted while
+    the run goes on (mmpcap.RotatingCapture), so the captures take up a
+    few segments on disk however long the run is; the series are saved
+    when the run is over and only the plot is left for post-processing.
+
+    '''
+
+    def __init__(self, segment_mb=None):
+        self.segment_mb = segment_mb
+        self._rotating = {}
+
+    def pcap_path(self, savepathprefix, side):
+        return '{}_{}.pcap'.format(savepathprefix, side)
+
+    def capture(self, savepathprefix, side):
+        pcap = self.pcap_path(savepathprefix, side)
+        if self.segment_mb is None:
+            return 'sudo tcpdump -i any -s 96 -w {}'.format(pcap), pcap
+        import getpass
+        # the next segments are opened after tcpdump has dropped root,
+        # as the user who owns the output directory
+        return 'sudo tcpdump -i any -s 96 -C {:g} -Z {} -w {}'.format(self.segment_mb, getpass.getuser(), pcap), pcap
+
+    def prepare(self, savepathprefix):
+        from mmpcap import capture_segments
+
+        # leftovers of an earlier run would look like open captures
+        for side in ('receiver', 'sender'):
+            for segment in capture_segments(self.pcap_path(savepathprefix, side)):
+                os.unlink(segment)
+
+    def _extractors(self, server_ip):
+        from mmpcap import PcapThroughput, PcapAckRtt
+
+        # throughput at the receiver, RTT at the sender
+        return {'receiver' : ('_receiver_tput.npz', PcapThroughput(server_ip)),
+                'sender' : ('_sender_RTT.npz', PcapAckRtt(server_ip))}
+
+    def start(self, server_ip, savepathprefix):
+        from mmpcap import RotatingCapture
+
+        if self.segment_mb is None:
+            return
+        for side, (suffix, extractor) in self._extractors(server_ip).items():
+            self._rotating[side] = suffix, RotatingCapture(self.pcap_path(savepathprefix, side), extractor).start()
+
+    def stop(self):
+        for _, rotating in self._rotating.values():
+            rotating.stop()
+
+    def finish(self, savepathprefix):
+        from mmpcap import save_pcap_series
+
+        for side, (suffix, rotating) in sorted(self._rotating.items()):
+            save_pcap_series(savepathprefix + suffix, *rotating.finish())
+            print('{} capture segments at the {} processed during the run (at most {:.1f} MB on disk), saved to "{}{}"'.format(
+                rotating.segments, side, rotating.peak_bytes / 1e6, savepathprefix, suffix))
+        self._rotating = {}
+
+    def postprocess(self, server_ip, savepathprefix, mmlogfpath, disp_plot=False, save_plot=True, skip_seconds=0):
+        from mmpcap import iter_pcap, save_pcap_series
+
+        for side, (suffix, extractor) in sorted(self._extractors(server_ip).items()):
+            pcap = self.pcap_path(savepathprefix, side)
+            if not os.path.exists(pcap):
+                # rotated, already extracted during the run
+                continue
+            print('Extracting {} at {} from "{}"'.format('throughput' if side == 'receiver' else 'RTT', side, pcap))
+            with span('extract ' + side):
+                for pkts in iter_pcap(pcap):
+                    extractor.update(pkts)
+                save_pcap_series(savepathprefix + suffix, *extractor.result())
+            print('Saved to "{}{}"'.format(savepathprefix, suffix))
+            os.unlink(pcap)
+
+        print('Plotting performance ...')
+        if not disp_plot:
+            # nothing to show, so no need for an interactive backend
+            os.environ.setdefault('MPLBACKEND', 'Agg')
+        with span('plot'):
+            from plot import plot_tput_delay_tcpdump
+            plot_tput_delay_tcpdump(mmlogfpath, skip_seconds=skip_seconds, title=os.path.basename(savepathprefix), disp=disp_plot, save=save_plot)
+
+
+class TcpInfoMeasurement(MMLogMeasurement):
+    '''TCP_INFO of the sender's socket, sampled by the sender itself every
+    'interval_ms' (sender -s, no packet captures): the RTT at the
+    sender (the kernel's smoothed RTT) next to the mm log
+    (plot.plot_tput_delay_tcpdump(), without the throughput at the
+    receiver). The samples (also cwnd, pacing and delivery rate,
+    retransmissions) stay in '*_sender_tcpinfo.bin', see
+    mmparse.read_tcpinfo_log().
+
+    '''
+
+    def __init__(self, interval_ms=10):
+        self.interval_ms = interval_ms
+
+    def tcpinfo_path(self, savepathprefix):
+        return savepathprefix + '_sender_tcpinfo.bin'
+
+    def prepare(self, savepathprefix):
+        if os.path.exists(self.tcpinfo_path(savepathprefix)):
+            os.unlink(self.tcpinfo_path(savepathprefix))
+
+    def sender_args(self, savepathprefix):
+        return ' -s {} -i {:g}'.format(self.tcpinfo_path(savepathprefix), self.interval_ms)
+
+    def postprocess(self, server_ip, savepathprefix, mmlogfpath, disp_plot=False, save_plot=True, skip_seconds=0):
+        from mmparse import tcpinfo_rtt
+        from mmpcap import save_pcap_series
+
+        # the RTT series, as from the captures
+        print('Extracting RTT from "{}"'.format(self.tcpinfo_path(savepathprefix)))
+        with span('extract sender'):
+            save_pcap_series(savepathprefix + '_sender_RTT.npz', *tcpinfo_rtt(self.tcpinfo_path(savepathprefix)))
+        print('Saved to "{}_sender_RTT.npz"'.format(savepathprefix))
+
+        print('Plotting performance ...')
+        if not disp_plot:
+            # nothing to show, so no need for an interactive backend
+            os.environ.setdefault('MPLBACKEND', 'Agg')
+        with span('plot'):
+            from plot import plot_tput_delay_tcpdump
+            plot_tput_delay_tcpdump(mmlogfpath, skip_seconds=skip_seconds, title=os.path.basename(savepathprefix), disp=disp_plot, save=save_plot)
+
+
+class Simulation(object):
+    PORT = 9999
+    BLKSIZE_DEFAULT = 128
+    TTR_DEFAULT = 10
+
+    # seconds allowed for each phase of a run: startup (until everything
+    # is ready), transfer (until the senders are done; None: 'ttr' plus
+    # a minute, no limit for the other sending modes) and drain (until
+    # the receiver is done)
+    PHASE_TIMEOUTS = {'startup' : 10, 'transfer' : None, 'drain' : 60}
+
+    def __init__(self, trace, port=None, ttr=None, n_blks=None, filepath=None, blksize=None, cc_algo=None, buf_len=None, iperf=False, link=None, traffic=None, measurement=None):
+        '''
+        Class for running mahimahi simulations on mmwave channel traces,
+        put together from a link emulation, a kind of traffic and a
+        measurement. runmm.py, runmm2.py and runmm_multi.py are presets
+        of it.
+
+        trace: the mmwave channel trace to use for this simulation
+
+        port: the port to use (9999 by default)
+
+        sending mode: only one of the three options below:
+
+        -- ttr: time to run the simulation (seconds)
+
+        -- n_blks: how many blocks of data to send
+
+        -- filepath: trace file from which to send data
+
+        blksize: size of a block of data that is sent in a single send() function in the sender (KiB)
+
+        cc_algo: the congestion control algorithm to use
+
+        buf_len: length of buffer to use in mahimahi
+
+        iperf: whether to use iperf or not instead of our custom sender/receiver
+
+        link: MMLink (default, receiver inside mm-link) or MMDelayLink
+
+        traffic: SingleSender (default), MultiSender or TimedSender
+
+        measurement: MMLogMeasurement (default), PcapMeasurement or
+        TcpInfoMeasurement
+
+        '''
+        # the trace to use to emulate the link
+        self.trace = trace
+
+        self.port = port if port is not None else Simulation.PORT
+
+        # packet sending mode
+        self.ttr = self.n_blks = self.filepath = None
+        if (ttr is not None) + (n_blks is not None) + (filepath is not None) > 1:
+            raise Exception('only one of \'ttr\', \'n_blks\' and \'filepath\' may be specified')
+        if n_blks is not None:
+            self.n_blks = n_blks
+        elif filepath is not None:
+            self.filepath = filepath
+        else:
+            self.ttr = ttr if ttr is not None else Simulation.TTR_DEFAULT
+
+        # sending block size
+        self.blksize = blksize if blksize is not None else Simulation.BLKSIZE_DEFAULT
+
+        # the congestion control algo
+        self.cc_algo = cc_algo
+
+        # length of buffer in mahimahi
+        self.buf_len = buf_len
+
+        # use iperf instead of our sender and receiver?
+        self.iperf = iperf
+
+        self.link = link if link is not None else MMLink()
+        self.traffic = traffic if traffic is not None else SingleSender()
+        self.measurement = measurement if measurement is not None else MMLogMeasurement()
+
+    def saveprefix(self, suffix=None):
+        # common prefix of the names of the output files
+        if self.ttr is not None:
+            saveprefix = '{}_T{}'.format(os.path.splitext(self.trace)[0], self.ttr)
+        elif self.n_blks is not None:
+            saveprefix = '{}_N{}'.format(self.trace, self.n_blks)
+        else:
+            assert (self.filepath is not None)
+            filename = os.path.splitext(os.path.basename(self.filepath))[0]
+            saveprefix = '{}_file_{}'.format(self.trace, filename)
+
+        saveprefix += '_{}KiB'.format(self.blksize)
+
+        if self.buf_len is not None:
+            saveprefix += '_Q{:.0f}'.format(self.buf_len)
+
+        saveprefix += self.link.saveprefix()
+
+        if suffix is not None:
+            saveprefix += '_' + suffix
+
+        return saveprefix
+
+    async def _start(self, sup, name, cmd, verbose):
+        if verbose >= 1:
+            print('Starting {} using command:'.format(name), cmd if isinstance(cmd, str) else ' '.join(cmd))
+        proc = await sup.start(name, cmd)
+        if verbose >= 2:
+            print('{} started, pid'.format(name[0].upper() + name[1:]), proc.pid)
+        return proc
+
+    async def _startup(self, sup, startup, receiver_cmd, mm_cmd, sender_cmd, savepathprefix, deadline, verbose):
+        # start everything, each part once the one before it is ready
+        def exited(name):
+            return lambda: sup.procs[name].returncode
+
+        if self.link.mm_side == 'sender':
+            # capture and receiver outside, senders inside mahimahi
+            capture = self.measurement.capture(savepathprefix, 'receiver')
+            if capture is not None:
+                await self._start(sup, 'receiver capture', capture[0], verbose)
+                await startup.wait_async('receiver capture', lambda: file_opened(capture[1]), deadline, exited('receiver capture'))
+
+            await self._start(sup, 'receiver', receiver_cmd, verbose)
+            # the sender connects right away
+            await startup.wait_async('receiver', lambda: listening(self.port), deadline, exited('receiver'))
+
+            script = self.traffic.script(self, sender_cmd)
+            capture = self.measurement.capture(savepathprefix, 'sender')
+            if capture is not None:
+                # the sender starts once tcpdump inside mahimahi has
+                # opened its capture, which is stopped after it
+                script = '{} & T=$!; {}{}; sudo kill $T; wait $T'.format(capture[0], shell_wait_for_file(capture[1]), script)
+            if script != sender_cmd:
+                sender_argv = mm_cmd.split() + ['--', 'sh', '-c', script]
+            else:
+                sender_argv = (mm_cmd + ' -- ' + sender_cmd).split()
+            await self._start(sup, 'sender', sender_argv, verbose)
+            return ['sender']
+
+        # receiver inside mahimahi, senders outside
+        await self._start(sup, 'receiver', mm_cmd + ' -- ' + receiver_cmd, verbose)
+
+        # to ensure the mm interface gets up (the receiver listens
+        # only once it is)
+        if verbose >= 2:
+            print('Waiting for mm-interface to get up ...')
+        receiver_pid = sup.procs['receiver'].pid
+        await startup.wait_async('mm-link and receiver', lambda: listening(self.port, receiver_pid), deadline, exited('receiver'))
+
+        senders = ['sender'] if self.traffic.n_senders == 1 else ['sender {}'.format(ii+1) for ii in range(self.traffic.n_senders)]
+        for name in senders:
+            await self._start(sup, name, sender_cmd, verbose)
+        return senders
+
+    async def _supervise(self, sup, receiver_cmd, mm_cmd, sender_cmd, savepathprefix, mmlogfpath, verbose, live_interval, stall_timeout, timeouts):
+        startup = StartupTimer()
+        tail = None
+        try:
+            senders = await sup.phase('startup', self._startup(sup, startup, receiver_cmd, mm_cmd, sender_cmd, savepathprefix, timeouts['startup'], verbose),
+                                      timeouts['startup'])
+            print(startup)
+            self.measurement.start(self.link.server_ip(), savepathprefix)
+
+            # follow the mm log while the processes run
+            if live_interval is not None:
+                from mmtail import MMLogTail
+
+                def check_progress(tail):
+                    stats = tail.rolling()
+                    if verbose >= 1 and stats is not None:
+                        print('Live: tput {:.2f} Mbps, utilization {:.1f} %, queue {} bytes, delay {:.1f} ms'.format(
+                            stats['tput_Mbps'], stats['utilization'], stats['queue_bytes'], stats['delay_avg_ms']))
+                    if stall_timeout is not None and tail.seconds_since_egress() > stall_timeout:
+                        print('Nothing left the mm-link queue for {} s, aborting the run'.format(stall_timeout))
+                        sup.abort()
+                        return True
+                    return False
+
+                tail = MMLogTail(mmlogfpath).start(live_interval, check_progress)
+
+            # waiting for processes to close
+            if verbose >= 1:
+                print('Waiting for sender process{} ...'.format('es' if len(senders) > 1 else ''))
+            transfer = timeouts['transfer']
+            if transfer is None and self.ttr is not None:
+                transfer = float(self.ttr) + 60
+            await sup.phase('transfer', sup.wait(*senders), transfer)
+            if sup.aborted:
+                # stopped by check_progress(), not done
+                raise RunStalled('nothing left the mm-link queue for {} s'.format(stall_timeout))
+
+            if self.traffic.stop_receiver:
+                await sup.stop('receiver')
+
+            if verbose >= 1:
+                print('Waiting for receiver process ...')
+            await sup.phase('drain', sup.wait('receiver'), timeouts['drain'])
+            if sup.aborted:
+                raise RunStalled('nothing left the mm-link queue for {} s'.format(stall_timeout))
+
+        finally:
+            if tail is not None:
+                tail.stop()
+            self.measurement.stop()
+            # captures, and anything left over if the run failed
+            await sup.close()
+
+    def run(self, savedir='output', log=False, verbose=0, disp_plot=False, save_plot=True, live_interval=None, stall_timeout=None, suffix=None, skip_seconds=0, phase_timeouts=None, postprocess_queue=None, profile=False):
+        ''' Run the simulation with following runtime options.
+
+        savedir: directory where to store outputs
+
+        log: log the data transfer (useful for debugging and offline prediction algo)
+
+        disp_plot: display a plot
+
+        save_plot: save the plot
+
+        live_interval: follow the mm log while the simulation runs and
+        rewrite a '*_live.json' summary next to it every so many
+        seconds (off by default)
+
+        stall_timeout: with 'live_interval', abort the run if nothing
+        has left the mm-link queue for this many seconds
+
+        suffix: appended to the names of the output files (e.g. to tell
+        apart runs with the same settings)
+
+        skip_seconds: initial amount of time to skip during parsing,
+        to compute throughput and delay (useful to exclude any warmup
+        phase)
+
+        phase_timeouts: overrides of PHASE_TIMEOUTS
+
+        postprocess_queue: path of a postprocess.PostprocessQueue to
+        put the post-processing of the run in (for a PostprocessPool to
+        do, 'python postprocess.py QUEUE'), instead of doing it here. The
+        run returns as soon as the emulation is over, but only starts
+        once the queue has room (see PostprocessQueue.pressure()).
+
+        profile: run the post-processing under cProfile, with the stats
+        in '*_postprocess.pstats' (done by the pool if it is queued)
+
+        The output of every process goes, timestamped, to
+        '*_processes.log' (and to the console with verbose >= 2). A run
+        with a phase that times out is torn down and raises
+        supervisor.PhaseTimeout, one aborted by 'stall_timeout' raises
+        supervisor.RunStalled; neither is post-processed. SIGTERM or SIGINT during the emulation
+        (e.g. a scheduler killing the run) tear it down as well, and
+        raise supervisor.Interrupted.
+
+        Every run leaves a manifest, '*_manifest.json' (see
+        timing.write_manifest()): its settings, the timing of each of
+        its phases (timing.RunTimer, post-processing included), the
+        processes with their exit codes and times, and the rusage of the
+        runner and of all its children together.
+        '''
+        import asyncio
+        from timing import RunTimer, profiled, write_manifest
+
+        timer = RunTimer()
+
+        # make output directories
+        if not os.path.exists(savedir):
+            os.makedirs(savedir)
+
+        if postprocess_queue is not None:
+            from postprocess import PostprocessQueue
+            queue = PostprocessQueue(postprocess_queue)
+            with timer.span('queue wait'):
+                queue.wait_for_room()
+
+        print('Saving all output to this directory: "{}"'.format(savedir))
+
+        # fixing dest file names
+        savepathprefix = os.path.join(savedir, self.saveprefix(suffix))
+        mmlogfpath = self.link.log_path(savepathprefix)
+        self.measurement.prepare(savepathprefix)
+
+        # (i) receiver command
+        receiver_cmd = 'sender_receiver/receiver {} {} {}'.format(self.port, self.traffic.n_senders, int(verbose >= 1))
+        if log:
+            recvlogdir = savepathprefix + '_receiver'
+            if not os.path.exists(recvlogdir):
+                os.mkdir(recvlogdir)
+            receiver_cmd += ' --log {}'.format(os.path.join(recvlogdir, 'recvlog'))
+
+        # (ii) mm command
+        mm_cmd = self.link.command(self, savepathprefix)
+
+        # (iii) sender command
+        if self.link.mm_side == 'sender' and self.traffic.n_senders > 1:
+            raise Exception('multiple senders have to share one link, so mahimahi has to be on the receiver side')
+        if self.link.mm_side == 'receiver' and self.measurement.capture(savepathprefix, 'receiver') is not None:
+            raise Exception('packet captures need the sender inside mahimahi (mm_side \'sender\')')
+        server_ip = self.link.server_ip()
+        sender_cmd = self.traffic.command(self, server_ip, savepathprefix, log) + self.measurement.sender_args(savepathprefix)
+        if self.traffic.n_senders > 1 and self.measurement.sender_args(savepathprefix):
+            raise Exception('the senders would all write the same measurement file, use one sender')
+
+        timeouts = dict(self.PHASE_TIMEOUTS)
+        if phase_timeouts is not None:
+            timeouts.update(phase_timeouts)
+
+        pstatspath = savepathprefix + '_postprocess.pstats' if profile else None
+        sup = Supervisor(savepathprefix + '_processes.log', echo=verbose >= 2)
+        status = 'failed'
+        try:
+            with timer.activate():
+                with timer.span('emulation'):
+                    try:
+                        asyncio.run(sup.guard(self._supervise(sup, receiver_cmd, mm_cmd, sender_cmd, savepathprefix, mmlogfpath, verbose, live_interval, stall_timeout, timeouts)))
+                    finally:
+                        print(sup.report())
+                with timer.span('finish'):
+                    self.measurement.finish(savepathprefix)
+
+                if postprocess_queue is None:
+                    with timer.span('postprocess'), profiled(pstatspath):
+                        self.measurement.postprocess(server_ip, savepathprefix, mmlogfpath, disp_plot, save_plot, skip_seconds)
+            status = 'ok'
+        finally:
+            # the phases of the emulation, in it
+            emulation = [span for span in timer.spans if span['name'] == 'emulation']
+            if emulation:
+                for phase in sup.summary()['phases']:
+                    timer.add('emulation/' + phase['name'], emulation[0]['start'] + phase['start'], phase['seconds'], phase['status'])
+            if verbose >= 1:
+                print(timer.report())
+            settings = {'trace' : self.trace, 'port' : self.port, 'ttr' : self.ttr, 'n_blks' : self.n_blks, 'filepath' : self.filepath,
+                        'blksize' : self.blksize, 'cc_algo' : self.cc_algo, 'buf_len' : self.buf_len, 'iperf' : self.iperf,
+                        'link' : dict(vars(self.link), type=type(self.link).__name__),
+                        'traffic' : dict(vars(self.traffic), type=type(self.traffic).__name__),
+                        'measurement' : type(self.measurement).__name__}
+            write_manifest(savepathprefix + '_manifest.json', timer, prefix=savepathprefix, settings=settings, status=status,
+                           postprocess_queue=postprocess_queue, profile=pstatspath,
+                           processes=sup.summary()['processes'])
+
+        if postprocess_queue is not None:
+            # absolute, the pool may run from another directory (e.g. a
+            # sweep started away from the repository)
+            queue.put(self.measurement, server_ip, os.path.abspath(savepathprefix), os.path.abspath(mmlogfpath), save_plot,
+                      skip_seconds, profile)
+            print('Post-processing queued in "{}"'.format(postprocess_queue))
+
+        return
@@ -0,0 +1,236 @@
+import os
+import time
+import signal
+import asyncio
+import subprocess as sp
+
+
+class PhaseTimeout(Exception):
+    pass
+
+
+class RunStalled(PhaseTimeout):
+    # the run was aborted (Supervisor.abort()) because it stopped making
+    # progress
+    pass
+
+
+class Interrupted(Exception):
+    # the run got SIGTERM or SIGINT (see Supervisor.guard())
+    pass
+
+
+def signal_group(pid, sig):
+    # the process group led by 'pid' (with sudo for root-owned processes
+    # like tcpdump and the mahimahi shells)
+    try:
+        os.killpg(pid, sig)
+    except ProcessLookupError:
+        pass
+    except PermissionError:
+        sp.call(['sudo', 'kill', '-s', signal.Signals(sig).name[3:], '--', '-{}'.format(pid)])
+
+
+class Supervisor(object):
+
+    def __init__(self, logpath=None, echo=False, grace=5):
+        '''
+        Runs the processes of an experiment under asyncio, each in its
+        own process group. Their output (stdout and stderr) is read line
+        by line and written with a timestamp (seconds since the
+        supervisor was made) and the name of the process to 'logpath',
+        and to the console with 'echo'.
+
+        Teardown (stop(), close()) only ever signals the process groups
+        the supervisor started: SIGTERM first, SIGKILL to those still
+        there after 'grace' seconds.
+
+        Methods with 'async' must run in the event loop the processes
+        were started from (e.g. inside asyncio.run()).
+
+        '''
+        self.t0 = time.monotonic()
+        self.echo = echo
+        self.grace = grace
+        self.aborted = False
+
+        # name: asyncio process, start and end time (in start order)
+        self.procs = {}
+        self.started = {}
+        self.ended = {}
+
+        # (name, seconds, status, start) of every phase so far
+        self.phases = []
+
+        self._log = open(logpath, 'a') if logpath is not None else None
+        self._readers = []
+        self._watchers = []
+        self._loop = None
+
+    def _write(self, name, line):
+        line = '[{:9.3f}] {}: {}'.format(time.monotonic() - self.t0, name, line)
+        if self._log is not None:
+            self._log.write(line + '\n')
+        if self.echo:
+            print(line, flush=True)
+
+    async def _pump(self, name, stream):
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            self._write(name, line.decode(errors='replace').rstrip('\n'))
+
+    async def _watch(self, name, proc):
+        returncode = await proc.wait()
+        self.ended[name] = time.monotonic()
+        self._write('supervisor', '{} exited (return code {})'.format(name, returncode))
+
+    async def start(self, name, argv):
+        '''Start 'argv' (a list, or a string split on whitespace) as
+        process 'name', in a process group of its own.
+
+        '''
+        if isinstance(argv, str):
+            argv = argv.split()
+        if name in self.procs:
+            raise ValueError('there is a process \'{}\' already'.format(name))
+        self._loop = asyncio.get_running_loop()
+
+        proc = await asyncio.create_subprocess_exec(*argv, stdin=sp.DEVNULL, stdout=sp.PIPE, stderr=sp.STDOUT,
+                                                    start_new_session=True)
+        self.procs[name] = proc
+        self.started[name] = time.monotonic()
+        self._write('supervisor', 'started {} (pid {}): {}'.format(name, proc.pid, ' '.join(argv)))
+        self._readers.append(asyncio.ensure_future(self._pump(name, proc.stdout)))
+        self._watchers.append(asyncio.ensure_future(self._watch(name, proc)))
+
+        return proc
+
+    def running(self, name):
+        return self.procs[name].returncode is None
+
+    async def phase(self, name, aw, timeout=None):
+        '''Await 'aw' as phase 'name' of the experiment, timing it.
+        Raises PhaseTimeout (after cancelling it) if it takes longer
+        than 'timeout' seconds.
+
+        '''
+        t0 = time.monotonic()
+        status = 'failed'
+        try:
+            res = await asyncio.wait_for(aw, timeout)
+            status = 'ok'
+            return res
+        except asyncio.TimeoutError:
+            status = 'timeout'
+            raise PhaseTimeout('{} did not finish within {} s'.format(name, timeout))
+        finally:
+            elapsed = time.monotonic() - t0
+            self.phases.append((name, elapsed, status, t0 - self.t0))
+            self._write('supervisor', 'phase {} {} after {:.3f} s'.format(name, status, elapsed))
+
+    async def guard(self, aw, signals=(signal.SIGTERM, signal.SIGINT)):
+        '''Await 'aw' (the whole experiment, which close()s the
+        supervisor when it is done) and cancel it on any of 'signals',
+        so that it still tears down what it started: the processes are
+        each in a session of their own, and a signal that kills only the
+        runner (e.g. a scheduler timing it out) would leave them all
+        running. Raises Interrupted once 'aw' has cleaned up.
+
+        '''
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(aw)
+        received = []
+
+        def interrupt(sig):
+            # the first signal cancels, the teardown is not cut short by
+            # more of them
+            if not received:
+                self._write('supervisor', 'got {}, tearing down'.format(sig.name))
+                task.cancel()
+            received.append(sig)
+
+        for sig in signals:
+            loop.add_signal_handler(sig, interrupt, sig)
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if not received:
+                raise
+            raise Interrupted('run interrupted by {}'.format(received[0].name))
+        finally:
+            for sig in signals:
+                loop.remove_signal_handler(sig)
+
+    async def wait(self, *names):
+        # return codes of the named processes once they have all exited
+        return await asyncio.gather(*(self.procs[name].wait() for name in names))
+
+    async def stop(self, *names):
+        '''Stop the named processes (all of them if none are named) that
+        are still running: SIGTERM to their process groups, SIGKILL
+        after the grace period.
+
+        '''
+        procs = [(name, self.procs[name]) for name in (names or list(self.procs))]
+        running = [(name, proc) for name, proc in procs if proc.returncode is None]
+        for name, proc in running:
+            self._write('supervisor', 'stopping {} (SIGTERM)'.format(name))
+            signal_group(proc.pid, signal.SIGTERM)
+        for name, proc in running:
+            try:
+                await asyncio.wait_for(proc.wait(), self.grace)
+            except asyncio.TimeoutError:
+                self._write('supervisor', 'killing {} (SIGKILL)'.format(name))
+                signal_group(proc.pid, signal.SIGKILL)
+                await proc.wait()
+
+    def abort(self):
+        # stop everything, from any thread (e.g. a stalled run noticed
+        # by the live tail)
+        self.aborted = True
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self.stop(), self._loop)
+
+    async def close(self):
+        # teardown: stop what is left and collect the rest of the output
+        await self.phase('teardown', self.stop())
+        await asyncio.gather(*self._watchers)
+        # a process that got away (e.g. out of its group) may hold a pipe
+        # open, don't wait for it
+        done, pending = await asyncio.wait(self._readers, timeout=1) if self._readers else (set(), set())
+        for reader in pending:
+            reader.cancel()
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def summary(self):
+        '''The processes (pid, return code, seconds) and the phases, as
+        lists of dicts (e.g. for a run manifest).
+
+        '''
+        processes = []
+        for name, proc in self.procs.items():
+            end = self.ended.get(name)
+            processes.append({'name' : name, 'pid' : proc.pid, 'returncode' : proc.returncode,
+                              'seconds' : (end if end is not None else time.monotonic()) - self.started[name]})
+        phases = [{'name' : name, 'start' : start, 'seconds' : elapsed, 'status' : status}
+                  for name, elapsed, status, start in self.phases]
+        return {'processes' : processes, 'phases' : phases}
+
+    def report(self):
+        '''Exit codes and wall-clock times of the processes and of the
+        phases, as text.
+
+        '''
+        lines = ['Processes:']
+        for name, proc in self.procs.items():
+            end = self.ended.get(name)
+            lines.append('  {:<28s} pid {:<7d} return code {:>4}  {:8.3f} s'.format(
+                name, proc.pid, str(proc.returncode), (end if end is not None else time.monotonic()) - self.started[name]))
+        lines.append('Phases:')
+        for name, elapsed, status, start in self.phases:
+            lines.append('  {:<28s} {:<8s} {:8.3f} s'.format(name, status, elapsed))
+        return '\n'.join(lines)
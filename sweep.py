@@ -0,0 +1,361 @@
+import os, sys
+import json
+import time
+import hashlib
+import contextlib
+import itertools
+import threading
+
+from scheduler import simulation_job, check_concurrent, run_jobs
+
+# sweep axes, in the order they are expanded
+SWEEP_AXES = ('trace', 'cc_algo', 'buf_len', 'mm_delay', 'blksize')
+
+# output files of a run that must be there (and not empty) for it to
+# count as complete, after the prefix of the run; the first one is the
+# mm log, there as soon as the emulation is over
+SWEEP_OUTPUTS = {'runmm.py' : lambda run_args: ('_downlink.csv' if run_args.get('mm_side', 'receiver') == 'receiver' else '_uplink.csv',),
+                 'runmm2.py' : lambda run_args: ('_uplink.csv', '_sender_RTT.npz') + (('_receiver_tput.npz',) if run_args.get('tcpinfo') is None else ())}
+
+
+def load_sweep(specpath):
+    '''Sweep spec from a JSON file, like
+
+      {"script": "runmm2.py", "dir": "output", "ttr": 60,
+       "trace": ["humanmotion", "walkandturn"],
+       "cc_algo": ["cubic", "bbr"],
+       "buf_len": {"humanmotion": [15400, 30800], "walkandturn": [26000, 52000]},
+       "mm_delay": [0, 10],
+       "blksize": [128],
+       "repetitions": 3,
+       "run_args": {"skip_seconds": 5}}
+
+    Every axis (trace, cc_algo, buf_len, mm_delay, blksize) is a list of
+    values or a single value; left out, it takes the default of the
+    script. 'buf_len' may also map each trace to its own list of buffer
+    sizes (e.g. multiples of the BDP of that trace). 'run_args' are
+    extra options of the script, as in scheduler.simulation_job().
+
+    '''
+    with open(specpath) as fin:
+        spec = json.load(fin)
+
+    spec.setdefault('script', 'runmm2.py')
+    spec.setdefault('dir', 'output')
+    spec.setdefault('repetitions', 1)
+    spec.setdefault('run_args', {})
+    if spec['script'] not in SWEEP_OUTPUTS:
+        raise ValueError('sweeps can run {} only'.format(' or '.join(sorted(SWEEP_OUTPUTS))))
+    if 'trace' not in spec:
+        raise ValueError('a sweep needs at least one trace')
+
+    return spec
+
+
+def expand_sweep(spec):
+    '''All runs of a sweep, as dicts of the Simulation parameters plus
+    'rep' (repetition, from 1), in the order trace x cc_algo x buf_len x
+    mm_delay x blksize x repetition.
+
+    '''
+    axes = []
+    for axis in SWEEP_AXES:
+        values = spec.get(axis, [None])
+        if not isinstance(values, (list, dict)):
+            values = [values]
+        axes.append(values)
+
+    runs = []
+    traces, rest = axes[0], axes[1:]
+    for trace in traces:
+        per_trace = list(rest)
+        if isinstance(per_trace[1], dict):
+            # buffer sizes per trace
+            per_trace[1] = per_trace[1][trace]
+        for values in itertools.product(*per_trace):
+            params = dict(zip(SWEEP_AXES, (trace,) + values))
+            params['ttr'] = spec.get('ttr')
+            for rep in range(1, spec['repetitions'] + 1):
+                runs.append(dict(params, rep=rep))
+
+    return runs
+
+
+def file_digest(filepath, chunksize=1<<20):
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as fin:
+        for chunk in iter(lambda: fin.read(chunksize), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def run_hash(spec, params, trace_digest):
+    '''Content hash of a run: the script, its parameters and options,
+    and the contents of the channel trace. Runs with the same hash
+    produce the same experiment.
+
+    '''
+    key = {'script' : spec['script'],
+           'params' : params,
+           'run_args' : spec['run_args'],
+           'trace_sha256' : trace_digest}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+class SweepLedger(object):
+
+    def __init__(self, dbpath):
+        '''
+        SQLite record of the runs of a sweep: one row per run (by
+        content hash) with its name, parameters, state ('pending',
+        'postprocessing', 'done' or 'failed'), attempts, times, return code and the sizes
+        of its output files when it completed.
+
+        Every call opens its own connection, so the ledger can be
+        updated from the scheduler's worker threads.
+
+        '''
+        self.dbpath = dbpath
+        self._lock = threading.Lock()
+        with self._connect() as con:
+            con.execute('''CREATE TABLE IF NOT EXISTS runs (
+                               hash TEXT PRIMARY KEY,
+                               name TEXT NOT NULL,
+                               params TEXT NOT NULL,
+                               state TEXT NOT NULL DEFAULT 'pending',
+                               attempts INTEGER NOT NULL DEFAULT 0,
+                               returncode INTEGER,
+                               started REAL,
+                               finished REAL,
+                               outputs TEXT)''')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # one transaction, committed unless it raises
+        import sqlite3
+
+        con = sqlite3.connect(self.dbpath, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def add(self, runhash, name, params):
+        # a run the ledger doesn't know yet starts out pending
+        with self._lock, self._connect() as con:
+            con.execute('INSERT OR IGNORE INTO runs (hash, name, params) VALUES (?, ?, ?)',
+                        (runhash, name, json.dumps(params, sort_keys=True)))
+
+    def get(self, runhash):
+        with self._lock, self._connect() as con:
+            row = con.execute('SELECT name, params, state, attempts, returncode, started, finished, outputs FROM runs WHERE hash = ?',
+                              (runhash,)).fetchone()
+        if row is None:
+            return None
+        return {'hash' : runhash, 'name' : row[0], 'params' : json.loads(row[1]), 'state' : row[2],
+                'attempts' : row[3], 'returncode' : row[4], 'started' : row[5], 'finished' : row[6],
+                'outputs' : json.loads(row[7]) if row[7] is not None else None}
+
+    def update(self, runhash, state, attempts=0, returncode=None, started=None, finished=None, outputs=None):
+        with self._lock, self._connect() as con:
+            con.execute('UPDATE runs SET state = ?, attempts = attempts + ?, returncode = ?, started = ?, finished = ?, outputs = ? WHERE hash = ?',
+                        (state, attempts, returncode, started, finished,
+                         json.dumps(outputs) if outputs is not None else None, runhash))
+
+    def find(self, name):
+        # hash of the run called 'name', None if there is none
+        with self._lock, self._connect() as con:
+            row = con.execute('SELECT hash FROM runs WHERE name = ?', (name,)).fetchone()
+        return row[0] if row is not None else None
+
+    def counts(self):
+        # number of runs per state
+        with self._lock, self._connect() as con:
+            return dict(con.execute('SELECT state, COUNT(*) FROM runs GROUP BY state').fetchall())
+
+
+def output_sizes(paths):
+    # sizes of the output files, None if one is missing or empty
+    sizes = {}
+    for path in paths:
+        try:
+            sizes[path] = os.path.getsize(path)
+        except OSError:
+            return None
+        if sizes[path] == 0:
+            return None
+    return sizes
+
+
+def verified(record, root='.'):
+    '''True if the ledger says the run is done and its output files are
+    all still there, with the sizes they had when it completed.
+
+    '''
+    if record is None or record['state'] != 'done' or not record['outputs']:
+        return False
+    sizes = output_sizes(os.path.join(root, path) for path in record['outputs'])
+    return sizes is not None and all(sizes[os.path.join(root, path)] == size for path, size in record['outputs'].items())
+
+
+def sweep_jobs(spec, ledger, root='.', timeout=None, retries=0, postprocess_queue=None):
+    '''Jobs (scheduler.Job) for the runs of a sweep that still have to
+    be done, registering them all in the ledger. Runs that completed
+    and whose outputs are still in place are skipped, all others
+    (failed, interrupted, missing or with changed outputs) are run
+    again. Each job carries its content hash ('job.hash') and output
+    files ('job.outputs').
+
+    root: top of the repository (where the scripts are)
+
+    postprocess_queue: path (from 'root') of the PostprocessQueue the
+    runs leave their post-processing in; a job then only checks for the
+    mm log, and runs still waiting for post-processing are not run
+    again
+
+    '''
+    import importlib
+
+    sys.path.insert(0, os.path.abspath(root))
+    Simulation = importlib.import_module(os.path.splitext(spec['script'])[0]).Simulation
+    outputs = SWEEP_OUTPUTS[spec['script']](spec['run_args'])
+
+    trace_digests = {}
+    jobs = []
+    for params in expand_sweep(spec):
+        trace = params['trace']
+        if trace not in trace_digests:
+            trace_digests[trace] = file_digest(os.path.join(root, 'traces', 'channels', trace))
+
+        kwargs = dict(ttr=params['ttr'], blksize=params['blksize'], cc_algo=params['cc_algo'], buf_len=params['buf_len'])
+        if params['mm_delay'] is not None:
+            if spec['script'] == 'runmm.py':
+                raise ValueError('runmm.py has no mm-delay, use runmm2.py for an mm_delay sweep')
+            kwargs['mm_delay'] = params['mm_delay']
+        sim = Simulation(trace, **kwargs)
+
+        runhash = run_hash(spec, params, trace_digests[trace])
+        # the output names of the scripts leave out the CC algorithm
+        suffix = [params['cc_algo']] if params['cc_algo'] is not None else []
+        if spec['repetitions'] > 1:
+            suffix.append('r{}'.format(params['rep']))
+        suffix = '_'.join(suffix) if suffix else None
+        job = simulation_job(sim, spec['dir'], suffix, timeout, retries, os.path.join(root, spec['script']),
+                             postprocess_queue=postprocess_queue, **spec['run_args'])
+
+        ledger.add(runhash, job.name, params)
+        record = ledger.get(runhash)
+        if verified(record, root):
+            continue
+        if postprocess_queue is not None and record['state'] == 'postprocessing':
+            continue
+
+        prefix = os.path.join(spec['dir'], sim.saveprefix(suffix))
+        job.hash = runhash
+        job.outputs = [prefix + ext for ext in outputs]
+        checked = job.outputs[:1] if postprocess_queue is not None else job.outputs
+        job.check = lambda job, checked=checked: output_sizes(os.path.join(root, path) for path in checked) is not None
+        jobs.append(job)
+
+    return jobs
+
+
+def run_sweep(specpath, workers=1, ledgerpath=None, root='.', timeout=None, retries=0, base_port=9999, dry_run=False, verbose=1,
+              postprocess_workers=0):
+    '''Run (or resume) the sweep in the spec file 'specpath' with up to
+    'workers' runs at a time, keeping track of every run in a SQLite
+    ledger (default: 'sweep.db' in the output directory of the sweep).
+    Returns the counts of runs per state in the ledger.
+
+    postprocess_workers: if not 0, post-process the runs in a pool of
+    this many processes (postprocess.PostprocessPool, with its queue in
+    'postprocess.db' in the output directory) while the next runs go
+    on; a run is done once its post-processing is
+
+    '''
+    spec = load_sweep(specpath)
+    outdir = os.path.join(root, spec['dir'])
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    if ledgerpath is None:
+        ledgerpath = os.path.join(outdir, 'sweep.db')
+    ledger = SweepLedger(ledgerpath)
+
+    queuepath = os.path.join(spec['dir'], 'postprocess.db') if postprocess_workers else None
+    jobs = sweep_jobs(spec, ledger, root, timeout, retries, queuepath)
+    # before anything runs, rather than each parallel run failing (and
+    # failing again on every resume)
+    check_concurrent(jobs, workers)
+    n_runs = len(expand_sweep(spec))
+    if verbose:
+        print('{} runs in the sweep, {} done, {} to run'.format(n_runs, n_runs - len(jobs), len(jobs)))
+    if dry_run:
+        return ledger.counts()
+
+    outputs = SWEEP_OUTPUTS[spec['script']](spec['run_args'])
+    pool = thread = None
+    if postprocess_workers:
+        from postprocess import PostprocessQueue, PostprocessPool
+
+        def postprocessed(task, state, paths):
+            runhash = ledger.find(os.path.basename(task['savepathprefix']))
+            if runhash is None:
+                return
+            record = ledger.get(runhash)
+            prefix = os.path.join(spec['dir'], record['name'])
+            sizes = output_sizes(os.path.join(root, prefix + ext) for ext in outputs) if state == 'done' else None
+            ledger.update(runhash, 'done' if sizes is not None else 'failed', 0, record['returncode'],
+                          record['started'], time.time(),
+                          {prefix + ext : sizes[os.path.join(root, prefix + ext)] for ext in outputs} if sizes is not None else None)
+
+        pool = PostprocessPool(PostprocessQueue(os.path.join(root, queuepath)), postprocess_workers, verbose=verbose, callback=postprocessed)
+        # the pool also finishes what an interrupted sweep left queued
+        thread = threading.Thread(target=pool.run, args=(True,), daemon=True)
+        thread.start()
+    elif not jobs:
+        return ledger.counts()
+
+    t0 = time.time()
+
+    def record(job, res):
+        if pool is not None and res['status'] == 'ok':
+            ledger.update(job.hash, 'postprocessing', res['attempts'], res['returncode'], time.time() - res['elapsed'])
+            return
+        sizes = output_sizes(os.path.join(root, path) for path in job.outputs) if res['status'] == 'ok' else None
+        ledger.update(job.hash, 'done' if sizes is not None else 'failed', res['attempts'], res['returncode'],
+                      time.time() - res['elapsed'], time.time(),
+                      {path : sizes[os.path.join(root, path)] for path in job.outputs} if sizes is not None else None)
+
+    try:
+        if jobs:
+            run_jobs(jobs, workers, base_port, os.path.join(outdir, 'logs'), verbose=verbose, callback=record)
+    finally:
+        if pool is not None:
+            if verbose:
+                print('Waiting for post-processing to finish ...', flush=True)
+            pool.stop()
+            thread.join()
+        if verbose:
+            print('Ledger ({:.0f} s): {}'.format(time.time() - t0, ledger.counts()))
+
+    return ledger.counts()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run or resume a parameter sweep of simulations')
+    parser.add_argument('spec', help='Sweep spec (JSON)')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='Runs at a time (default: 1)')
+    parser.add_argument('--ledger', help='SQLite ledger of the sweep (default: sweep.db in its output directory)')
+    parser.add_argument('--timeout', type=float, help='Seconds after which a run is killed (default: no limit)')
+    parser.add_argument('--retries', type=int, default=0, help='Times to retry a run that fails or times out (default: 0)')
+    parser.add_argument('--base-port', type=int, default=9999, help='Port of the first run slot (default: 9999)')
+    parser.add_argument('--dry-run', '-n', action='store_true', help='Only show how many runs are left')
+    parser.add_argument('--postprocess', '-P', type=int, default=0, metavar='K',
+                        help='Post-process runs in K processes while the next runs go on (default: after each run)')
+    args = parser.parse_args()
+
+    run_sweep(args.spec, args.jobs, args.ledger, os.path.dirname(os.path.abspath(__file__)), args.timeout, args.retries, args.base_port, args.dry_run,
+              postprocess_workers=args.postprocess)
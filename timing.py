@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import contextlib
+
+# the timer spans go to while one is active (see RunTimer.activate())
+_active = None
+
+
+def rusage():
+    '''CPU time (s), peak RSS (MB) and block I/O (bytes) of this process
+    ('self') and of its children that have exited ('children').
+
+    '''
+    import resource
+
+    usage = {}
+    for who, name in ((resource.RUSAGE_SELF, 'self'), (resource.RUSAGE_CHILDREN, 'children')):
+        ru = resource.getrusage(who)
+        # ru_maxrss is in KiB on Linux, blocks are 512 bytes
+        usage[name] = {'user_s' : ru.ru_utime, 'sys_s' : ru.ru_stime, 'maxrss_mb' : ru.ru_maxrss / 1024.0,
+                       'read_bytes' : ru.ru_inblock * 512, 'written_bytes' : ru.ru_oublock * 512}
+    return usage
+
+
+def rusage_delta(before, after):
+    # what was used between two rusage(), without the peak RSS (a peak
+    # so far, which doesn't subtract)
+    delta = {}
+    for who in after:
+        delta[who] = {key : value - before[who][key] for key, value in after[who].items() if key != 'maxrss_mb'}
+    return delta
+
+
+class RunTimer(object):
+
+    def __init__(self):
+        '''
+        Hierarchical wall-clock spans of the phases of a run, each with
+        the CPU time and block I/O of this process and of its children
+        that exited during it. Nested spans are named by their path
+        ('postprocess/plot/render').
+
+        Code that runs inside activate() records its spans with the
+        module-level span(), which does nothing when no timer is active,
+        so the plot and parse functions can be instrumented whether or
+        not anyone is timing them.
+
+        '''
+        self.t0 = time.monotonic()
+        self.started = time.time()
+        self.spans = []
+        self._stack = []
+
+    @contextlib.contextmanager
+    def span(self, name):
+        path = '/'.join(self._stack + [name])
+        self._stack.append(name)
+        start = time.monotonic()
+        before = rusage()
+        status = 'failed'
+        try:
+            yield
+            status = 'ok'
+        finally:
+            self._stack.pop()
+            self.add(path, start - self.t0, time.monotonic() - start, status, rusage_delta(before, rusage()))
+
+    def add(self, path, start, seconds, status='ok', usage=None):
+        # a span timed elsewhere (e.g. the phases of a Supervisor), with
+        # its start in seconds since the timer was made
+        self.spans.append({'name' : path, 'start' : round(start, 6), 'seconds' : round(seconds, 6), 'status' : status,
+                           'rusage' : usage})
+
+    @contextlib.contextmanager
+    def activate(self):
+        global _active
+        previous, _active = _active, self
+        try:
+            yield self
+        finally:
+            _active = previous
+
+    def report(self):
+        lines = ['Timing:']
+        for span in sorted(self.spans, key=lambda span: span['start']):
+            depth = span['name'].count('/')
+            name = '  ' * depth + span['name'].rsplit('/', 1)[-1]
+            lines.append('  {:<28s} {:<8s} {:8.3f} s'.format(name, span['status'], span['seconds']))
+        return '\n'.join(lines)
+
+
+def span(name):
+    '''Time the body of a 'with' as span 'name' of the active RunTimer
+    (nested in the spans around it), if there is one.
+
+    '''
+    if _active is None:
+        return contextlib.nullcontext()
+    return _active.span(name)
+
+
+@contextlib.contextmanager
+def profiled(pstatspath):
+    '''Run the body under cProfile and dump its stats to 'pstatspath'
+    (e.g. for 'python -m pstats'), if it is not None.
+
+    '''
+    if pstatspath is None:
+        yield
+        return
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(pstatspath)
+        print('Profile saved to "{}"'.format(pstatspath))
+
+
+def _save_manifest(path, manifest):
+    # all at once, readers never see half a manifest
+    tmppath = path + '.tmp'
+    with open(tmppath, 'w') as fout:
+        json.dump(manifest, fout, indent=1, default=str)
+    os.replace(tmppath, path)
+
+
+def write_manifest(path, timer, **info):
+    '''Write the run manifest 'path' (JSON): the spans of 'timer', the
+    rusage of this process and of all its children together (the
+    kernel only accounts for children in aggregate), how it was
+    started, and whatever else is given in 'info' (settings,
+    processes, status).
+
+    '''
+    import platform
+
+    manifest = {'argv' : sys.argv, 'cwd' : os.getcwd(), 'host' : platform.node(), 'python' : platform.python_version(),
+                'started' : timer.started, 'seconds' : round(time.monotonic() - timer.t0, 6)}
+    manifest.update(info)
+    manifest['spans'] = timer.spans
+    manifest['rusage'] = rusage()
+
+    _save_manifest(path, manifest)
+    return manifest
+
+
+def update_manifest(path, timer, **info):
+    '''Add the spans of 'timer' and 'info' to the manifest 'path', e.g.
+    for post-processing done later by another process. Starts a
+    manifest if there is none.
+
+    '''
+    if not os.path.exists(path):
+        return write_manifest(path, timer, **info)
+
+    with open(path) as fin:
+        manifest = json.load(fin)
+    # spans start from the timer of the run
+    offset = timer.started - manifest['started']
+    for span in timer.spans:
+        manifest['spans'].append(dict(span, start=round(span['start'] + offset, 6)))
+    manifest.update(info)
+
+    _save_manifest(path, manifest)
+    return manifest
+
+
+@contextlib.contextmanager
+def instrumented(manifestpath, name, profile=False, pstatspath=None, **info):
+    '''For the command line tools: time the body as span 'name' (under
+    cProfile with 'profile', its stats next to the manifest as
+    '<name>.pstats') and write the manifest 'manifestpath' once it is
+    done. Does nothing if 'manifestpath' is None.
+
+    pstatspath: stats made elsewhere (e.g. by worker processes, when
+    profiling this process would only show it waiting for them), to
+    point to from the manifest
+
+    '''
+    if manifestpath is None:
+        yield None
+        return
+
+    timer = RunTimer()
+    profilepath = os.path.join(os.path.dirname(manifestpath), name + '.pstats') if profile else None
+    status = 'failed'
+    try:
+        with timer.activate(), timer.span(name), profiled(profilepath):
+            yield timer
+        status = 'ok'
+    finally:
+        write_manifest(manifestpath, timer, status=status, profile=profilepath or pstatspath, **info)
+        print('Manifest saved to "{}"'.format(manifestpath))